@@ -0,0 +1,149 @@
+import os, re, gzip, time, shutil, sqlite3, logging
+from datetime import datetime
+import db
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(db.DB_PATH) or ".", "backups"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))                      # snapshots kept in BACKUP_DIR
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))  # 0 disables scheduled snapshots
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "1") == "1"
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "1024"))       # pages copied per backup step
+CHUNK = 1 << 20
+
+NAME_RE = re.compile(r"^manager-\d{8}T\d{6}Z(-[a-z]+)?\.db(\.gz)?$")
+
+log = logging.getLogger("myst.backup")
+
+def copy_to(path: str):
+    """Consistent copy of the live database into `path`, without blocking writers.
+
+    The source holds one read transaction for the whole copy: in WAL mode that pins a snapshot
+    and writers carry on, and the stepped copy never restarts because the source cannot change
+    under it (without the pin, a busy collector restarts the backup on every commit)."""
+    src = db.connect(); dst = sqlite3.connect(path)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=BACKUP_STEP_PAGES, sleep=0.001)
+        src.rollback()
+        dst.execute("PRAGMA journal_mode=DELETE")  # a self-contained single file, no -wal next to it
+    finally:
+        dst.close(); src.close()
+
+def _gzip(path: str, out: str):
+    with open(path, "rb") as f, gzip.open(out, "wb", compresslevel=6) as g:
+        shutil.copyfileobj(f, g, CHUNK)
+
+def snapshot(compress: bool = BACKUP_COMPRESS, tag: str = "") -> dict:
+    """Write a new snapshot into BACKUP_DIR and prune the oldest beyond BACKUP_KEEP."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = f"manager-{datetime.utcnow():%Y%m%dT%H%M%SZ}{'-' + tag if tag else ''}.db" + (".gz" if compress else "")
+    final = os.path.join(BACKUP_DIR, name)
+    raw = final + ".tmp"
+    t0 = time.monotonic()
+    try:
+        copy_to(raw)
+        if compress:
+            _gzip(raw, raw + ".gz"); os.remove(raw); os.replace(raw + ".gz", final)
+        else:
+            os.replace(raw, final)
+    finally:
+        for p in (raw, raw + ".gz"):
+            if os.path.exists(p): os.remove(p)
+    prune()
+    return {"name": name, "size": os.path.getsize(final), "duration": round(time.monotonic() - t0, 3)}
+
+def list_snapshots() -> list:
+    if not os.path.isdir(BACKUP_DIR): return []
+    out = []
+    for name in os.listdir(BACKUP_DIR):
+        if NAME_RE.match(name):
+            st = os.stat(os.path.join(BACKUP_DIR, name))
+            out.append({"name": name, "size": st.st_size, "created": datetime.utcfromtimestamp(st.st_mtime).isoformat(timespec="seconds")})
+    return sorted(out, key=lambda s: s["name"], reverse=True)
+
+def prune(keep: int = BACKUP_KEEP):
+    if keep <= 0: return
+    for s in list_snapshots()[keep:]:
+        os.remove(os.path.join(BACKUP_DIR, s["name"]))
+
+def path_of(name: str) -> str:
+    if not NAME_RE.match(name): raise ValueError("not a snapshot name")
+    p = os.path.join(BACKUP_DIR, name)
+    if not os.path.exists(p): raise FileNotFoundError(name)
+    return p
+
+def maintain():
+    """Scheduler job: take a snapshot once the newest one is older than BACKUP_INTERVAL_HOURS."""
+    if BACKUP_INTERVAL_HOURS <= 0: return
+    snaps = list_snapshots()
+    newest = os.path.getmtime(os.path.join(BACKUP_DIR, snaps[0]["name"])) if snaps else 0
+    if time.time() - newest >= BACKUP_INTERVAL_HOURS * 3600:
+        s = snapshot(tag="auto")
+        log.info("backup %s written (%d bytes, %.1fs)", s["name"], s["size"], s["duration"])
+
+def _read(path: str, compress: bool = False, remove: bool = False):
+    z = gzip.zlib.compressobj(6, gzip.zlib.DEFLATED, 31) if compress else None
+    try:
+        with open(path, "rb") as f:
+            while True:
+                buf = f.read(CHUNK)
+                if not buf: break
+                if z: buf = z.compress(buf)
+                if buf: yield buf
+        if z: yield z.flush()
+    finally:
+        if remove: os.remove(path)
+
+def stream_live(compress: bool = False):
+    """Fresh consistent snapshot for download; the temporary copy is removed once streamed."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    tmp = os.path.join(BACKUP_DIR, f".download-{os.getpid()}-{time.monotonic_ns()}.db")
+    try:
+        copy_to(tmp)
+    except Exception:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    return _read(tmp, compress=compress, remove=True)
+
+def stream_file(name: str):
+    return _read(path_of(name))
+
+def _check(path: str) -> str:
+    c = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        res = [r[0] for r in c.execute("PRAGMA integrity_check")]
+        if res != ["ok"]: return "integrity_check: " + "; ".join(res[:5])
+        if not c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='nodes'").fetchone():
+            return "not a panel database (no nodes table)"
+        return ""
+    except sqlite3.DatabaseError as e:
+        return str(e)
+    finally:
+        c.close()
+
+def restore(f) -> dict:
+    """Replace the live database with the snapshot in binary file object `f` (.db or .db.gz).
+
+    The candidate must pass PRAGMA integrity_check. The current database is snapshotted first,
+    then the candidate is copied into the live file through the backup API, so open connections
+    stay valid and see the restored data; pending migrations run afterwards."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    cand = os.path.join(BACKUP_DIR, f".restore-{os.getpid()}-{time.monotonic_ns()}.db")
+    try:
+        head = f.read(2); f.seek(0)
+        src = gzip.GzipFile(fileobj=f, mode="rb") if head == b"\x1f\x8b" else f
+        with open(cand, "wb") as out:
+            try: shutil.copyfileobj(src, out, CHUNK)
+            except (OSError, EOFError) as e: raise ValueError(f"cannot read upload: {e}")
+        problem = _check(cand)
+        if problem: raise ValueError(f"snapshot rejected, nothing was changed: {problem}")
+        before = snapshot(tag="prerestore")
+        src_c = sqlite3.connect(cand); live = db.connect()
+        try:
+            src_c.backup(live)  # one step: readers see either the old or the new database
+        finally:
+            live.close(); src_c.close()
+        db.db_init()
+        return {"restored": True, "previous": before["name"]}
+    finally:
+        if os.path.exists(cand): os.remove(cand)
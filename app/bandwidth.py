@@ -0,0 +1,78 @@
+import os, json, math
+from typing import Optional
+
+BANDWIDTH_MAX_GAP = float(os.getenv("BANDWIDTH_MAX_GAP", "3600"))  # seconds; longer gaps between samples give no rate
+HIST_MIN = 0.01   # Mbps; bin 0 holds everything below this
+HIST_STEPS = 4    # bins per doubling, so a quantile read off the histogram is within ~19% (one bin) of the true value
+
+# One sample from the node: its clock, boot id and default-route interface, then /proc/net/dev.
+COMMAND = ("echo \"now $(date +%s.%N)\"; echo \"boot $(cat /proc/sys/kernel/random/boot_id 2>/dev/null)\"; "
+           "echo \"dev $(ip route show default 2>/dev/null | awk '{for(i=1;i<NF;i++) if($i==\"dev\"){print $(i+1); exit}}')\"; "
+           "cat /proc/net/dev")
+
+def parse(out: str) -> Optional[dict]:
+    """{"t", "boot", "iface", "rx", "tx"} from COMMAND output; the default-route interface, or every non-loopback
+    interface summed when there is none. None if the output has no counters."""
+    head, ifaces = {}, {}
+    for line in (out or "").splitlines():
+        if ":" in line and "|" not in line:
+            name, _, rest = line.partition(":")
+            f = rest.split()
+            if len(f) >= 9 and f[0].isdigit() and f[8].isdigit():
+                ifaces[name.strip()] = (int(f[0]), int(f[8]))
+            continue
+        k, _, v = line.partition(" ")
+        if k in ("now", "boot", "dev"): head[k] = v.strip()
+    if not ifaces: return None
+    try: t = float(head.get("now", ""))
+    except ValueError: t = None  # date without %N support; the caller falls back to the panel clock
+    dev = head.get("dev") or ""
+    if dev in ifaces:
+        rx, tx = ifaces[dev]
+    else:
+        dev = "+".join(sorted(k for k in ifaces if k != "lo"))
+        rx = sum(v[0] for k, v in ifaces.items() if k != "lo"); tx = sum(v[1] for k, v in ifaces.items() if k != "lo")
+    return {"t": t, "boot": head.get("boot") or "", "iface": dev, "rx": rx, "tx": tx}
+
+def _delta(prev: int, cur: int) -> Optional[int]:
+    if cur >= prev: return cur - prev
+    if prev < 2 ** 32 and prev - cur > 2 ** 31: return cur + 2 ** 32 - prev  # 32-bit counter wrapped
+    return None  # counter reset
+
+def rate(prev: Optional[dict], cur: Optional[dict]) -> Optional[float]:
+    """Mbps between two samples of the same interface and boot; None across a reboot, an interface change,
+    a counter reset or a gap longer than BANDWIDTH_MAX_GAP."""
+    if not prev or not cur or prev.get("t") is None or cur.get("t") is None: return None
+    if prev.get("iface") != cur["iface"] or prev.get("boot") != cur["boot"]: return None
+    dt = cur["t"] - prev["t"]
+    if dt <= 0 or dt > BANDWIDTH_MAX_GAP: return None
+    drx, dtx = _delta(prev["rx"], cur["rx"]), _delta(prev["tx"], cur["tx"])
+    if drx is None or dtx is None: return None
+    return round((drx + dtx) * 8 / dt / 1e6, 3)
+
+# Rollup histograms: {"bin": count} on a log scale, mergeable by adding counts.
+def hist_bin(mbps: float) -> int:
+    return 0 if mbps < HIST_MIN else 1 + int(math.floor(HIST_STEPS * math.log2(mbps / HIST_MIN)))
+
+def hist_add(h: dict, mbps: float, n: int = 1) -> dict:
+    b = str(hist_bin(mbps)); h[b] = h.get(b, 0) + n
+    return h
+
+def hist_merge(a: dict, b: dict) -> dict:
+    for k, v in b.items(): a[k] = a.get(k, 0) + v
+    return a
+
+def hist_load(text: Optional[str]) -> dict:
+    try: return json.loads(text) if text else {}
+    except ValueError: return {}
+
+def hist_quantile(h: dict, q: float) -> Optional[float]:
+    """Upper edge of the bin holding the q-quantile, so p95 errs high rather than low."""
+    total = sum(h.values())
+    if not total: return None
+    need = q * total; seen = 0
+    for b in sorted(h, key=int):
+        seen += h[b]
+        if seen >= need:
+            return 0.0 if b == "0" else round(HIST_MIN * 2 ** (int(b) / HIST_STEPS), 3)
+    return None
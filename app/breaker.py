@@ -0,0 +1,67 @@
+import os, time
+from db import db_conn
+
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))          # consecutive failed collects before a node is skipped
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "300"))        # seconds skipped; doubles after each failed trial
+BREAKER_COOLDOWN_MAX = float(os.getenv("BREAKER_COOLDOWN_MAX", "3600"))
+
+# closed: collected normally (the row only counts failures); open: skipped until retry_at;
+# half_open: one trial collect is in flight, its result closes or re-opens the breaker.
+
+def cooldown(failures: int) -> float:
+    return min(BREAKER_COOLDOWN * 2 ** max(0, failures - BREAKER_THRESHOLD), BREAKER_COOLDOWN_MAX)
+
+def split(nodes, now: float = None) -> tuple:
+    """(allowed, skipped): nodes whose breaker is open are skipped until retry_at; the first caller after that
+    gets the node as its half-open trial, and concurrent sweeps keep skipping it until the trial reports."""
+    now = now or time.time()
+    ids = [n["id"] for n in nodes]
+    state = {}
+    with db_conn() as c:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            state.update((r["node_id"], dict(r)) for r in c.execute(
+                f"SELECT node_id, state, failures, retry_at FROM node_breaker WHERE state!='closed' AND node_id IN ({','.join('?' * len(chunk))})", chunk))
+        trial = [b["node_id"] for b in state.values() if b["retry_at"] <= now]
+        # half-open trials hold the node for one more cool-down in case the trial never reports back
+        c.executemany("UPDATE node_breaker SET state='half_open', retry_at=? WHERE node_id=? AND retry_at<=?",
+                      [(now + cooldown(state[i]["failures"]), i, now) for i in trial])
+    trial = set(trial)
+    allowed = [n for n in nodes if n["id"] not in state or n["id"] in trial]
+    skipped = [n for n in nodes if n["id"] in state and n["id"] not in trial]
+    return allowed, skipped
+
+def record(c, results, now: float = None):
+    """Fold collect results into the breakers; runs in the caller's transaction. An ok result closes the breaker,
+    BREAKER_THRESHOLD failures in a row open it. Also pushes the node's next scheduled poll past retry_at."""
+    now = now or time.time()
+    results = [r for r in results if r.get("status") in ("ok", "failed", "timeout")]
+    ok = [(r["id"],) for r in results if r["status"] == "ok"]
+    if ok: c.executemany("DELETE FROM node_breaker WHERE node_id=?", ok)
+    bad = [r for r in results if r["status"] != "ok"]
+    if not bad: return
+    ids = [r["id"] for r in bad]
+    prev = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        prev.update((r["node_id"], r["failures"]) for r in c.execute(
+            f"SELECT node_id, failures FROM node_breaker WHERE node_id IN ({','.join('?' * len(chunk))})", chunk))
+    rows = []
+    for r in bad:
+        failures = prev.get(r["id"], 0) + 1; prev[r["id"]] = failures
+        opened = failures >= BREAKER_THRESHOLD
+        rows.append({"node_id": r["id"], "state": "open" if opened else "closed", "failures": failures,
+                     "retry_at": now + cooldown(failures) if opened else 0, "last_error": (r.get("error") or r["status"])[:500],
+                     "updated": now})
+    c.executemany("""INSERT INTO node_breaker(node_id, state, failures, retry_at, last_error, updated)
+                     VALUES(:node_id,:state,:failures,:retry_at,:last_error,:updated)
+                     ON CONFLICT(node_id) DO UPDATE SET state=excluded.state, failures=excluded.failures,
+                     retry_at=excluded.retry_at, last_error=excluded.last_error, updated=excluded.updated""", rows)
+    c.executemany("UPDATE node_schedule SET next_run=MAX(next_run, :retry_at) WHERE node_id=:node_id",
+                  [r for r in rows if r["state"] == "open"])
+
+def defer(node_ids):
+    """Move skipped nodes' next scheduled poll to their breaker's retry time."""
+    with db_conn() as c:
+        c.executemany("""UPDATE node_schedule SET next_run=MAX(next_run, (SELECT retry_at FROM node_breaker b
+                         WHERE b.node_id=node_schedule.node_id)) WHERE node_id=?""", [(i,) for i in node_ids])
@@ -0,0 +1,91 @@
+"""Headless entry point for cron and systemd timers; run from the app directory like main.py:
+
+    python -m cli collect --all | --tag TAG | --node ID...
+    python -m cli export [--format json|ndjson|csv] [--sections ...] [--start ISO] [--end ISO] [--node ID...] [--gzip] [-o FILE]
+    python -m cli backup [-o FILE] [--gzip]
+
+Nothing beyond the standard library is imported until a command needs it: export and backup only open
+SQLite, collect loads paramiko. Settings come from the environment and ENV_FILE, as for the panel."""
+import os, sys, json, argparse
+
+ENV_FILE = os.getenv("ENV_FILE", "/opt/myst-manager/.env")
+
+def _load_env(path: str):
+    # the panel gets this file from systemd's EnvironmentFile; values already in the environment win
+    if not os.path.exists(path): return
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=path, override=False)
+
+def _out(path: str):
+    return sys.stdout.buffer if path == "-" else open(path, "wb")
+
+def cmd_collect(a) -> int:
+    import core, sshpool, tequilapi
+    try:
+        summary = core.collect() if a.all else core.collect(a.tag, a.node)
+    finally:
+        tequilapi.close_all(); sshpool.pool.close_all()
+    if not a.verbose:
+        summary = dict(summary, nodes=[r for r in summary["nodes"] if r["status"] not in ("ok", "skipped")])
+    print(json.dumps(summary))
+    return 0
+
+def cmd_export(a) -> int:
+    import core
+    _, _, chunks = core.export(a.format, a.sections, a.start, a.end, a.node or (), a.gzip)
+    f = _out(a.output)
+    try:
+        for chunk in chunks: f.write(chunk)
+    finally:
+        if f is not sys.stdout.buffer: f.close()
+    return 0
+
+def cmd_backup(a) -> int:
+    import backup
+    if a.output is None:
+        print(json.dumps(backup.snapshot(**({} if a.gzip is None else {"compress": a.gzip}))))
+        return 0
+    f = _out(a.output)
+    try:
+        for chunk in backup.stream_live(compress=bool(a.gzip)): f.write(chunk)
+    finally:
+        if f is not sys.stdout.buffer: f.close()
+    return 0
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="python -m cli", description="MysteriumNET panel without the web app")
+    sub = p.add_subparsers(dest="command", required=True)
+    c = sub.add_parser("collect", help="collect node status over SSH and store it as the panel does")
+    g = c.add_mutually_exclusive_group(required=True)
+    g.add_argument("--all", action="store_true", help="every node (Collect All)")
+    g.add_argument("--tag", help="nodes carrying this tag")
+    g.add_argument("--node", type=int, action="append", help="node id; repeatable")
+    c.add_argument("-v", "--verbose", action="store_true", help="list every node in the summary, not only failures")
+    c.set_defaults(fn=cmd_collect)
+    e = sub.add_parser("export", help="write the same export as GET /export")
+    e.add_argument("--format", choices=("json", "ndjson", "csv"), default="json")
+    e.add_argument("--sections", help="comma-separated: wallets,nodes,acls,settings,metrics")
+    e.add_argument("--start"); e.add_argument("--end")
+    e.add_argument("--node", type=int, action="append", help="node id for metrics; repeatable")
+    e.add_argument("--gzip", action="store_true")
+    e.add_argument("-o", "--output", default="-", help="file, or - for stdout (default)")
+    e.set_defaults(fn=cmd_export)
+    b = sub.add_parser("backup", help="snapshot the database into BACKUP_DIR, or write a copy to --output")
+    b.add_argument("-o", "--output", help="file, or - for stdout; without it a rotated snapshot is kept in BACKUP_DIR")
+    b.add_argument("--gzip", action=argparse.BooleanOptionalAction, default=None, help="default: BACKUP_COMPRESS for snapshots, off for --output")
+    b.set_defaults(fn=cmd_backup)
+    return p
+
+def main(argv=None) -> int:
+    a = parser().parse_args(argv)
+    _load_env(ENV_FILE)
+    import db
+    db.db_init()
+    try:
+        return a.fn(a)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+import os, json, time, socket
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import bandwidth, breaker, exporter, preflight, probe, rollups, sessions, tequilapi
+from db import db_conn, set_setting
+from sshpool import node_exec
+
+COLLECT_MODE = os.getenv("COLLECT_MODE", "batch")  # batch: one probe round-trip, legacy: one channel per command
+COLLECT_CONCURRENCY = int(os.getenv("COLLECT_CONCURRENCY", "32"))
+COLLECT_NODE_DEADLINE = float(os.getenv("COLLECT_NODE_DEADLINE", "60"))  # seconds per node, all commands included
+
+class DeadlineExceeded(Exception):
+    pass
+
+def _remaining(deadline: float) -> float:
+    left = deadline - time.monotonic()
+    if left <= 0: raise DeadlineExceeded("node deadline exceeded")
+    return left
+
+def _run_commands(n: dict, cmds: dict, deadline: float) -> dict:
+    data = {}
+    if COLLECT_MODE == "batch":
+        try:
+            left = _remaining(deadline)
+            return probe.run(lambda cmd, **kw: node_exec(n, cmd, connect_timeout=min(25, left), **kw),
+                             cmds, timeout=int(max(1, min(20, left - 10))))
+        except probe.ProbeError:
+            pass  # node without mktemp/base64/timeout: fall back to one command per channel
+    for k, cmd in cmds.items():
+        left = _remaining(deadline)
+        try:
+            rc, out, err = node_exec(n, cmd, timeout=min(25, left), connect_timeout=min(25, left))
+            data[k] = {"rc": rc, "out": out.strip(), "err": err.strip()}
+        except socket.timeout:
+            raise
+        except Exception as e:
+            data[k] = {"rc": 255, "out": "", "err": str(e)}
+    return data
+
+def _api_json(n: dict, api_port: int, path: str, timeout: float):
+    if tequilapi.TEQUILAPI_MODE != "curl" and not tequilapi.denied(n):
+        return tequilapi.get_json(n, path, timeout=timeout)
+    cmd = probe.api_commands(api_port, {"api_sessions": path})["api_sessions"]
+    rc, out, err = node_exec(n, cmd, timeout=timeout + 5, connect_timeout=timeout + 5)
+    return json.loads(out)
+
+def _session_pages(n: dict, api_port: int, sec: dict, cur, deadline: float):
+    # pages after the first; a walk cut short leaves the session cursor where it was
+    try: items, pages = sessions.parse(sec.get("out", ""))
+    except ValueError: return
+    page, timeout = 1, probe.API_ENDPOINTS["api_sessions"][1]
+    while page < pages:
+        try:
+            more, _ = sessions.parse(_api_json(n, api_port, sessions.path(cur, page + 1), min(timeout, _remaining(deadline))))
+        except Exception:
+            break
+        items += more; page += 1
+    sec["out"] = json.dumps(items); sec["complete"] = page >= pages
+
+def fetch_api(n: dict, api_port: int, deadline: float, paths: dict = None) -> dict:
+    """TequilAPI sections for one node: over an SSH-forwarded channel, or with curl on the node (TEQUILAPI_MODE=curl,
+    or sshd refusing forwarding)."""
+    if tequilapi.TEQUILAPI_MODE != "curl":
+        try:
+            left = _remaining(deadline)
+            return tequilapi.fetch(n, api_port, deadline, connect_timeout=min(25, left), paths=paths)
+        except tequilapi.ForwardingDenied:
+            pass
+        except (DeadlineExceeded, socket.timeout):
+            raise
+        except Exception as e:
+            return {k: {"rc": 255, "out": "", "err": str(e)} for k in probe.API_ENDPOINTS}
+    return _run_commands(n, probe.api_commands(api_port, paths), deadline)
+
+def _new_sessions(data: dict):
+    sec = data.get("api_sessions") or {}
+    if sec.get("rc") != 0 or not sec.get("out"): return [], False
+    try: items, pages = sessions.parse(sec["out"])
+    except ValueError: return [], False
+    return items, sec.get("complete", pages <= 1)
+
+def summarize(data: dict) -> dict:
+    # session count and bytes are running totals kept by sessions.ingest(); store_results() fills them in
+    data["sessions"] = {"count": 0, "bytes": 0}
+    # the rate needs the previous sample, so store_results() fills in mbps
+    sample = None
+    try: sample = bandwidth.parse(data.get("netdev",{}).get("out",""))
+    except Exception: pass
+    data["bandwidth"] = {"mbps": 0.0, "sample": sample}
+    nat_type = ""
+    try:
+        nat_out = data.get("api_nat",{}).get("out","")
+        nat_type = (json.loads(nat_out).get("type") if nat_out else "") or ""
+    except Exception: pass
+    data["nat"] = {"type": nat_type}
+    ids, services = [], []
+    try:
+        obj = json.loads(data.get("api_identities",{}).get("out","") or "{}")
+        ids = [i.get("id","") for i in obj.get("identities") or [] if isinstance(i, dict)] if isinstance(obj, dict) else []
+    except Exception: pass
+    try:
+        obj = json.loads(data.get("api_services",{}).get("out","") or "[]")
+        services = [{"type": s.get("type",""), "status": s.get("status","")} for s in obj if isinstance(s, dict)] if isinstance(obj, list) else []
+    except Exception: pass
+    data["identity"] = {"ids": ids}
+    data["services"] = {"items": services}
+    return data
+
+def collect_node(n: dict, deadline_s: float = COLLECT_NODE_DEADLINE) -> dict:
+    """Collect one node. Returns {"id", "status": ok|failed|timeout, "duration", "error", "ts", "data"}."""
+    t0 = time.monotonic(); deadline = t0 + deadline_s
+    res = {"id": n["id"], "host": n.get("host"), "capacity_mbps": n.get("capacity_mbps"), "status": "ok", "error": "", "data": None}
+    api_port = n.get("api_port") or 4050
+    tunnel = tequilapi.TEQUILAPI_MODE != "curl"
+    cur = sessions.cursor(n["id"])
+    paths = {"api_sessions": sessions.path(cur)}  # sessions are asked for from the node's session cursor on
+    cmds = probe.commands(api_port, api=not tunnel, paths=paths)
+    sections = list(cmds) + (list(probe.API_ENDPOINTS) if tunnel else [])
+    try:
+        data = _run_commands(n, cmds, deadline)
+        if all(v.get("rc") == 255 for v in data.values()):
+            res["status"] = "failed"; res["error"] = next(iter(data.values())).get("err", "")
+            data.update({k: {"rc": 255, "out": "", "err": res["error"]} for k in sections if k not in data})
+        else:
+            if tunnel: data.update(fetch_api(n, api_port, deadline, paths))
+            if data["api_sessions"]["rc"] == 0: _session_pages(n, api_port, data["api_sessions"], cur, deadline)
+    except (DeadlineExceeded, socket.timeout) as e:
+        res["status"] = "timeout"; res["error"] = str(e) or "timed out"
+        data = {k: {"rc": 255, "out": "", "err": res["error"]} for k in sections}
+    except Exception as e:
+        res["status"] = "failed"; res["error"] = str(e)
+        data = {k: {"rc": 255, "out": "", "err": str(e)} for k in sections}
+    res["data"] = summarize(data)
+    res["ts"] = datetime.utcnow().isoformat()
+    res["duration"] = round(time.monotonic() - t0, 3)
+    return res
+
+def unreachable(n: dict, error: str) -> dict:
+    """collect_node()'s failed result for a node the pre-flight could not reach, without any SSH work."""
+    sections = list(probe.commands(api=False)) + list(probe.API_ENDPOINTS)
+    return {"id": n["id"], "host": n.get("host"), "capacity_mbps": n.get("capacity_mbps"), "status": "failed",
+            "error": f"unreachable: {error}", "data": summarize({k: {"rc": 255, "out": "", "err": error} for k in sections}),
+            "ts": datetime.utcnow().isoformat(), "duration": 0.0}
+
+def status_row(r: dict) -> dict:
+    d = r["data"]
+    net = d["bandwidth"].get("sample") or {}
+    api_ok = ((d.get("api_health") or {}).get("out","") or "").strip() != ""
+    running = ("myst-node" in (d.get("docker") or {}).get("out","")) or api_ok
+    return {"node_id": r["id"], "running": 1 if running else 0, "api_ok": 1 if api_ok else 0,
+            "sessions": d["sessions"]["count"], "bytes_total": d["sessions"]["bytes"], "mbps": d["bandwidth"]["mbps"],
+            "nat_type": d["nat"]["type"], "ts": r["ts"], "status": r.get("status", "ok"),
+            "duration": r.get("duration"), "host": r.get("host"), "capacity_mbps": r.get("capacity_mbps"),
+            "net_t": net.get("t"), "net_boot": net.get("boot"), "net_iface": net.get("iface"), "rx_bytes": net.get("rx"), "tx_bytes": net.get("tx")}
+
+def _rates(c, rows):
+    # rate from the previous stored sample; across a reset the last known rate is shown until the next sample
+    prev = {}
+    ids = [r["id"] for r in rows]
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for p in c.execute(f"""SELECT node_id, mbps, net_t AS t, net_boot AS boot, net_iface AS iface, rx_bytes AS rx, tx_bytes AS tx
+                               FROM node_status WHERE node_id IN ({','.join('?' * len(chunk))})""", chunk):
+            prev[p["node_id"]] = dict(p)
+    for r in rows:
+        bw = r["data"]["bandwidth"]; cur = bw.get("sample"); p = prev.get(r["id"])
+        if cur and cur["t"] is None: cur["t"] = rollups.epoch(r["ts"])
+        bw["rate"] = bandwidth.rate(p if p and p["rx"] is not None else None, cur)
+        if cur is None: bw["mbps"] = 0.0
+        elif bw["rate"] is not None: bw["mbps"] = bw["rate"]
+        else: bw["mbps"] = p["mbps"] if p and r.get("status", "ok") == "ok" else 0.0
+        if cur: prev[r["id"]] = dict(cur, mbps=bw["mbps"])  # a pushed batch can hold several samples of one node
+
+def store_results(results, schedule_rows=()):
+    # one transaction for the whole run instead of one connection per node
+    rows = [r for r in results if r.get("data") is not None]
+    if not results and not schedule_rows: return
+    with db_conn() as c:
+        for r in rows:
+            items, complete = _new_sessions(r["data"])
+            count, sent = sessions.ingest(c, r["id"], items, complete)
+            r["data"]["sessions"] = {"count": count, "bytes": sent, "new": len(items)}
+        _rates(c, rows)
+        statuses = [status_row(r) for r in rows]
+        if schedule_rows:
+            c.executemany("""INSERT INTO node_schedule(node_id, next_run, interval, last_run, last_duration, last_status, failures, stable, last_sig)
+                             VALUES(:node_id,:next_run,:interval,:last_run,:last_duration,:last_status,:failures,:stable,:last_sig)
+                             ON CONFLICT(node_id) DO UPDATE SET next_run=excluded.next_run, interval=excluded.interval,
+                             last_run=excluded.last_run, last_duration=excluded.last_duration, last_status=excluded.last_status,
+                             failures=excluded.failures, stable=excluded.stable, last_sig=excluded.last_sig""", schedule_rows)
+        breaker.record(c, results)
+        c.executemany("UPDATE nodes SET last_seen=?, last_metrics=? WHERE id=?",
+                      [(r["ts"], json.dumps(r["data"]), r["id"]) for r in rows])
+        c.executemany("INSERT INTO metrics(node_id, ts, sessions, bytes_total, api_ok, nat_type, rx_bytes, tx_bytes, mbps) VALUES(?,?,?,?,?,?,?,?,?)",
+                      [(r["id"], r["ts"], r["data"]["sessions"]["count"], r["data"]["sessions"]["bytes"],
+                        1 if r["data"].get("api_health",{}).get("out","") else 0, r["data"]["nat"]["type"],
+                        s["rx_bytes"], s["tx_bytes"], r["data"]["bandwidth"].get("rate")) for r, s in zip(rows, statuses)])
+        # typed copy of the blob for listings; last_seen only moves when the node actually answered
+        # counters only move when the node sent a sample, so the next rate spans the gap instead of restarting
+        c.executemany("""INSERT INTO node_status(node_id, running, api_ok, sessions, bytes_total, mbps, nat_type, last_seen, updated, collect_status,
+                                                 net_t, net_boot, net_iface, rx_bytes, tx_bytes)
+                         VALUES(:node_id,:running,:api_ok,:sessions,:bytes_total,:mbps,:nat_type,
+                                CASE WHEN :status='ok' THEN :ts END, :ts, :status, :net_t, :net_boot, :net_iface, :rx_bytes, :tx_bytes)
+                         ON CONFLICT(node_id) DO UPDATE SET running=excluded.running, api_ok=excluded.api_ok,
+                         sessions=excluded.sessions, bytes_total=excluded.bytes_total, mbps=excluded.mbps, nat_type=excluded.nat_type,
+                         last_seen=COALESCE(excluded.last_seen, node_status.last_seen), updated=excluded.updated,
+                         collect_status=excluded.collect_status, net_t=COALESCE(excluded.net_t, node_status.net_t),
+                         net_boot=COALESCE(excluded.net_boot, node_status.net_boot), net_iface=COALESCE(excluded.net_iface, node_status.net_iface),
+                         rx_bytes=COALESCE(excluded.rx_bytes, node_status.rx_bytes), tx_bytes=COALESCE(excluded.tx_bytes, node_status.tx_bytes)""",
+                      statuses)
+    exporter.update(statuses)
+
+def run_many(nodes, concurrency: int = COLLECT_CONCURRENCY, deadline_s: float = COLLECT_NODE_DEADLINE, skip_open: bool = True) -> list:
+    results = []
+    if not nodes: return results
+    # a sweep costs what its reachable nodes cost: open breakers are skipped, dead ports fail in one async pass
+    if skip_open:
+        nodes, skipped = breaker.split(nodes)
+        results += [{"id": n["id"], "status": "skipped", "error": "circuit open", "duration": None, "data": None} for n in skipped]
+    down = preflight.check(nodes)
+    results += [unreachable(n, down[n["id"]]) for n in nodes if n["id"] in down]
+    nodes = [n for n in nodes if n["id"] not in down]
+    if not nodes: return results
+    workers = max(1, min(concurrency, len(nodes)))
+    ex = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="collect")
+    futs = {ex.submit(collect_node, n, deadline_s): n for n in nodes}
+    # worker-side timeouts are clipped to the deadline; this is only a guard against a stuck thread
+    waves = -(-len(nodes) // workers)
+    done, pending = wait(futs, timeout=waves * deadline_s + 30)
+    for f in done:
+        try: results.append(f.result())
+        except Exception as e:
+            results.append({"id": futs[f]["id"], "status": "failed", "error": str(e), "duration": None, "data": None})
+    for f in pending:
+        results.append({"id": futs[f]["id"], "status": "timeout", "error": "worker did not finish", "duration": None, "data": None})
+    ex.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def run_summary(results, started: str, duration: float, concurrency: int) -> dict:
+    durations = [r["duration"] for r in results if r.get("duration") is not None]
+    return {
+        "started": started, "duration": round(duration, 3), "total": len(results),
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "timeout": sum(1 for r in results if r["status"] == "timeout"),
+        "skipped": sum(1 for r in results if r["status"] == "skipped"),
+        "node_max": max(durations) if durations else 0.0,
+        "node_avg": round(sum(durations) / len(durations), 3) if durations else 0.0,
+        "concurrency": concurrency,
+        "nodes": [{k: r.get(k) for k in ("id", "status", "duration", "error")} for r in results],
+    }
+
+def collect_many(nodes, concurrency: int = COLLECT_CONCURRENCY, deadline_s: float = COLLECT_NODE_DEADLINE, skip_open: bool = True) -> dict:
+    started = datetime.utcnow().isoformat(); t0 = time.monotonic()
+    results = run_many(nodes, concurrency, deadline_s, skip_open)
+    store_results(results)
+    return run_summary(results, started, time.monotonic() - t0, concurrency)
+
+def collect_all(concurrency: int = COLLECT_CONCURRENCY, deadline_s: float = COLLECT_NODE_DEADLINE) -> dict:
+    with db_conn() as c:
+        nodes = [dict(r) for r in c.execute("SELECT * FROM nodes")]
+    summary = collect_many(nodes, concurrency, deadline_s)
+    last = dict(summary, nodes=[r for r in summary["nodes"] if r["status"] not in ("ok", "skipped")])
+    set_setting("collect_last_run", json.dumps(last))
+    exporter.set_last_run(summary)
+    return summary
@@ -0,0 +1,111 @@
+"""Node, collection, deploy and ACL operations shared by the web apps and the CLI.
+
+Only db is imported up front; collector (and with it paramiko), deploy and ufw are imported by the functions that
+need them, so `python -m cli export` or `backup` never load the SSH stack."""
+from datetime import datetime
+from typing import Optional
+from db import db_conn
+
+def node(node_id: int) -> Optional[dict]:
+    with db_conn() as c:
+        r = c.execute("SELECT * FROM nodes WHERE id=?", (node_id,)).fetchone()
+    return dict(r) if r else None
+
+def nodes(tag: Optional[str] = None, node_ids=None) -> list:
+    """All nodes, those carrying tag, or those in node_ids; the tag filter is the node listing's."""
+    import nodelist
+    where, args = nodelist.filters(tag)
+    if node_ids:
+        where.append(f"n.id IN ({','.join(str(int(i)) for i in node_ids)})")
+    with db_conn() as c:
+        return [dict(r) for r in c.execute(f"SELECT n.* FROM {nodelist.FROM}" + (" WHERE " + " AND ".join(where) if where else "")
+                                           + " ORDER BY n.id", args)]
+
+def delete_node(node_id: int):
+    import creds, exporter
+    with db_conn() as c:
+        r = c.execute("SELECT host, port FROM nodes WHERE id=?", (node_id,)).fetchone()
+        c.execute("DELETE FROM nodes WHERE id=?", (node_id,))
+        for t in ("node_schedule", "node_status", "node_tags", "sessions", "session_cursor", "node_agents", "node_breaker"):
+            c.execute(f"DELETE FROM {t} WHERE node_id=?", (node_id,))
+    # a node added again at the same address is usually a reinstalled host with a new key
+    if r: creds.forget(r["host"], r["port"])
+    exporter.remove(node_id)
+
+# Collection
+
+def collect_node(n: dict) -> dict:
+    """Collect one node now; an explicit collect ignores the circuit breaker."""
+    import collector
+    return collector.collect_many([n], skip_open=False)
+
+def collect(tag: Optional[str] = None, node_ids=None) -> dict:
+    """Collect the selected nodes; with no selection this is Collect All and records the run for the Nodes page."""
+    import collector
+    if not tag and not node_ids: return collector.collect_all()
+    selected = nodes(tag, node_ids)
+    if not selected: raise ValueError("no nodes match the selection")
+    return collector.collect_many(selected)
+
+# Deploy
+
+def deploy_node(n: dict, mgmt_ip: str, agent_url: Optional[str] = None, redeploy: bool = False) -> Optional[int]:
+    """Start a deploy job and return its id, or None when the node already runs and neither redeploy nor an
+    agent was asked for."""
+    import jobs
+    import deploy as deployer
+    # adding the agent to a node that already runs is a redeploy with the same settings; a redeploy of an
+    # unchanged node ends after one hash check
+    if deployer.is_running(n["id"]) and not (agent_url or redeploy): return None
+    return jobs.submit("deploy", n["id"], deployer.for_node(n, mgmt_ip, agent_url))
+
+def deploy_now(n: dict, mgmt_ip: str) -> tuple:
+    """Deploy in the calling thread, without a jobs row: (ok, output). For callers that wait for the result."""
+    import jobs
+    import deploy as deployer
+    out = jobs.Job(0)
+    try:
+        ok = deployer.for_node(n, mgmt_ip)(out)
+    except Exception as e:
+        out.write(f"\n== {e}\n"); ok = False
+    return ok, out.text()
+
+# ACL
+
+def acl_add(port: int, cidr: str, proto: str = "tcp") -> int:
+    with db_conn() as c:
+        return c.execute("INSERT INTO acl(port, proto, cidr, enabled) VALUES(?,?,?,1)", (port, proto, cidr)).lastrowid
+
+def acl_toggle(acl_id: int) -> Optional[bool]:
+    """Flip a rule on or off and return its new state; None if there is no such rule."""
+    with db_conn() as c:
+        r = c.execute("SELECT enabled FROM acl WHERE id=?", (acl_id,)).fetchone()
+        if not r: return None
+        c.execute("UPDATE acl SET enabled=? WHERE id=?", (0 if r["enabled"] else 1, acl_id))
+    return not r["enabled"]
+
+def acl_delete(acl_id: int):
+    with db_conn() as c:
+        c.execute("DELETE FROM acl WHERE id=?", (acl_id,))
+
+def acl_reconcile(mgmt_ip: str, panel_port: int, dry_run: bool) -> dict:
+    """Bring ufw in line with the acl table (see ufw.reconcile); raises ufw.UfwError when ufw cannot be read."""
+    import ufw
+    with db_conn() as c:
+        rows = [dict(r) for r in c.execute("SELECT * FROM acl")]
+    return ufw.reconcile(rows, mgmt_ip, panel_port, dry_run=dry_run)
+
+# Export
+
+MEDIA = {"json": "application/json", "ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def export(fmt: str = "json", sections: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+           node_ids=(), gzip: bool = False):
+    """(file name, media type, byte chunks) for an export; ValueError for an unknown format, section or date."""
+    import dump
+    if sections is None: sections = "nodes" if fmt == "csv" else ",".join(dump.DEFAULT_SECTIONS)
+    chosen = dump.validate(fmt, [x.strip() for x in sections.split(",") if x.strip()])
+    start = datetime.fromisoformat(start).isoformat() if start else None
+    end = datetime.fromisoformat(end).isoformat() if end else None
+    name = f"myst-export.{fmt}" + (".gz" if gzip else "")
+    return name, "application/gzip" if gzip else MEDIA[fmt], dump.stream(fmt, chosen, start, end, node_ids, gzip)
@@ -0,0 +1,92 @@
+import os, base64, threading
+from datetime import datetime
+from typing import Optional
+import paramiko
+from db import db_conn
+
+SSH_KEY_PASSPHRASE = os.getenv("SSH_KEY_PASSPHRASE") or None  # for encrypted key files; ssh-agent needs none
+SSH_USE_AGENT = os.getenv("SSH_USE_AGENT", "1") == "1"       # key auth with an empty key path asks ssh-agent (SSH_AUTH_SOCK)
+# tofu: remember a host's first key and refuse a different one later; strict: refuse hosts not in known_hosts;
+# accept: take whatever the host presents and remember the latest (the old AutoAddPolicy behaviour)
+HOST_KEY_POLICY = os.getenv("HOST_KEY_POLICY", "tofu")
+
+_lock = threading.Lock()
+_keys = {}           # path -> ((mtime_ns, size), PKey)
+_known = None        # (host, port) -> (key type, base64 blob); loaded from known_hosts on first use
+
+def load_key(path: str) -> paramiko.PKey:
+    """The private key at path, parsed once and re-read only when the file changes. RSA, ECDSA and Ed25519."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    hit = _keys.get(path)
+    if hit and hit[0] == stamp: return hit[1]
+    pkey = paramiko.PKey.from_path(path, SSH_KEY_PASSPHRASE)
+    with _lock: _keys[path] = (stamp, pkey)
+    return pkey
+
+def connect_args(password: Optional[str], key_path: Optional[str]) -> dict:
+    """Auth keyword arguments for SSHClient.connect: a key file, a password, or ssh-agent when neither is set."""
+    if key_path:
+        return {"pkey": load_key(key_path), "allow_agent": False, "look_for_keys": False}
+    if password:
+        return {"password": password, "allow_agent": False, "look_for_keys": False}
+    if SSH_USE_AGENT and os.getenv("SSH_AUTH_SOCK"):
+        return {"allow_agent": True, "look_for_keys": False}
+    raise paramiko.AuthenticationException("no password or key path, and no ssh-agent (SSH_AUTH_SOCK)")
+
+def _load():
+    global _known
+    if _known is None:
+        with db_conn() as c:
+            rows = {(r["host"], r["port"]): (r["key_type"], r["key"]) for r in c.execute("SELECT host, port, key_type, key FROM known_hosts")}
+        with _lock:
+            if _known is None: _known = rows
+    return _known
+
+def _name(host: str, port: int) -> str:
+    return host if port == 22 else f"[{host}]:{port}"
+
+def _remember(host: str, port: int, key: paramiko.PKey, replace: bool):
+    known = _load()  # accept mode connects without consulting known_hosts, so it may not be loaded yet
+    blob = key.get_base64()
+    now = datetime.utcnow().isoformat()
+    with db_conn() as c:
+        if replace:
+            c.execute("""INSERT INTO known_hosts(host, port, key_type, key, added) VALUES(?,?,?,?,?)
+                         ON CONFLICT(host, port) DO UPDATE SET key_type=excluded.key_type, key=excluded.key, added=excluded.added""",
+                      (host, port, key.get_name(), blob, now))
+        else:
+            c.execute("INSERT OR IGNORE INTO known_hosts(host, port, key_type, key, added) VALUES(?,?,?,?,?)",
+                      (host, port, key.get_name(), blob, now))
+        # another process may have recorded the host first; the stored key wins
+        r = c.execute("SELECT key_type, key FROM known_hosts WHERE host=? AND port=?", (host, port)).fetchone()
+    with _lock: known[(host, port)] = (r["key_type"], r["key"])
+    if (r["key_type"], r["key"]) != (key.get_name(), blob):
+        raise paramiko.BadHostKeyException(_name(host, port), key, paramiko.PKey.from_type_string(r["key_type"], base64.b64decode(r["key"])))
+
+class _Policy(paramiko.MissingHostKeyPolicy):
+    def __init__(self, port: int):
+        self.port = port
+
+    def missing_host_key(self, client, hostname, key):
+        host = hostname[1:hostname.rindex("]")] if hostname.startswith("[") else hostname
+        if HOST_KEY_POLICY == "strict":
+            raise paramiko.SSHException(f"{hostname}: host key not in known_hosts ({key.get_name()} {key.fingerprint})")
+        _remember(host, self.port, key, HOST_KEY_POLICY == "accept")
+
+def client(host: str, port: int) -> paramiko.SSHClient:
+    """An SSHClient that checks the host key against known_hosts; the key itself is compared by paramiko."""
+    c = paramiko.SSHClient()
+    known = None if HOST_KEY_POLICY == "accept" else _load().get((host, int(port)))
+    if known:
+        # with the stored key loaded paramiko also negotiates that key type, so a host with several keys matches
+        c.get_host_keys().add(_name(host, int(port)), known[0], paramiko.PKey.from_type_string(known[0], base64.b64decode(known[1])))
+    c.set_missing_host_key_policy(_Policy(int(port)))
+    return c
+
+def forget(host: str, port: int):
+    """Drop a host's stored key, e.g. after the node was reinstalled."""
+    with db_conn() as c:
+        c.execute("DELETE FROM known_hosts WHERE host=? AND port=?", (host, int(port)))
+    with _lock:
+        if _known is not None: _known.pop((host, int(port)), None)
@@ -0,0 +1,394 @@
+import os, json, sqlite3, secrets, threading
+from typing import Optional
+
+DB_PATH = os.getenv("MYST_MANAGER_DB", "/opt/myst-manager/manager.db")
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))  # ms a writer waits for the lock before failing
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")       # NORMAL is durable across app crashes in WAL mode
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+SECRET_KEY_FILE = os.getenv("SECRET_KEY_FILE", "")  # default: secret_key next to the database
+
+_local = threading.local()
+
+def connect(path: str = None, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or DB_PATH, timeout=DB_BUSY_TIMEOUT / 1000,
+                           cached_statements=DB_STATEMENT_CACHE, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def db_conn() -> sqlite3.Connection:
+    # one connection per thread, reused for the life of the thread; `with db_conn() as c:` still commits/rolls back
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        conn = _local.conn = connect()
+        _local.path = DB_PATH
+    return conn
+
+def _m1_base(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS nodes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        host TEXT NOT NULL,
+        user TEXT NOT NULL,
+        port INTEGER NOT NULL DEFAULT 22,
+        use_password INTEGER NOT NULL DEFAULT 1,
+        password TEXT,
+        key_path TEXT,
+        wg_port INTEGER NOT NULL DEFAULT 51820,
+        api_port INTEGER NOT NULL DEFAULT 4050,
+        wallet_id INTEGER,
+        payout_address TEXT,
+        capacity_mbps REAL,
+        tags TEXT,
+        notes TEXT,
+        created_at TEXT,
+        last_seen TEXT,
+        last_metrics TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS acl (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        port INTEGER NOT NULL,
+        proto TEXT NOT NULL DEFAULT 'tcp',
+        cidr TEXT NOT NULL,
+        enabled INTEGER NOT NULL DEFAULT 1
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS wallets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        label TEXT NOT NULL,
+        address TEXT NOT NULL
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        node_id INTEGER NOT NULL,
+        ts TEXT NOT NULL,
+        sessions INTEGER,
+        bytes_total INTEGER,
+        api_ok INTEGER,
+        nat_type TEXT
+    )""")
+    cols = [r[1] for r in c.execute("PRAGMA table_info(nodes)")]
+    if "api_port" not in cols:
+        c.execute("ALTER TABLE nodes ADD COLUMN api_port INTEGER NOT NULL DEFAULT 4050")
+    if "capacity_mbps" not in cols:
+        c.execute("ALTER TABLE nodes ADD COLUMN capacity_mbps REAL")
+    if "tags" not in cols:
+        c.execute("ALTER TABLE nodes ADD COLUMN tags TEXT")
+    if "created_at" not in cols:
+        c.execute("ALTER TABLE nodes ADD COLUMN created_at TEXT")
+
+def _m2_schedule_jobs(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS node_schedule (
+        node_id INTEGER PRIMARY KEY,
+        next_run REAL,
+        interval REAL,
+        last_run TEXT,
+        last_duration REAL,
+        last_status TEXT,
+        failures INTEGER NOT NULL DEFAULT 0,
+        stable INTEGER NOT NULL DEFAULT 0,
+        last_sig TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        node_id INTEGER,
+        state TEXT NOT NULL DEFAULT 'queued',
+        created TEXT,
+        started TEXT,
+        finished TEXT,
+        error TEXT,
+        log BLOB
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_node ON jobs(node_id, id)")
+
+def _m3_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_node_ts ON metrics(node_id, ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_schedule_next ON node_schedule(next_run)")
+    if "wallet_id" not in [r[1] for r in c.execute("PRAGMA table_info(nodes)")]:
+        c.execute("ALTER TABLE nodes ADD COLUMN wallet_id INTEGER")  # databases created by the first panel version
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nodes_wallet ON nodes(wallet_id)")
+
+def _m4_rollups(c):
+    for table in ("metrics_5m", "metrics_1h", "metrics_1d"):
+        c.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            node_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            up_samples INTEGER NOT NULL,
+            sessions_min INTEGER, sessions_max INTEGER, sessions_sum INTEGER, sessions_last INTEGER,
+            bytes_min INTEGER, bytes_max INTEGER, bytes_sum INTEGER, bytes_last INTEGER,
+            last_ts TEXT,
+            PRIMARY KEY (node_id, bucket)
+        )""")
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)")
+
+def _m5_node_status(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS node_status (
+        node_id INTEGER PRIMARY KEY,
+        running INTEGER NOT NULL DEFAULT 0,
+        api_ok INTEGER NOT NULL DEFAULT 0,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        bytes_total INTEGER NOT NULL DEFAULT 0,
+        mbps REAL NOT NULL DEFAULT 0,
+        nat_type TEXT NOT NULL DEFAULT '',
+        last_seen TEXT,
+        updated TEXT,
+        collect_status TEXT
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_node_status_running ON node_status(running)")
+    # backfill once from the raw blobs so the listing does not need them any more
+    c.execute("""INSERT OR IGNORE INTO node_status(node_id, running, api_ok, sessions, bytes_total, mbps, nat_type, last_seen, updated)
+                 SELECT id,
+                        (instr(COALESCE(json_extract(last_metrics,'$.docker.out'),''),'myst-node') > 0)
+                            OR trim(COALESCE(json_extract(last_metrics,'$.api_health.out'),'')) != '',
+                        trim(COALESCE(json_extract(last_metrics,'$.api_health.out'),'')) != '',
+                        COALESCE(json_extract(last_metrics,'$.sessions.count'),0),
+                        COALESCE(json_extract(last_metrics,'$.sessions.bytes'),0),
+                        COALESCE(json_extract(last_metrics,'$.bandwidth.mbps'),0),
+                        COALESCE(json_extract(last_metrics,'$.nat.type'),''),
+                        last_seen, last_seen
+                 FROM nodes WHERE last_metrics IS NOT NULL AND json_valid(last_metrics)""")
+
+def _m6_node_tags(c):
+    # tags as rows so filtering is an index lookup instead of LIKE over nodes.tags
+    c.execute("""CREATE TABLE IF NOT EXISTS node_tags (
+        tag TEXT NOT NULL,
+        node_id INTEGER NOT NULL,
+        PRIMARY KEY (tag, node_id)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_node_tags_node ON node_tags(node_id)")
+    for r in c.execute("SELECT id, tags FROM nodes WHERE tags IS NOT NULL AND tags != ''").fetchall():
+        set_node_tags(c, r["id"], r["tags"])
+    # keyset pagination on the sortable listing columns
+    for col in ("sessions", "mbps", "bytes_total", "last_seen", "nat_type"):
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_node_status_{col} ON node_status({col}, node_id)")
+
+def _m7_node_endpoint_unique(c):
+    # imports upsert on host:port:user; fold earlier duplicates into the oldest row first
+    dups = c.execute("""SELECT n.id, k.keep FROM nodes n
+                        JOIN (SELECT host, port, user, MIN(id) AS keep FROM nodes GROUP BY host, port, user HAVING COUNT(*) > 1) k
+                          ON n.host=k.host AND n.port=k.port AND n.user=k.user
+                        WHERE n.id != k.keep""").fetchall()
+    for r in dups:
+        c.execute("UPDATE metrics SET node_id=? WHERE node_id=?", (r["keep"], r["id"]))
+        c.execute("UPDATE jobs SET node_id=? WHERE node_id=?", (r["keep"], r["id"]))
+        for table in ("node_status", "node_schedule", "node_tags", "metrics_5m", "metrics_1h", "metrics_1d"):
+            c.execute(f"DELETE FROM {table} WHERE node_id=?", (r["id"],))
+        c.execute("DELETE FROM nodes WHERE id=?", (r["id"],))
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_nodes_endpoint ON nodes(host, port, user)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_wallets_address ON wallets(address)")
+
+def _m8_sessions(c):
+    # TequilAPI sessions, ingested from a per-node cursor; session_cursor holds the running totals
+    c.execute("""CREATE TABLE IF NOT EXISTS sessions (
+        node_id INTEGER NOT NULL,
+        id TEXT NOT NULL,
+        started TEXT,
+        status TEXT,
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        consumer_country TEXT,
+        PRIMARY KEY (node_id, id)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_node_started ON sessions(node_id, started)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_started ON sessions(started)")
+    c.execute("""CREATE TABLE IF NOT EXISTS session_cursor (
+        node_id INTEGER PRIMARY KEY,
+        cursor TEXT,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0
+    )""")
+
+def _m9_bandwidth(c):
+    # interface counters per sample; rates come from consecutive samples, rollups keep peak and a p95 histogram
+    for col, typ in (("net_t", "REAL"), ("net_boot", "TEXT"), ("net_iface", "TEXT"), ("rx_bytes", "INTEGER"), ("tx_bytes", "INTEGER")):
+        c.execute(f"ALTER TABLE node_status ADD COLUMN {col} {typ}")
+    for col, typ in (("rx_bytes", "INTEGER"), ("tx_bytes", "INTEGER"), ("mbps", "REAL")):
+        c.execute(f"ALTER TABLE metrics ADD COLUMN {col} {typ}")
+    for table in ("metrics_5m", "metrics_1h", "metrics_1d"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN mbps_samples INTEGER NOT NULL DEFAULT 0")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN mbps_sum REAL NOT NULL DEFAULT 0")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN mbps_max REAL")
+        c.execute(f"ALTER TABLE {table} ADD COLUMN mbps_hist TEXT")
+    # vnstat daily averages are not rates; start the listing from zero until two samples exist
+    c.execute("UPDATE node_status SET mbps=0")
+
+def _m10_agents(c):
+    # push-mode agents; only a hash of each node's token is kept
+    c.execute("""CREATE TABLE IF NOT EXISTS node_agents (
+        node_id INTEGER PRIMARY KEY,
+        token_hash TEXT NOT NULL UNIQUE,
+        created TEXT,
+        last_push TEXT,
+        version TEXT
+    )""")
+
+def _m11_breaker(c):
+    # per-node circuit breaker; rows exist only for nodes whose last collect failed
+    c.execute("""CREATE TABLE IF NOT EXISTS node_breaker (
+        node_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL DEFAULT 'closed',
+        failures INTEGER NOT NULL DEFAULT 0,
+        retry_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        updated REAL
+    )""")
+
+def _m12_rollouts(c):
+    # fleet rollouts: deploys in waves; each node's deploy is an ordinary row in jobs
+    c.execute("""CREATE TABLE IF NOT EXISTS rollouts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        state TEXT NOT NULL,
+        selector TEXT,
+        canary INTEGER NOT NULL,
+        wave_size INTEGER NOT NULL,
+        concurrency INTEGER NOT NULL,
+        max_failure REAL NOT NULL,
+        redeploy INTEGER NOT NULL DEFAULT 0,
+        agent_url TEXT,
+        mgmt_ip TEXT,
+        created TEXT,
+        finished TEXT,
+        error TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS rollout_nodes (
+        rollout_id INTEGER NOT NULL,
+        node_id INTEGER NOT NULL,
+        wave INTEGER NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        job_id INTEGER,
+        PRIMARY KEY (rollout_id, node_id)
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rollout_nodes_wave ON rollout_nodes(rollout_id, wave, state)")
+
+def _m13_known_hosts(c):
+    # SSH host keys seen by the panel (see creds.HOST_KEY_POLICY)
+    c.execute("""CREATE TABLE IF NOT EXISTS known_hosts (
+        host TEXT NOT NULL,
+        port INTEGER NOT NULL,
+        key_type TEXT NOT NULL,
+        key TEXT NOT NULL,
+        added TEXT,
+        PRIMARY KEY (host, port)
+    )""")
+
+def _m14_leases(c):
+    # leader election and per-process heartbeats between panel workers (see leader.py)
+    c.execute("""CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires REAL NOT NULL
+    )""")
+    # the process a job or rollout coordinator runs in, so only orphans are recovered
+    c.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+    c.execute("ALTER TABLE rollouts ADD COLUMN owner TEXT")
+
+def _m15_rollout_coordinator(c):
+    # the coordinator job driving a rollout; a coordinator that is no longer this job stops
+    c.execute("ALTER TABLE rollouts ADD COLUMN job_id INTEGER")
+
+def _m16_job_log(c):
+    # output of running jobs, appended in chunks; folded into jobs.log when the job ends
+    c.execute("""CREATE TABLE IF NOT EXISTS job_log (
+        job_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        PRIMARY KEY (job_id, seq)
+    )""")
+
+def _m17_node_status_keyset(c):
+    # the listing pages through node_status in index order, so every node gets a status row and the sort keys
+    # live on node_status: capacity is copied from nodes, last_seen falls back to the nodes column as before
+    c.execute("ALTER TABLE node_status ADD COLUMN capacity_mbps REAL NOT NULL DEFAULT 0")
+    c.execute("INSERT OR IGNORE INTO node_status(node_id) SELECT id FROM nodes")
+    c.execute("""UPDATE node_status SET capacity_mbps=COALESCE((SELECT capacity_mbps FROM nodes WHERE id=node_id), 0),
+                                        last_seen=COALESCE(last_seen, (SELECT last_seen FROM nodes WHERE id=node_id))""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_nodes_status_insert AFTER INSERT ON nodes BEGIN
+                     INSERT OR IGNORE INTO node_status(node_id, capacity_mbps, last_seen) VALUES(NEW.id, COALESCE(NEW.capacity_mbps, 0), NEW.last_seen);
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_nodes_status_capacity AFTER UPDATE OF capacity_mbps ON nodes BEGIN
+                     UPDATE node_status SET capacity_mbps=COALESCE(NEW.capacity_mbps, 0) WHERE node_id=NEW.id;
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_nodes_status_last_seen AFTER UPDATE OF last_seen ON nodes BEGIN
+                     UPDATE node_status SET last_seen=NEW.last_seen WHERE node_id=NEW.id AND last_seen IS NULL;
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_nodes_status_delete AFTER DELETE ON nodes BEGIN
+                     DELETE FROM node_status WHERE node_id=OLD.id;
+                 END""")
+    # same expressions as nodelist.SORTS; the plain (col, node_id) indexes serve sessions, mbps and bytes_total
+    c.execute("DROP INDEX IF EXISTS idx_node_status_last_seen")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_node_status_last_seen ON node_status(COALESCE(last_seen, ''), node_id)")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_node_status_utilization
+                 ON node_status((CASE WHEN capacity_mbps > 0 THEN mbps / capacity_mbps ELSE -1.0 END), node_id)""")
+
+# Applied in order; PRAGMA user_version records how many have run. Only ever append.
+MIGRATIONS = [_m1_base, _m2_schedule_jobs, _m3_indexes, _m4_rollups, _m5_node_status, _m6_node_tags,
+              _m7_node_endpoint_unique, _m8_sessions, _m9_bandwidth, _m10_agents,
+              _m11_breaker, _m12_rollouts, _m13_known_hosts, _m14_leases,
+              _m15_rollout_coordinator, _m16_job_log, _m17_node_status_keyset]
+
+def db_init():
+    c = db_conn()
+    if c.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        c.execute("PRAGMA journal_mode=WAL")  # readers no longer block on the writer
+    if c.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS): return
+    # several workers start at once: the first takes the write lock and migrates, the others wait and find
+    # nothing left to do. Jobs and rollouts cut off by a restart are recovered by the leader (leader.recover).
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        for i, m in enumerate(MIGRATIONS[version:], start=version + 1):
+            m(c)
+            c.execute(f"PRAGMA user_version={i}")
+        c.commit()
+    except BaseException:
+        c.rollback(); raise
+
+def shared_secret(path: Optional[str] = None) -> str:
+    """A random key created once and shared by every process that uses this database (session signing when
+    SECRET_KEY is not set). Kept in a 0600 file next to the database, so exports and backups never carry it."""
+    path = path or SECRET_KEY_FILE or os.path.join(os.path.dirname(DB_PATH) or ".", "secret_key")
+    try:
+        with open(path) as f: return f.read().strip()
+    except FileNotFoundError: pass
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f: f.write(secrets.token_hex(32))
+    try: os.link(tmp, path)  # fails if another worker got there first; its key wins
+    except FileExistsError: pass
+    finally: os.remove(tmp)
+    with open(path) as f: return f.read().strip()
+
+def get_setting(key: str, default: Optional[str]=None) -> Optional[str]:
+    with db_conn() as c:
+        r = c.execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
+        return r["value"] if r else default
+
+def get_wallet_address(wallet_id: Optional[int]) -> Optional[str]:
+    if not wallet_id: return None
+    with db_conn() as c:
+        r = c.execute("SELECT address FROM wallets WHERE id=?", (wallet_id,)).fetchone()
+        return r["address"] if r else None
+
+def set_setting(key: str, value: str):
+    with db_conn() as c:
+        c.execute("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+
+def split_tags(tags: Optional[str]) -> list:
+    out = []
+    for t in (tags or "").split(","):
+        t = t.strip()
+        if t and t not in out: out.append(t)
+    return out
+
+def set_node_tags(c, node_id: int, tags: Optional[str]):
+    """Replace a node's rows in node_tags from the comma-separated nodes.tags text. Runs in the caller's transaction."""
+    c.execute("DELETE FROM node_tags WHERE node_id=?", (node_id,))
+    c.executemany("INSERT OR IGNORE INTO node_tags(tag, node_id) VALUES(?,?)", [(t, node_id) for t in split_tags(tags)])
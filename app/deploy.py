@@ -0,0 +1,112 @@
+import os, json, time, codecs, base64, hashlib
+import ingest, preflight
+from db import db_conn, get_wallet_address
+from sshpool import node_client, node_exec
+
+REMOTE_SCRIPT = os.getenv("REMOTE_INSTALL_SCRIPT", "/opt/myst-manager/remote_install.sh")
+AGENT_SCRIPT = os.getenv("AGENT_SCRIPT", "/opt/myst-manager/myst_agent.py")
+DEPLOY_TIMEOUT = int(os.getenv("DEPLOY_TIMEOUT", "1200"))
+DEPLOY_FAST_PATH = os.getenv("DEPLOY_FAST_PATH", "1") == "1"  # 0: always upload and run every step (FORCE=1)
+
+STATE_DIR = "/opt/myst/.deploy"  # remote_install.sh keeps its step markers and a copy of itself here
+# one round trip: hashes of the installed script and myst.env, then whether the container runs
+REMOTE_STATE = (f"sha256sum {STATE_DIR}/remote_install.sh /opt/myst/myst.env 2>/dev/null; "
+                "echo \"running $(sudo -n docker inspect -f '{{.State.Running}}' myst-node 2>/dev/null)\"")
+
+def is_running(node_id: int) -> bool:
+    with db_conn() as c:
+        r = c.execute("SELECT running FROM node_status WHERE node_id=?", (node_id,)).fetchone()
+    return bool(r and r["running"])
+
+def render_env(n: dict, payout) -> str:
+    """The node's myst.env; remote_install.sh writes it verbatim, so its hash tells whether the node is current."""
+    return f"LOG_LEVEL=info\nMYST_TEQUILA_API_PORT={n['api_port']}\nWIREGUARD_PORT={n['wg_port']}\nPAYOUT_ADDRESS={payout or ''}\n"
+
+_script_hash = (None, None)  # (mtime, sha256) of REMOTE_SCRIPT
+
+def script_hash() -> str:
+    global _script_hash
+    mtime = os.stat(REMOTE_SCRIPT).st_mtime_ns
+    if _script_hash[0] != mtime:
+        with open(REMOTE_SCRIPT, "rb") as f:
+            _script_hash = (mtime, hashlib.sha256(f.read()).hexdigest())
+    return _script_hash[1]
+
+def remote_state(n: dict) -> dict:
+    """{"script": sha256, "env": sha256, "running": bool} as found on the node; missing files are left out."""
+    rc, out, _ = node_exec(n, REMOTE_STATE, timeout=30, connect_timeout=30)
+    state = {"running": False}
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == "running":
+            state["running"] = parts[1] == "true"
+        elif len(parts) == 2:
+            state["script" if parts[1].endswith("/remote_install.sh") else "env"] = parts[0]
+    return state
+
+def command(n: dict, mgmt_ip: str, payout, agent: bool = False, script: str = "/tmp/remote_install.sh") -> str:
+    env = base64.b64encode(render_env(n, payout).encode()).decode()
+    return (f"sudo {'INSTALL_AGENT=1 ' if agent else ''}{'' if DEPLOY_FAST_PATH else 'FORCE=1 '}MGMT_IP='{mgmt_ip}' PAYOUT_ADDRESS='{payout or ''}' "
+            f"WG_PORT='{n['wg_port']}' API_PORT='{n['api_port']}' MYST_ENV_B64='{env}' bash {script} --non-interactive")
+
+def for_node(n: dict, mgmt_ip: str, agent_url: str = None):
+    """The deploy job body for one node; agent_url also installs the push agent with a freshly issued token."""
+    payout = n.get("payout_address") or get_wallet_address(n.get("wallet_id"))
+    cfg = ingest.agent_config(n, ingest.issue_token(n["id"]), agent_url) if agent_url else None
+    return lambda job: run(job, n, mgmt_ip, payout, cfg)
+
+def run(job, n: dict, mgmt_ip: str, payout, agent: dict = None) -> bool:
+    """agent: ingest.agent_config() for a push-mode agent installed alongside the node.
+
+    With DEPLOY_FAST_PATH the node's installed script, myst.env and container state are compared first: a node
+    that matches is left alone, and an unchanged script is run from the node's copy instead of being uploaded.
+    The script itself skips the package and firewall steps it already finished."""
+    job.write(f"== deploy to {n['user']}@{n['host']}:{n['port']}\n")
+    down = preflight.check([n])
+    if down:
+        job.write(f"== {down[n['id']]}\n")
+        return False
+    state = remote_state(n) if DEPLOY_FAST_PATH else {}
+    fresh_script = state.get("script") == script_hash()
+    if fresh_script and state.get("env") == hashlib.sha256(render_env(n, payout).encode()).hexdigest() and state["running"] and not agent:
+        job.write("== up to date: script, myst.env and container unchanged\n")
+        return True
+    script = f"{STATE_DIR}/remote_install.sh" if fresh_script else "/tmp/remote_install.sh"
+    with node_client(n, timeout=60) as client:
+        if not fresh_script or agent:
+            sftp = client.open_sftp()
+            if not fresh_script:
+                sftp.put(REMOTE_SCRIPT, "/tmp/remote_install.sh")
+                sftp.chmod("/tmp/remote_install.sh", 0o755)
+            if agent:
+                sftp.put(AGENT_SCRIPT, "/tmp/myst_agent.py")
+                # the config carries the agent's token, so it is never readable by other users on the node
+                with sftp.open("/tmp/myst_agent.json", "w") as f:
+                    f.chmod(0o600)
+                    f.write(json.dumps(agent))
+            sftp.close()
+            job.write("== uploaded " + " and ".join(x for x, up in (("remote_install.sh", not fresh_script), ("agent", agent)) if up) + "\n")
+        if fresh_script:
+            job.write("== remote_install.sh unchanged on the node, running its copy\n")
+        chan = client.get_transport().open_session(timeout=60)
+        try:
+            chan.set_combine_stderr(True)
+            chan.settimeout(1.0)
+            chan.exec_command(command(n, mgmt_ip, payout, bool(agent), script))
+            deadline = time.monotonic() + DEPLOY_TIMEOUT
+            dec = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                try:
+                    buf = chan.recv(32768)
+                    if not buf: break
+                    job.write(dec.decode(buf))
+                except TimeoutError:
+                    pass
+                if time.monotonic() > deadline:
+                    job.write(f"\n== timed out after {DEPLOY_TIMEOUT}s\n")
+                    return False
+            rc = chan.recv_exit_status()
+        finally:
+            chan.close()
+    job.write(f"\n== exit code {rc}\n")
+    return rc == 0
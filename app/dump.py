@@ -0,0 +1,81 @@
+import io, csv, json, zlib
+from typing import Optional
+from db import connect
+
+FETCH = 1000  # rows per fetchmany; the whole export never holds more than this
+SECTIONS = ("wallets", "nodes", "acls", "settings", "metrics")
+DEFAULT_SECTIONS = ("wallets", "nodes", "acls", "settings")
+# NDJSON "type" per section; importer.iter_ndjson maps them back
+TYPES = {"wallets": "wallet", "nodes": "node", "acls": "acl", "settings": "setting", "metrics": "metric"}
+
+def _query(section: str, start: Optional[str], end: Optional[str], node_ids):
+    where, args = [], []
+    if section == "metrics":
+        if start: where.append("ts >= ?"); args.append(start)
+        if end: where.append("ts < ?"); args.append(end)
+    if section in ("metrics", "nodes") and node_ids:
+        where.append(f"{'id' if section == 'nodes' else 'node_id'} IN ({','.join('?' * len(node_ids))})"); args += list(node_ids)
+    table = {"acls": "acl"}.get(section, section)
+    order = " ORDER BY key" if section == "settings" else " ORDER BY id"
+    return f"SELECT * FROM {table}" + (" WHERE " + " AND ".join(where) if where else "") + order, args
+
+def _rows(c, section, start, end, node_ids):
+    sql, args = _query(section, start, end, node_ids)
+    cur = c.execute(sql, args)
+    cols = [d[0] for d in cur.description]
+    while True:
+        batch = cur.fetchmany(FETCH)
+        if not batch: return
+        yield cols, batch
+
+def _json(sections, c, start, end, node_ids):
+    # same document shape as the old in-memory /export, written incrementally
+    yield "{"
+    for i, section in enumerate(sections):
+        yield ("," if i else "") + json.dumps(section) + ":["
+        first = True
+        for cols, batch in _rows(c, section, start, end, node_ids):
+            yield ("" if first else ",") + ",".join(json.dumps(dict(zip(cols, r))) for r in batch)
+            first = False
+        yield "]"
+    yield "}\n"
+
+def _ndjson(sections, c, start, end, node_ids):
+    for section in sections:
+        kind = TYPES[section]
+        for cols, batch in _rows(c, section, start, end, node_ids):
+            yield "".join(json.dumps(dict(zip(cols, r), type=kind)) + "\n" for r in batch)
+
+def _csv(sections, c, start, end, node_ids):
+    buf = io.StringIO(); w = csv.writer(buf)
+    header = False
+    for cols, batch in _rows(c, sections[0], start, end, node_ids):
+        if not header: w.writerow(cols); header = True
+        w.writerows(batch)
+        yield buf.getvalue(); buf.seek(0); buf.truncate()
+
+WRITERS = {"json": _json, "ndjson": _ndjson, "csv": _csv}
+
+def validate(fmt: str, sections) -> list:
+    if fmt not in WRITERS: raise ValueError(f"format must be one of {', '.join(WRITERS)}")
+    bad = set(sections) - set(SECTIONS)
+    sections = [s for s in SECTIONS if s in sections]  # canonical order: wallets before nodes
+    if bad or not sections: raise ValueError(f"sections must be some of {', '.join(SECTIONS)}")
+    if fmt == "csv" and len(sections) != 1: raise ValueError("csv exports one section at a time")
+    return sections
+
+def stream(fmt: str, sections, start: Optional[str] = None, end: Optional[str] = None, node_ids=(), gzip: bool = False):
+    """Yield the export as bytes. Everything is read inside one read transaction, so the sections agree with each other."""
+    # StreamingResponse iterates a sync generator from whichever threadpool thread is free,
+    # so this connection must not be tied to the creating thread (nor be the thread-local one)
+    c = connect(check_same_thread=False)
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    try:
+        c.execute("BEGIN")
+        for chunk in WRITERS[fmt](sections, c, start, end, node_ids):
+            data = chunk.encode()
+            if z: data = z.compress(data)
+            if data: yield data
+        if z: yield z.flush()
+    finally:
+        c.rollback(); c.close()
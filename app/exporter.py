@@ -0,0 +1,137 @@
+import os, json, time, threading, calendar
+from datetime import datetime
+from typing import Optional
+from db import db_conn, get_setting
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "5"))  # seconds a rendered scrape is reused
+# collection in another process (the CLI, the leader worker) only reaches node_status, so the housekeeping
+# thread reloads the snapshot every METRICS_CACHE_TTL when the database shows newer results
+METRICS_RELOAD = os.getenv("METRICS_RELOAD", "1") == "1"
+
+# node_id -> {"host", "up", "sessions", "bytes_total", "mbps", "capacity", "nat_type", "last_seen", "duration"}
+_snapshot = {}
+_lock = threading.Lock()
+_state = {"version": 0, "usd_per_gb": 0.0, "last_run": None, "marker": None}
+_cache = {"version": -1, "at": 0.0, "body": b""}
+
+def _epoch(ts: Optional[str]) -> Optional[float]:
+    if not ts: return None
+    try: return calendar.timegm(datetime.fromisoformat(ts).utctimetuple())
+    except ValueError: return None
+
+def _marker() -> tuple:
+    # changes whenever a collection is stored or a node added or removed, by any process; no join, no node rows read
+    with db_conn() as c:
+        return tuple(c.execute("""SELECT (SELECT MAX(updated) FROM node_status), (SELECT COUNT(*) FROM node_status),
+                                         (SELECT COUNT(*) FROM nodes), (SELECT MAX(id) FROM nodes),
+                                         (SELECT value FROM settings WHERE key='collect_last_run'),
+                                         (SELECT value FROM settings WHERE key='usd_per_gb')""").fetchone())
+
+def warm():
+    """Load the snapshot from node_status (startup, or when refresh() sees newer data); otherwise collection
+    updates it in place."""
+    marker = _marker()
+    with db_conn() as c:
+        rows = c.execute("""SELECT n.id, n.host, n.capacity_mbps, COALESCE(st.running, 0) AS running, COALESCE(st.sessions, 0) AS sessions,
+                                   COALESCE(st.bytes_total, 0) AS bytes_total, COALESCE(st.mbps, 0.0) AS mbps,
+                                   COALESCE(st.nat_type, '') AS nat_type, st.last_seen, s.last_duration
+                            FROM nodes n LEFT JOIN node_status st ON st.node_id=n.id LEFT JOIN node_schedule s ON s.node_id=n.id""").fetchall()
+    snap = {r["id"]: {"host": r["host"], "up": r["running"], "sessions": r["sessions"], "bytes_total": r["bytes_total"],
+                      "mbps": r["mbps"], "capacity": r["capacity_mbps"] or 0.0, "nat_type": r["nat_type"],
+                      "last_seen": _epoch(r["last_seen"]), "duration": r["last_duration"]} for r in rows}
+    with _lock:
+        _snapshot.clear(); _snapshot.update(snap)
+        _state["usd_per_gb"] = float(get_setting("usd_per_gb", "0") or 0)
+        _state["last_run"] = json.loads(get_setting("collect_last_run") or "null") or _state["last_run"]
+        _state["marker"] = marker; _state["version"] += 1
+
+def refresh():
+    """Reload the snapshot if another process stored results since the last load; runs off the request path."""
+    if _marker() != _state["marker"]: warm()
+
+def update(statuses):
+    """Fold collector.status_row() rows into the snapshot; called after each stored collection."""
+    with _lock:
+        for r in statuses:
+            cur = _snapshot.setdefault(r["node_id"], {"host": "", "capacity": 0.0, "last_seen": None})
+            if r.get("host"): cur["host"] = r["host"]
+            if "capacity_mbps" in r: cur["capacity"] = r["capacity_mbps"] or 0.0
+            cur["up"] = r["running"]; cur["sessions"] = r["sessions"]; cur["bytes_total"] = r["bytes_total"]
+            cur["mbps"] = r["mbps"]; cur["nat_type"] = r["nat_type"]; cur["duration"] = r.get("duration")
+            if r["status"] == "ok": cur["last_seen"] = _epoch(r["ts"])
+        _state["version"] += 1
+
+def remove(node_id: int):
+    with _lock:
+        _snapshot.pop(node_id, None); _state["version"] += 1
+
+def set_usd_per_gb(value: float):
+    with _lock:
+        _state["usd_per_gb"] = value; _state["version"] += 1
+
+def set_last_run(summary: dict):
+    with _lock:
+        _state["last_run"] = summary; _state["version"] += 1
+
+# (metric, type, help); samples are written in this order, one family at a time
+FAMILIES = [
+    ("myst_node_up", "gauge", "1 if myst-node is running or TequilAPI answers"),
+    ("myst_node_sessions", "gauge", "Sessions reported by TequilAPI"),
+    # the running total kept in session_cursor: only grows, and restarts from 0 if the node is re-added
+    ("myst_node_bytes_total", "counter", "Bytes sent across reported sessions"),
+    ("myst_node_bandwidth_mbps", "gauge", "Interface throughput in Mbps between the last two samples"),
+    ("myst_node_utilization_ratio", "gauge", "Bandwidth divided by configured capacity"),
+    ("myst_node_est_usd", "gauge", "Estimated earnings at the configured USD per GB"),
+    ("myst_node_last_seen_age_seconds", "gauge", "Seconds since the node last answered a collection"),
+    ("myst_node_collect_duration_seconds", "gauge", "Duration of the last collection"),
+    ("myst_node_info", "gauge", "Node metadata"),
+]
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _num(v) -> str:
+    return repr(float(v))
+
+def _build() -> bytes:
+    # text exposition written directly: at thousands of nodes this is several times cheaper than
+    # building prometheus_client metric families for every scrape
+    now = time.time()
+    with _lock:
+        snap = [(nid, dict(v)) for nid, v in _snapshot.items()]
+        usd = _state["usd_per_gb"]; last_run = _state["last_run"]
+    cols = [[] for _ in FAMILIES]
+    up_count = 0
+    for nid, v in sorted(snap):
+        lbl = f'node_id="{nid}",host="{_esc(v.get("host") or "")}"'
+        mbps = v.get("mbps") or 0.0; b = v.get("bytes_total") or 0
+        up_count += 1 if v.get("up") else 0
+        cols[0].append(f"myst_node_up{{{lbl}}} {_num(v.get('up') or 0)}")
+        cols[1].append(f"myst_node_sessions{{{lbl}}} {_num(v.get('sessions') or 0)}")
+        cols[2].append(f"myst_node_bytes_total{{{lbl}}} {_num(b)}")
+        cols[3].append(f"myst_node_bandwidth_mbps{{{lbl}}} {_num(mbps)}")
+        if v.get("capacity"): cols[4].append(f"myst_node_utilization_ratio{{{lbl}}} {_num(mbps / v['capacity'])}")
+        cols[5].append(f"myst_node_est_usd{{{lbl}}} {_num(b / 1e9 * usd)}")
+        if v.get("last_seen") is not None: cols[6].append(f"myst_node_last_seen_age_seconds{{{lbl}}} {_num(max(0.0, now - v['last_seen']))}")
+        if v.get("duration") is not None: cols[7].append(f"myst_node_collect_duration_seconds{{{lbl}}} {_num(v['duration'])}")
+        cols[8].append(f'myst_node_info{{{lbl},nat_type="{_esc(v.get("nat_type") or "")}"}} 1.0')
+    out = []
+    for (name, type_, help_), samples in zip(FAMILIES, cols):
+        out += [f"# HELP {name} {help_}", f"# TYPE {name} {type_}"] + samples
+    out += ["# HELP myst_nodes Nodes known to the panel", "# TYPE myst_nodes gauge",
+            f'myst_nodes{{state="up"}} {_num(up_count)}', f'myst_nodes{{state="down"}} {_num(len(snap) - up_count)}']
+    if last_run:
+        out += ["# HELP myst_collect_run Last Collect All run", "# TYPE myst_collect_run gauge"]
+        out += [f'myst_collect_run{{field="{k}"}} {_num(last_run.get(k, 0))}' for k in ("duration", "total", "ok", "failed", "timeout")]
+    return ("\n".join(out) + "\n").encode()
+
+def render() -> bytes:
+    """Exposition text; rebuilt at most every METRICS_CACHE_TTL seconds or when the snapshot changed."""
+    now = time.monotonic()
+    if _cache["version"] == _state["version"] and now - _cache["at"] < METRICS_CACHE_TTL:
+        return _cache["body"]
+    version = _state["version"]
+    body = _build()
+    _cache.update(version=version, at=now, body=body)
+    return body
@@ -0,0 +1,280 @@
+import os, io, csv, gzip, json, time
+from typing import Optional
+from db import db_conn, split_tags
+
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "1000"))  # rows per executemany
+MAX_REPORTED_ERRORS = 100
+# bookkeeping that belongs to the database it was exported from
+LOCAL_SETTINGS = {"rollup_cursor", "retention_last_run", "collect_last_run", "import_last_report"}
+
+NODE_UPSERT = """INSERT INTO nodes(host,user,port,use_password,password,key_path,wg_port,api_port,wallet_id,payout_address,capacity_mbps,tags,notes,created_at,last_seen,last_metrics)
+    VALUES(:host,:user,:port,:use_password,COALESCE(:password,''),:key_path,:wg_port,:api_port,:wallet_id,:payout_address,:capacity_mbps,:tags,:notes,
+           COALESCE(:created_at, datetime('now')),:last_seen,:last_metrics)
+    ON CONFLICT(host, port, user) DO UPDATE SET use_password=excluded.use_password,
+        password=COALESCE(NULLIF(:password,''), nodes.password), key_path=COALESCE(:key_path, nodes.key_path),
+        wg_port=excluded.wg_port, api_port=excluded.api_port, wallet_id=COALESCE(:wallet_id, nodes.wallet_id),
+        payout_address=COALESCE(:payout_address, nodes.payout_address), capacity_mbps=COALESCE(:capacity_mbps, nodes.capacity_mbps),
+        tags=COALESCE(:tags, nodes.tags), notes=COALESCE(:notes, nodes.notes),
+        last_seen=COALESCE(:last_seen, nodes.last_seen), last_metrics=COALESCE(:last_metrics, nodes.last_metrics)"""
+
+_dec = json.JSONDecoder()
+
+class _JSONStream:
+    """Just enough of an incremental JSON reader to walk a top-level object of arrays one element at a time."""
+    def __init__(self, f, chunk: int = 1 << 16):
+        self.f = f; self.chunk = chunk
+        self.buf = ""; self.i = 0; self.eof = False; self.offset = 0
+
+    def _fill(self) -> bool:
+        if self.eof: return False
+        data = self.f.read(self.chunk)
+        if not data: self.eof = True; return False
+        self.offset += self.i
+        self.buf = self.buf[self.i:] + data; self.i = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.i < len(self.buf) and self.buf[self.i] in " \t\r\n": self.i += 1
+            if self.i < len(self.buf): return self.buf[self.i]
+            if not self._fill(): return ""
+
+    def take(self, expected: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in expected:
+            raise ValueError(f"malformed JSON at offset {self.offset + self.i}: expected one of {expected!r}")
+        self.i += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                v, end = _dec.raw_decode(self.buf, self.i)
+            except json.JSONDecodeError:
+                if self._fill(): continue
+                raise ValueError(f"malformed JSON at offset {self.offset + self.i}")
+            # a number that ends exactly at the buffer edge may continue in the next chunk
+            if end == len(self.buf) and not isinstance(v, (dict, list, str)) and self._fill(): continue
+            self.i = end
+            return v
+
+def iter_json(f):
+    """Yield (section, item) from {"nodes": [...], "wallets": [...], ...}; a bare top-level list is read as nodes."""
+    s = _JSONStream(f)
+    if s.peek() == "[":
+        yield from (("nodes", v) for v in _iter_array(s))
+        return
+    s.take("{")
+    if s.peek() == "}": return
+    while True:
+        key = s.value()
+        s.take(":")
+        if s.peek() == "[":
+            for v in _iter_array(s): yield key, v
+        else:
+            yield key, s.value()
+        if s.take(",}") == "}": return
+
+def _iter_array(s: _JSONStream):
+    s.take("[")
+    if s.peek() == "]": s.i += 1; return
+    while True:
+        yield s.value()
+        if s.take(",]") == "]": return
+
+def iter_ndjson(f):
+    """One {"type": "node"|"wallet"|"acl"|"setting", ...} object per line, as written by the streaming export."""
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line: continue
+        try: obj = json.loads(line)
+        except ValueError: raise ValueError(f"malformed NDJSON on line {lineno}")
+        if not isinstance(obj, dict): raise ValueError(f"NDJSON line {lineno} is not an object")
+        yield obj.pop("type", "node") + "s", obj
+
+def _blank(v) -> bool:
+    return v is None or (isinstance(v, str) and v.strip() == "")
+
+def _int(d: dict, key: str, default: int, lo: int = 1, hi: int = 65535) -> int:
+    v = d.get(key)
+    if _blank(v): return default
+    try: n = int(str(v).strip())
+    except ValueError: raise ValueError(f"{key} is not an integer: {v!r}")
+    if not lo <= n <= hi: raise ValueError(f"{key} out of range: {n}")
+    return n
+
+def _opt(d: dict, key: str) -> Optional[str]:
+    # None when the column is absent so upserts keep the stored value; '' clears it
+    if key not in d or d[key] is None: return None
+    return str(d[key]).strip()
+
+def node_row(d: dict) -> dict:
+    """Validate one imported node (JSON object or CSV row) into upsert parameters. Raises ValueError."""
+    if not isinstance(d, dict): raise ValueError("node is not an object")
+    host = str(d.get("host") or "").strip()
+    if not host: raise ValueError("host is required")
+    user = str(d.get("user") or "").strip() or "ubuntu"
+    if "use_password" in d and not _blank(d["use_password"]):
+        use_password = 1 if str(d["use_password"]).strip().lower() in ("1", "true", "yes") else 0
+    else:
+        auth = str(d.get("auth") or "password").strip().lower()
+        if auth not in ("password", "key"): raise ValueError(f"auth must be password or key: {auth!r}")
+        use_password = 1 if auth == "password" else 0
+    capacity = None
+    if not _blank(d.get("capacity_mbps")):
+        try: capacity = float(d["capacity_mbps"])
+        except (TypeError, ValueError): raise ValueError(f"capacity_mbps is not a number: {d['capacity_mbps']!r}")
+        if capacity < 0: raise ValueError("capacity_mbps is negative")
+    payout = _opt(d, "payout_address")
+    if payout and not (payout.startswith("0x") and len(payout) == 42):
+        raise ValueError(f"payout_address is not a 0x address: {payout!r}")
+    metrics = d.get("last_metrics")
+    if metrics is not None and not isinstance(metrics, str): metrics = json.dumps(metrics)
+    return {"host": host, "user": user, "port": _int(d, "port", 22), "use_password": use_password,
+            "password": _opt(d, "password"), "key_path": _opt(d, "key_path"),
+            "wg_port": _int(d, "wg_port", 51820), "api_port": _int(d, "api_port", 4050),
+            "wallet_id": None, "payout_address": payout,
+            "capacity_mbps": capacity, "tags": _opt(d, "tags"), "notes": _opt(d, "notes"),
+            "created_at": _opt(d, "created_at") or None, "last_seen": _opt(d, "last_seen") or None, "last_metrics": metrics}
+
+class Importer:
+    """Upserts one import inside a single transaction on `c`; feed rows with add(section, item), then finish()."""
+    def __init__(self, c, batch: int = IMPORT_BATCH):
+        self.c = c; self.batch_size = batch
+        self.t0 = time.monotonic()
+        self.report = {"inserted": 0, "updated": 0, "rejected": 0, "errors": [],
+                       "wallets": {"inserted": 0, "matched": 0}, "acls": 0, "settings": 0}
+        self.known = {(r[1], r[2], r[3]): r[0] for r in c.execute("SELECT id, host, port, user FROM nodes")}
+        self.by_address = {}; self.by_label = {}
+        for r in c.execute("SELECT id, label, address FROM wallets ORDER BY id"):
+            self.by_address.setdefault(r["address"].lower(), r["id"]); self.by_label.setdefault(r["label"], r["id"])
+        self.local_wallets = set(self.by_address.values())
+        self.wallet_map = {}        # wallet id in the file -> id here
+        self.saw_wallets = False
+        self.pending_wallets = []   # (file wallet id, node key) seen before the wallets section
+        self.acls = {(r[0], r[1], r[2]) for r in c.execute("SELECT port, proto, cidr FROM acl")}
+        self.rows = []; self.n = 0
+
+    def _reject(self, error: str):
+        self.report["rejected"] += 1
+        if len(self.report["errors"]) < MAX_REPORTED_ERRORS:
+            self.report["errors"].append({"row": self.n, "error": error})
+
+    def add(self, section: str, item):
+        self.n += 1
+        try:
+            if section == "nodes": self._node(item)
+            elif section == "wallets": self._wallet(item)
+            elif section == "acls": self._acl(item)
+            elif section == "settings": self._setting(item)
+        except ValueError as e:
+            self._reject(f"{section}: {e}")
+        except (KeyError, TypeError, AttributeError) as e:
+            self._reject(f"{section}: bad record ({e.__class__.__name__}: {e})")
+
+    def _node(self, d):
+        row = node_row(d)
+        wallet = d.get("wallet_id")
+        if not _blank(wallet):
+            wallet = int(wallet)
+            if wallet in self.wallet_map: row["wallet_id"] = self.wallet_map[wallet]
+            else: self.pending_wallets.append((wallet, (row["host"], row["port"], row["user"])))
+        elif not _blank(d.get("wallet")):
+            ref = str(d["wallet"]).strip()
+            row["wallet_id"] = self.by_address.get(ref.lower()) or self.by_label.get(ref)
+            if row["wallet_id"] is None: raise ValueError(f"unknown wallet: {ref!r}")
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size: self.flush()
+
+    def _wallet(self, w):
+        self.saw_wallets = True
+        address = str(w["address"]).strip(); label = str(w.get("label") or address).strip()
+        if not address: raise ValueError("wallet address is required")
+        wid = self.by_address.get(address.lower())
+        if wid is None:
+            wid = self.c.execute("INSERT INTO wallets(label,address) VALUES(?,?)", (label, address)).lastrowid
+            self.by_address[address.lower()] = wid; self.by_label.setdefault(label, wid)
+            self.report["wallets"]["inserted"] += 1
+        else:
+            self.report["wallets"]["matched"] += 1
+        if not _blank(w.get("id")): self.wallet_map[int(w["id"])] = wid
+
+    def _acl(self, a):
+        key = (_int(a, "port", 0), str(a.get("proto") or "tcp").strip().lower(), str(a["cidr"]).strip())
+        if key[0] == 0 or not key[2]: raise ValueError("acl needs port and cidr")
+        if key in self.acls: return
+        self.c.execute("INSERT INTO acl(port, proto, cidr, enabled) VALUES(?,?,?,?)", key + (1 if a.get("enabled", 1) else 0,))
+        self.acls.add(key); self.report["acls"] += 1
+
+    def _setting(self, s):
+        if s["key"] in LOCAL_SETTINGS: return
+        self.c.execute("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (s["key"], s["value"]))
+        self.report["settings"] += 1
+
+    def flush(self):
+        if not self.rows: return
+        last_id = self.c.execute("SELECT COALESCE(MAX(id), 0) FROM nodes").fetchone()[0]
+        for r in self.rows:
+            k = (r["host"], r["port"], r["user"])
+            if k in self.known: self.report["updated"] += 1
+            else: self.report["inserted"] += 1; self.known[k] = None
+        self.c.executemany(NODE_UPSERT, self.rows)
+        for r in self.c.execute("SELECT id, host, port, user FROM nodes WHERE id > ?", (last_id,)):
+            self.known[(r[1], r[2], r[3])] = r[0]
+        tagged = [(self.known[(r["host"], r["port"], r["user"])], r["tags"]) for r in self.rows if r["tags"] is not None]
+        if tagged:
+            self.c.executemany("DELETE FROM node_tags WHERE node_id=?", [(nid,) for nid, _ in tagged])
+            self.c.executemany("INSERT OR IGNORE INTO node_tags(tag, node_id) VALUES(?,?)",
+                               [(t, nid) for nid, tags in tagged for t in split_tags(tags)])
+        self.rows = []
+
+    def finish(self) -> dict:
+        self.flush()
+        # node rows that arrived before their wallet: wallet ids in the file refer to the file's wallets,
+        # or to this database's wallets when the file carries none
+        fix = []
+        for wallet, key in self.pending_wallets:
+            wid = self.wallet_map.get(wallet)
+            if wid is None and not self.saw_wallets and wallet in self.local_wallets: wid = wallet
+            if wid is not None: fix.append((wid, key[0], key[1], key[2]))
+        if fix: self.c.executemany("UPDATE nodes SET wallet_id=? WHERE host=? AND port=? AND user=?", fix)
+        self.report["duration"] = round(time.monotonic() - self.t0, 3)
+        return self.report
+
+def _open(f):
+    head = f.read(2); f.seek(0)
+    return gzip.GzipFile(fileobj=f, mode="rb") if head == b"\x1f\x8b" else f
+
+def detect_format(f, filename: str = "") -> str:
+    """json, ndjson or csv from the file name, else from the first line. Leaves `f` rewound."""
+    name = (filename or "").lower().removesuffix(".gz")
+    for ext, fmt in ((".csv", "csv"), (".ndjson", "ndjson"), (".jsonl", "ndjson"), (".json", "json")):
+        if name.endswith(ext): return fmt
+    head = _open(f).read(1 << 16); f.seek(0)
+    first = head.lstrip(b"\xef\xbb\xbf \t\r\n").split(b"\n", 1)[0].strip()
+    if first[:1] == b"[" or first == b"{": return "json"
+    if first[:1] == b"{":
+        try: obj = json.loads(first)
+        except ValueError: return "json"  # first line of a larger document
+        return "ndjson" if isinstance(obj, dict) and "type" in obj else "json"
+    return "csv"
+
+def run(f, fmt: str) -> dict:
+    """Import a binary file object (optionally gzipped) in `fmt`: json, ndjson or csv.
+    All or nothing: a malformed file rolls everything back."""
+    text = io.TextIOWrapper(_open(f), encoding="utf-8-sig", newline="" if fmt == "csv" else None)
+    try:
+        c = db_conn()
+        with c:
+            imp = Importer(c)
+            if fmt == "csv":
+                for row in csv.DictReader(text): imp.add("nodes", row)
+            else:
+                for section, item in (iter_ndjson(text) if fmt == "ndjson" else iter_json(text)):
+                    imp.add(section, item)
+            report = imp.finish()
+    finally:
+        text.detach()
+    report["format"] = fmt
+    return report
@@ -0,0 +1,149 @@
+import os, json, time, zlib, hashlib, secrets, threading, logging
+from datetime import datetime, timedelta
+import collector, probe, sessions
+from db import db_conn, get_setting
+
+AGENT_INTERVAL = float(os.getenv("AGENT_INTERVAL", "60"))     # seconds between agent samples
+AGENT_STALE = float(os.getenv("AGENT_STALE", "300"))          # SSH pull resumes when an agent has been quiet this long
+AGENT_PANEL_URL = os.getenv("AGENT_PANEL_URL", "")            # where agents push; default https://<hostname setting>
+AGENT_VERIFY_TLS = os.getenv("AGENT_VERIFY_TLS", "1") == "1"
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(8 << 20)))       # request body as sent
+INGEST_MAX_INFLATED = int(os.getenv("INGEST_MAX_INFLATED", str(64 << 20)))  # after gunzip
+INGEST_MAX_SAMPLES = int(os.getenv("INGEST_MAX_SAMPLES", "120"))          # per push; older buffered samples are dropped
+INGEST_FLUSH_MS = float(os.getenv("INGEST_FLUSH_MS", "50"))               # pushes arriving this close together share a transaction
+INGEST_BATCH = int(os.getenv("INGEST_BATCH", "2000"))                     # samples per write transaction
+
+log = logging.getLogger("myst.ingest")
+
+class AuthError(Exception):
+    pass
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_token(node_id: int) -> str:
+    """New push token for a node; only its hash is stored, and any earlier token stops working."""
+    token = secrets.token_urlsafe(32)
+    with db_conn() as c:
+        c.execute("""INSERT INTO node_agents(node_id, token_hash, created) VALUES(?,?,?)
+                     ON CONFLICT(node_id) DO UPDATE SET token_hash=excluded.token_hash, created=excluded.created""",
+                  (node_id, _hash(token), datetime.utcnow().isoformat()))
+    return token
+
+def authenticate(token: str) -> dict:
+    if not token: raise AuthError("missing token")
+    with db_conn() as c:
+        r = c.execute("""SELECT n.id, n.host, n.capacity_mbps FROM node_agents a JOIN nodes n ON n.id=a.node_id
+                         WHERE a.token_hash=?""", (_hash(token),)).fetchone()
+    if not r: raise AuthError("unknown token")
+    return dict(r)
+
+def panel_url(base_url: str) -> str:
+    if AGENT_PANEL_URL: return AGENT_PANEL_URL.rstrip("/")
+    host = get_setting("hostname")
+    return f"https://{host}" if host else base_url.rstrip("/")
+
+def agent_config(n: dict, token: str, url: str) -> dict:
+    """What the agent runs on the node: the collector's own probe commands and TequilAPI endpoints."""
+    api = {k: [path, t] for k, (path, t) in probe.API_ENDPOINTS.items()}
+    api["api_sessions"][0] = sessions.path(sessions.cursor(n["id"]), "{page}")
+    return {"url": url + "/api/ingest", "token": token, "interval": AGENT_INTERVAL, "verify_tls": AGENT_VERIFY_TLS,
+            "api_port": n.get("api_port") or 4050, "commands": probe.commands(n.get("api_port") or 4050, api=False), "api": api}
+
+def decode(body: bytes, encoding: str = "") -> dict:
+    if len(body) > INGEST_MAX_BYTES: raise ValueError("payload too large")
+    if "gzip" in (encoding or "").lower():
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try: body = d.decompress(body, INGEST_MAX_INFLATED)
+        except zlib.error as e: raise ValueError(f"bad gzip body: {e}")
+        if d.unconsumed_tail: raise ValueError("payload too large once inflated")
+    try: doc = json.loads(body)
+    except ValueError as e: raise ValueError(f"invalid JSON: {e}")
+    if not isinstance(doc, dict) or not isinstance(doc.get("samples"), list):
+        raise ValueError("expected {\"samples\": [...]}")
+    return doc
+
+def _ts(v, now: datetime) -> str:
+    # the node's clock is trusted for buffered samples, but not into the future
+    try: t = datetime.fromisoformat(str(v).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError: return now.isoformat()
+    return (t if t <= now + timedelta(minutes=5) else now).isoformat()
+
+def to_result(n: dict, sample: dict, now: datetime) -> dict:
+    """A pushed sample in the shape collector.collect_node() returns, so both feed store_results()."""
+    data = sample.get("data") if isinstance(sample, dict) else None
+    if not isinstance(data, dict): raise ValueError("sample without data")
+    sections = {}
+    for k, v in data.items():
+        if isinstance(v, dict):
+            rc = v.get("rc", 255)
+            # a ValueError is a 400, which makes the agent drop the batch instead of retrying it forever
+            if not isinstance(rc, int) or isinstance(rc, bool): raise ValueError(f"section {k}: rc must be an integer")
+            sections[k] = {"rc": rc, "out": str(v.get("out") or ""), "err": str(v.get("err") or "")}
+            if "complete" in v: sections[k]["complete"] = bool(v["complete"])
+    status = "failed" if not sections or all(v["rc"] == 255 for v in sections.values()) else "ok"
+    return {"id": n["id"], "host": n.get("host"), "capacity_mbps": n.get("capacity_mbps"), "status": status,
+            "error": "" if status == "ok" else "agent sent no usable sections", "data": collector.summarize(sections),
+            "ts": _ts(sample.get("ts"), now), "duration": sample.get("duration")}
+
+class Writer:
+    """Group commit: pushes that arrive within INGEST_FLUSH_MS of each other are written in one transaction."""
+    def __init__(self, delay: float = INGEST_FLUSH_MS / 1000, max_batch: int = INGEST_BATCH):
+        self.delay = delay
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._queue = []  # [(results, agent_row, done_event, box)]
+        self._thread = None
+
+    def submit(self, results: list, agent: dict, timeout: float = 30):
+        done, box = threading.Event(), {}
+        with self._cond:
+            self._queue.append((results, agent, done, box))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="ingest-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if not done.wait(timeout): raise TimeoutError("ingest write timed out")
+        if "error" in box: raise box["error"]
+
+    def _take(self) -> list:
+        with self._cond:
+            while not self._queue: self._cond.wait()
+        time.sleep(self.delay)  # let pushes that are in flight join this transaction
+        with self._cond:
+            batch, n = [], 0
+            while self._queue and (not batch or n + len(self._queue[0][0]) <= self.max_batch):
+                item = self._queue.pop(0); batch.append(item); n += len(item[0])
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take()
+            try:
+                results = [r for item in batch for r in item[0]]
+                now = time.time()
+                # a node that pushes is not pulled over SSH until it has been quiet for AGENT_STALE
+                sched = {a["node_id"]: {"node_id": a["node_id"], "next_run": now + AGENT_STALE, "interval": AGENT_INTERVAL,
+                                        "last_run": a["last_push"], "last_duration": None, "last_status": "push",
+                                        "failures": 0, "stable": 0, "last_sig": None} for _, a, _, _ in batch}
+                collector.store_results(results, list(sched.values()))
+                with db_conn() as c:
+                    c.executemany("UPDATE node_agents SET last_push=:last_push, version=:version WHERE node_id=:node_id",
+                                  [a for _, a, _, _ in batch])
+            except Exception as e:
+                log.exception("ingest batch of %d pushes failed", len(batch))
+                for _, _, _, box in batch: box["error"] = e
+            for _, _, done, _ in batch: done.set()
+
+writer = Writer()
+
+def handle(token: str, body: bytes, encoding: str = "") -> dict:
+    """One agent push: authenticate, decode, queue for the next group commit, and tell the agent where to resume."""
+    n = authenticate(token)
+    doc = decode(body, encoding)
+    now = datetime.utcnow()
+    results = [to_result(n, s, now) for s in doc["samples"][-INGEST_MAX_SAMPLES:]]
+    if results:
+        writer.submit(results, {"node_id": n["id"], "last_push": now.isoformat(), "version": str(doc.get("agent") or "")[:32]})
+    return {"accepted": len(results), "interval": AGENT_INTERVAL,
+            "sessions_path": sessions.path(sessions.cursor(n["id"]), "{page}")}
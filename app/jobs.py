@@ -0,0 +1,154 @@
+import os, time, zlib, asyncio, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+from db import db_conn
+from leader import OWNER, WEB_WORKERS
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# seconds between appends of a running job's new output to job_log, so workers other than the one running it
+# can stream it; a single worker streams from memory and never needs it
+JOB_LOG_FLUSH = float(os.getenv("JOB_LOG_FLUSH", "2" if WEB_WORKERS > 1 else "0"))
+
+log = logging.getLogger("myst.jobs")
+
+class Job:
+    """A running job's live output. Workers call write(); streams read chunks from an offset."""
+    def __init__(self, job_id: int):
+        self.id = job_id
+        self.chunks = []
+        self.count = 0
+        self.done = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._stored = 0  # chunks already in job_log
+
+    def write(self, text: str):
+        if not text: return
+        with self._lock:
+            self.chunks.append(text); self.count += 1
+        if JOB_LOG_FLUSH and self.id and time.monotonic() - self._flushed >= JOB_LOG_FLUSH:
+            self.flush()
+
+    def flush(self):
+        # only the chunks since the last flush, keyed by the index of the first, so readers can resume after a seq
+        with self._flush_lock:
+            with self._lock:
+                seq, new = self._stored, "".join(self.chunks[self._stored:])
+                self._stored = len(self.chunks)
+            self._flushed = time.monotonic()
+            if not new: return
+            with db_conn() as c:
+                c.execute("INSERT INTO job_log(job_id, seq, text) VALUES(?,?,?)", (self.id, seq, new))
+
+    def read(self, offset: int):
+        with self._lock:
+            return self.chunks[offset:], self.count
+
+    def text(self) -> str:
+        with self._lock:
+            return "".join(self.chunks)
+
+_live = {}
+_ex = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+def create(kind: str, node_id: Optional[int]) -> int:
+    with db_conn() as c:
+        job_id = c.execute("INSERT INTO jobs(kind, node_id, state, created, owner) VALUES(?,?,'queued',?,?)",
+                           (kind, node_id, _now(), OWNER)).lastrowid
+    _live[job_id] = Job(job_id)
+    return job_id
+
+def submit(kind: str, node_id: Optional[int], fn) -> int:
+    """Queue fn(job) -> bool in the background and return the job id immediately."""
+    job_id = create(kind, node_id)
+    start(job_id, fn)
+    return job_id
+
+def start(job_id: int, fn):
+    """Queue a created job in the background, for callers that record its id before it runs."""
+    _ex.submit(_run, _live[job_id], fn)
+
+def execute(job_id: int, fn) -> bool:
+    """Run a created job in the calling thread, for callers that bring their own concurrency (rollouts)."""
+    return _run(_live[job_id], fn)
+
+def _run(job: Job, fn) -> bool:
+    with db_conn() as c:
+        c.execute("UPDATE jobs SET state='running', started=? WHERE id=?", (_now(), job.id))
+    ok, error = False, None
+    try:
+        ok = bool(fn(job))
+    except Exception as e:
+        log.exception("job %s failed", job.id)
+        error = str(e); job.write(f"\n[error] {e}\n")
+    finally:
+        state = "succeeded" if ok else "failed"
+        with db_conn() as c:
+            c.execute("UPDATE jobs SET state=?, finished=?, error=?, log=? WHERE id=?",
+                      (state, _now(), error, zlib.compress(job.text().encode(), 6), job.id))
+            c.execute("DELETE FROM job_log WHERE job_id=?", (job.id,))
+        job.done = True
+        _live.pop(job.id, None)
+    return ok
+
+def get(job_id: int) -> Optional[dict]:
+    with db_conn() as c:
+        r = c.execute("SELECT id, kind, node_id, state, created, started, finished, error FROM jobs WHERE id=?", (job_id,)).fetchone()
+    return dict(r) if r else None
+
+def recent(limit: int = 100, node_id: Optional[int] = None) -> list:
+    q = "SELECT id, kind, node_id, state, created, started, finished, error FROM jobs"
+    args = ()
+    if node_id is not None: q += " WHERE node_id=?"; args = (node_id,)
+    with db_conn() as c:
+        return [dict(r) for r in c.execute(q + " ORDER BY id DESC LIMIT ?", args + (limit,))]
+
+def full_log(job_id: int) -> Optional[str]:
+    job = _live.get(job_id)
+    if job: return job.text()
+    with db_conn() as c:
+        r = c.execute("SELECT log FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if r and not r["log"]:
+            # running in another worker, or cut off by a restart: what it had flushed so far
+            return "".join(x["text"] for x in c.execute("SELECT text FROM job_log WHERE job_id=? ORDER BY seq", (job_id,)))
+    if not r: return None
+    return zlib.decompress(r["log"]).decode(errors="replace")
+
+def _log_since(job_id: int, seq: int) -> list:
+    with db_conn() as c:
+        return [(x["seq"], x["text"]) for x in c.execute("SELECT seq, text FROM job_log WHERE job_id=? AND seq>? ORDER BY seq", (job_id, seq))]
+
+def _sse(data: str, event: Optional[str] = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return head + "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+
+async def stream(job_id: int, poll: float = 0.5):
+    """Server-sent events: output chunks as they arrive, then an 'end' event with the final state."""
+    job = _live.get(job_id)
+    offset = 0
+    while job is not None:
+        finished = job.done
+        chunks, offset = job.read(offset)
+        if chunks: yield _sse("".join(chunks))
+        if finished: break
+        await asyncio.sleep(poll)
+    if job is None:
+        # running in another worker: follow the chunks it appends to job_log, then send the rest of the final log
+        sent, seq = 0, -1
+        while True:
+            if (get(job_id) or {}).get("state") not in ("queued", "running") or not JOB_LOG_FLUSH:
+                text = full_log(job_id) or ""
+                if len(text) > sent: yield _sse(text[sent:])
+                break
+            new = _log_since(job_id, seq)
+            if new:
+                seq = new[-1][0]; text = "".join(t for _, t in new)
+                yield _sse(text); sent += len(text)
+            await asyncio.sleep(max(poll, JOB_LOG_FLUSH / 2))
+    info = get(job_id) or {}
+    yield _sse(info.get("state", "unknown"), event="end")
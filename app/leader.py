@@ -0,0 +1,108 @@
+import os, time, socket, secrets, threading, logging
+from typing import Optional
+from db import db_conn
+
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS", "1")))  # uvicorn worker processes serving the panel
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))          # seconds a lease outlives its last renewal
+
+# this process in leases and in jobs.owner / rollouts.owner
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+LEADER = "leader"
+WORKER = "worker:"  # + owner: one heartbeat lease per live process
+
+log = logging.getLogger("myst.leader")
+
+def acquire(name: str, owner: str = OWNER, ttl: float = LEASE_TTL) -> bool:
+    """Take or renew a lease; succeeds if it is free, expired or already ours. One statement, so it is atomic
+    across processes."""
+    now = time.time()
+    with db_conn() as c:
+        c.execute("""INSERT INTO leases(name, owner, expires) VALUES(?,?,?)
+                     ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires=excluded.expires
+                     WHERE leases.owner=excluded.owner OR leases.expires < ?""", (name, owner, now + ttl, now))
+        r = c.execute("SELECT owner FROM leases WHERE name=?", (name,)).fetchone()
+    return r is not None and r["owner"] == owner
+
+def release(name: str, owner: str = OWNER):
+    with db_conn() as c:
+        c.execute("DELETE FROM leases WHERE name=? AND owner=?", (name, owner))
+
+def holder(name: str) -> Optional[str]:
+    with db_conn() as c:
+        r = c.execute("SELECT owner FROM leases WHERE name=? AND expires >= ?", (name, time.time())).fetchone()
+    return r["owner"] if r else None
+
+def recover():
+    """Jobs and rollouts whose process is gone never finish: fail the jobs, pause the rollouts (Resume
+    re-deploys the nodes that were in flight). Rows from before owners were recorded count as orphaned."""
+    now = time.time()
+    alive = "SELECT substr(name, length(:prefix) + 1) FROM leases WHERE name LIKE :prefix || '%' AND expires >= :now"
+    args = {"prefix": WORKER, "now": now}
+    with db_conn() as c:
+        n = c.execute(f"""UPDATE jobs SET state='failed', error='interrupted by restart'
+                          WHERE state IN ('queued','running') AND (owner IS NULL OR owner NOT IN ({alive}))""", args).rowcount
+        rids = [r["id"] for r in c.execute(f"SELECT id FROM rollouts WHERE state='running' AND (owner IS NULL OR owner NOT IN ({alive}))", args)]
+        for rid in rids:
+            c.execute("UPDATE rollout_nodes SET state='pending', job_id=NULL WHERE rollout_id=? AND state='running'", (rid,))
+            c.execute("UPDATE rollouts SET state='paused', error='interrupted by restart' WHERE id=?", (rid,))
+        c.execute("DELETE FROM leases WHERE expires < ?", (now - LEASE_TTL,))
+    if n or rids: log.warning("recovered %d interrupted jobs and %d rollouts", n, len(rids))
+
+class Elector:
+    """Keeps this process's heartbeat lease and competes for the leader lease. The leader runs on_elected work
+    (collection, maintenance) until it loses the lease; every worker serves requests either way."""
+    def __init__(self, ttl: float = LEASE_TTL):
+        self.ttl = ttl
+        self.leading = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._on_elected = self._on_demoted = None
+        self._renewed = 0.0
+
+    def start(self, on_elected, on_demoted):
+        if self._thread: return
+        self._on_elected, self._on_demoted = on_elected, on_demoted
+        self._stop.clear()
+        # the heartbeat lease must exist before this worker creates jobs, or the leader would recover them
+        try: self.tick()
+        except Exception: log.exception("lease renewal failed")
+        self._thread = threading.Thread(target=self._loop, name="elector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+        self._thread = None
+        if self.leading: self._demote()
+        # let the next leader recover this process's jobs right away instead of after the TTL
+        try: release(LEADER); release(WORKER + OWNER)
+        except Exception: log.exception("releasing leases failed")
+
+    def _demote(self):
+        self.leading = False
+        try: self._on_demoted()
+        except Exception: log.exception("leader shutdown failed")
+
+    def tick(self):
+        acquire(WORKER + OWNER, ttl=self.ttl)
+        lead = acquire(LEADER, ttl=self.ttl)
+        self._renewed = time.monotonic()
+        if lead and not self.leading:
+            log.info("elected leader (%s)", OWNER)
+            self.leading = True
+            self._on_elected()
+        elif not lead and self.leading:
+            log.warning("lost the leader lease to %s", holder(LEADER))
+            self._demote()
+        if self.leading: recover()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try: self.tick()
+            except Exception:
+                log.exception("lease renewal failed")
+                # past the TTL another process may already lead; stop before two collectors overlap
+                if self.leading and time.monotonic() - self._renewed > self.ttl: self._demote()
+            self._stop.wait(self.ttl / 3)
+
+elector = Elector()
@@ -1,86 +1,31 @@
 
-import os, json, sqlite3, subprocess, secrets, csv, io
+import os, json, time, sqlite3, subprocess, secrets, csv, io
 from datetime import datetime
-from typing import Optional
-from fastapi import FastAPI, Request, Form, HTTPException, Depends, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, FileResponse
+from typing import List, Optional
+from fastapi import FastAPI, Request, Form, HTTPException, Depends, UploadFile, File, Query
+from fastapi.responses import Response, HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from jinja2 import Environment, FileSystemLoader, select_autoescape
-import paramiko
+from sshpool import pool
+from db import DB_PATH, db_conn, db_init, get_setting, set_setting, set_node_tags, shared_secret
+import backup, core, exporter, importer, ingest, jobs, leader, nodelist, rollout, rollups, tequilapi, ufw
+from leader import WEB_WORKERS
+from scheduler import scheduler, housekeeping, SCHEDULER_ENABLED
 
-DB_PATH = os.getenv("MYST_MANAGER_DB", "/opt/myst-manager/manager.db")
 HOST = os.getenv("UVICORN_HOST", "0.0.0.0")
 PORT = int(os.getenv("UVICORN_PORT", "8080"))
 ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin")
-SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_hex(32))
+# every worker must sign sessions with the same key, so the fallback is persisted rather than random per process
+SECRET_KEY = os.getenv("SECRET_KEY") or shared_secret()
 
 app = FastAPI()
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY, same_site="lax")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 env = Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape())
 
-def db_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def db_init():
-    with db_conn() as c:
-        c.execute("""CREATE TABLE IF NOT EXISTS nodes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            host TEXT NOT NULL,
-            user TEXT NOT NULL,
-            port INTEGER NOT NULL DEFAULT 22,
-            use_password INTEGER NOT NULL DEFAULT 1,
-            password TEXT,
-            key_path TEXT,
-            wg_port INTEGER NOT NULL DEFAULT 51820,
-            api_port INTEGER NOT NULL DEFAULT 4050,
-            wallet_id INTEGER,
-            payout_address TEXT,
-            capacity_mbps REAL,
-            tags TEXT,
-            notes TEXT,
-            created_at TEXT,
-            last_seen TEXT,
-            last_metrics TEXT
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS acl (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            port INTEGER NOT NULL,
-            proto TEXT NOT NULL DEFAULT 'tcp',
-            cidr TEXT NOT NULL,
-            enabled INTEGER NOT NULL DEFAULT 1
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS wallets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            label TEXT NOT NULL,
-            address TEXT NOT NULL
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            node_id INTEGER NOT NULL,
-            ts TEXT NOT NULL,
-            sessions INTEGER,
-            bytes_total INTEGER,
-            api_ok INTEGER,
-            nat_type TEXT
-        )""")
-        cols = [r[1] for r in c.execute("PRAGMA table_info(nodes)")]
-        if "api_port" not in cols:
-            c.execute("ALTER TABLE nodes ADD COLUMN api_port INTEGER NOT NULL DEFAULT 4050")
-        if "capacity_mbps" not in cols:
-            c.execute("ALTER TABLE nodes ADD COLUMN capacity_mbps REAL")
-        if "tags" not in cols:
-            c.execute("ALTER TABLE nodes ADD COLUMN tags TEXT")
-        if "created_at" not in cols:
-            c.execute("ALTER TABLE nodes ADD COLUMN created_at TEXT")
 db_init()
 
 def require_login(request: Request):
@@ -110,36 +55,22 @@ def logout(request: Request):
 def home_redirect():
     return RedirectResponse("/nodes", status_code=302)
 
-def get_setting(key: str, default: Optional[str]=None) -> Optional[str]:
-    with db_conn() as c:
-        r = c.execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
-        return r["value"] if r else default
-
-def get_wallet_address(wallet_id: Optional[int]) -> Optional[str]:
-    if not wallet_id: return None
-    with db_conn() as c:
-        r = c.execute("SELECT address FROM wallets WHERE id=?", (wallet_id,)).fetchone()
-        return r["address"] if r else None
-
 @app.get("/nodes", response_class=HTMLResponse)
 def nodes_page(request: Request, _: bool = Depends(require_login)):
-    with db_conn() as c:
-        nodes = [dict(r) for r in c.execute("SELECT n.*, w.label AS wallet_label FROM nodes n LEFT JOIN wallets w ON n.wallet_id=w.id ORDER BY id DESC")]
     usd_per_gb = float(get_setting("usd_per_gb","0") or 0)
+    with db_conn() as c:
+        nodes = [dict(r) for r in c.execute(f"SELECT {nodelist.COLUMNS} FROM {nodelist.FROM} ORDER BY n.id DESC", {"usd_per_gb": usd_per_gb})]
+        fleet = dict(c.execute("""SELECT COUNT(*) AS total, COALESCE(SUM(st.running), 0) AS running,
+                                  COALESCE(SUM(st.sessions), 0) AS sessions, round(COALESCE(SUM(st.mbps), 0), 3) AS mbps
+                                  FROM nodes n LEFT JOIN node_status st ON st.node_id=n.id""").fetchone())
+    now = time.time()
     for n in nodes:
-        lm = json.loads(n["last_metrics"]) if n["last_metrics"] else {}
-        docker_out = (lm.get("docker") or {}).get("out","")
-        api_ok = ((lm.get("api_health") or {}).get("out","") or "").strip() != ""
-        n["myst_running"] = ("myst-node" in docker_out) or api_ok
-        n["sessions"] = (lm.get("sessions") or {}).get("count", 0)
-        n["bandwidth_mbps"] = (lm.get("bandwidth") or {}).get("mbps", 0.0)
-        n["nat_type"] = (lm.get("nat") or {}).get("type","")
-        cap = n.get("capacity_mbps") or 0.0
-        n["utilization_pct"] = round((n["bandwidth_mbps"]/cap)*100,1) if cap else None
-        bytes_total = (lm.get("sessions") or {}).get("bytes", 0)
-        n["est_usd"] = round((bytes_total/1e9) * usd_per_gb, 4) if usd_per_gb else 0.0
+        n["next_in"] = max(0, int(n["next_run"] - now)) if n.get("next_run") else None
+        n["breaker_in"] = max(0, int(n["breaker_retry"] - now)) if n.get("breaker_retry") else None
+    last_run = json.loads(get_setting("collect_last_run") or "{}")
+    last_import = json.loads(get_setting("import_last_report") or "{}")
     tmpl = env.get_template("nodes.html")
-    return tmpl.render(nodes=nodes, usd_per_gb=usd_per_gb)
+    return tmpl.render(nodes=nodes, usd_per_gb=usd_per_gb, last_run=last_run, last_import=last_import, fleet=fleet)
 
 @app.get("/wallets", response_class=HTMLResponse)
 def wallets_page(request: Request, _: bool = Depends(require_login)):
@@ -153,7 +84,8 @@ def server_page(request: Request, _: bool = Depends(require_login)):
     with db_conn() as c:
         acls  = [dict(r) for r in c.execute("SELECT * FROM acl ORDER BY port, id")]
     tmpl = env.get_template("server.html")
-    return tmpl.render(acls=acls, port_panel=PORT)
+    acl_last = json.loads(get_setting("acl_last_apply") or "{}")
+    return tmpl.render(acls=acls, port_panel=PORT, acl_last=acl_last, backups=backup.list_snapshots(), backup_keep=backup.BACKUP_KEEP)
 
 @app.get("/settings", response_class=HTMLResponse)
 def settings_page(request: Request, _: bool = Depends(require_login)):
@@ -174,6 +106,8 @@ def settings_save(hostname: str = Form(""), le_email: str = Form(""),
         c.execute("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", ("telegram_token", telegram_token.strip()))
         c.execute("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", ("telegram_chat", telegram_chat.strip()))
         c.execute("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", ("usd_per_gb", usd_per_gb.strip()))
+    try: exporter.set_usd_per_gb(float(usd_per_gb.strip() or 0))
+    except ValueError: pass
     return RedirectResponse("/settings", status_code=303)
 
 @app.post("/wallets/add")
@@ -196,238 +130,230 @@ def add_node(host: str = Form(...), user: str = Form(...), port: int = Form(22),
              capacity_mbps: float = Form(None), payout_address: str = Form(""), tags: str = Form(""),
              notes: str = Form(""), _: bool = Depends(require_login)):
     use_password = 1 if auth_type == "password" else 0
-    with db_conn() as c:
-        c.execute("""INSERT INTO nodes(host,user,port,use_password,password,key_path,wg_port,api_port,wallet_id,payout_address,capacity_mbps,tags,notes,created_at,last_seen,last_metrics)
-                     VALUES(?,?,?,?,?,?,?,?,?,?,?,?,datetime('now'),NULL,NULL)""",
-                  (host,user,port,use_password,password,key_path,wg_port,api_port,None,payout_address or None,capacity_mbps,tags,notes))
+    try:
+        with db_conn() as c:
+            node_id = c.execute("""INSERT INTO nodes(host,user,port,use_password,password,key_path,wg_port,api_port,wallet_id,payout_address,capacity_mbps,tags,notes,created_at,last_seen,last_metrics)
+                         VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,datetime('now'),NULL,NULL)""",
+                      (host,user,port,use_password,password,key_path,wg_port,api_port,None,payout_address or None,capacity_mbps,tags,notes)).lastrowid
+            set_node_tags(c, node_id, tags)
+    except sqlite3.IntegrityError:
+        raise HTTPException(409, f"Node {user}@{host}:{port} already exists")
     return RedirectResponse("/nodes", status_code=303)
 
 @app.post("/nodes/{node_id}/delete")
 def node_delete(node_id: int, _: bool = Depends(require_login)):
-    with db_conn() as c:
-        c.execute("DELETE FROM nodes WHERE id=?", (node_id,))
+    core.delete_node(node_id)
     return RedirectResponse("/nodes", status_code=303)
 
 @app.post("/nodes/{node_id}/deploy")
-def deploy(node_id: int, request: Request, _: bool = Depends(require_login)):
-    mgmt_ip = request.client.host
+def deploy(node_id: int, request: Request, agent: bool = Form(False), redeploy: bool = Form(False),
+           _: bool = Depends(require_login)):
+    n = core.node(node_id)
+    if not n: raise HTTPException(404, "Node not found")
+    job_id = core.deploy_node(n, request.client.host, ingest.panel_url(str(request.base_url)) if agent else None, redeploy)
+    if job_id is None:
+        return RedirectResponse("/nodes", status_code=303)
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse({"job_id": job_id}, status_code=202)
+    return RedirectResponse(f"/jobs/{job_id}", status_code=303)
+
+@app.get("/rollouts", response_class=HTMLResponse)
+def rollouts_page(request: Request, _: bool = Depends(require_login)):
     with db_conn() as c:
-        r = c.execute("SELECT * FROM nodes WHERE id=?", (node_id,)).fetchone()
-    if not r: raise HTTPException(404, "Node not found")
-    n = dict(r)
-    if n.get("last_metrics"):
-        lm = json.loads(n["last_metrics"])
-        docker_out = (lm.get("docker") or {}).get("out","")
-        api_ok = ((lm.get("api_health") or {}).get("out","") or "").strip() != ""
-        if ("myst-node" in docker_out) or api_ok:
-            return RedirectResponse("/nodes", status_code=303)
-    payout = n.get("payout_address") or get_wallet_address(n.get("wallet_id"))
-    res = {"ok": False, "stdout": "", "stderr": ""}
+        tags = [r["tag"] for r in c.execute("SELECT DISTINCT tag FROM node_tags ORDER BY tag")]
+    tmpl = env.get_template("rollouts.html")
+    return tmpl.render(rollouts=rollout.recent(), tags=tags, defaults={"canary": rollout.ROLLOUT_CANARY,
+                       "wave_size": rollout.ROLLOUT_WAVE_SIZE, "concurrency": rollout.ROLLOUT_CONCURRENCY,
+                       "max_failure_pct": round(rollout.ROLLOUT_MAX_FAILURE * 100)})
+
+@app.post("/rollouts")
+def rollouts_create(request: Request, tag: str = Form(""), nat: str = Form(""), running: str = Form(""), node_ids: str = Form(""),
+                    canary: int = Form(rollout.ROLLOUT_CANARY), wave_size: int = Form(rollout.ROLLOUT_WAVE_SIZE),
+                    concurrency: int = Form(rollout.ROLLOUT_CONCURRENCY), max_failure_pct: float = Form(rollout.ROLLOUT_MAX_FAILURE * 100),
+                    redeploy: bool = Form(False), agent: bool = Form(False), _: bool = Depends(require_login)):
+    selector = {"tag": tag.strip() or None, "nat": nat.strip() or None,
+                "running": {"yes": True, "no": False}.get(running),
+                "node_ids": [int(x) for x in node_ids.replace(",", " ").split() if x.isdigit()] or None}
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        if n["use_password"]:
-            client.connect(n["host"], port=n["port"], username=n["user"], password=n.get("password"), timeout=60)
-        else:
-            pkey = paramiko.RSAKey.from_private_key_file(n.get("key_path"))
-            client.connect(n["host"], port=n["port"], username=n["user"], pkey=pkey, timeout=60)
-        sftp = client.open_sftp()
-        sftp.put("/opt/myst-manager/remote_install.sh", "/tmp/remote_install.sh")
-        sftp.chmod("/tmp/remote_install.sh", 0o755)
-        sftp.close()
-        cmd = f"sudo MGMT_IP='{mgmt_ip}' PAYOUT_ADDRESS='{payout or ''}' WG_PORT='{n['wg_port']}' API_PORT='{n['api_port']}' bash /tmp/remote_install.sh --non-interactive"
-        stdin, stdout, stderr = client.exec_command(cmd, timeout=1200)
-        out = stdout.read().decode()
-        err = stderr.read().decode()
-        rc = stdout.channel.recv_exit_status()
-        res['ok'] = (rc == 0)
-        res['stdout'] = out[-4000:]
-        res['stderr'] = err[-4000:]
-    except Exception as e:
-        res['stderr'] = str(e)
-    now = datetime.utcnow().isoformat()
-    with db_conn() as c:
-        c.execute("UPDATE nodes SET last_seen=?, last_metrics=? WHERE id=?", (now, json.dumps(res), node_id))
-    return RedirectResponse("/nodes", status_code=303)
+        rid = rollout.create(rollout.select(**selector), selector, request.client.host, canary=canary, wave_size=wave_size,
+                             concurrency=concurrency, max_failure=max_failure_pct / 100, redeploy=redeploy,
+                             agent_url=ingest.panel_url(str(request.base_url)) if agent else None)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse({"rollout_id": rid}, status_code=202)
+    return RedirectResponse(f"/rollouts/{rid}", status_code=303)
+
+@app.get("/rollouts/{rollout_id}", response_class=HTMLResponse)
+def rollout_page(rollout_id: int, _: bool = Depends(require_login)):
+    r = rollout.progress(rollout_id)
+    if not r: raise HTTPException(404, "Rollout not found")
+    tmpl = env.get_template("rollout.html")
+    return tmpl.render(r=r)
+
+@app.get("/api/rollouts/{rollout_id}")
+def rollout_api(rollout_id: int, _: bool = Depends(require_login)):
+    r = rollout.progress(rollout_id)
+    if not r: raise HTTPException(404, "Rollout not found")
+    return JSONResponse(r)
+
+@app.post("/rollouts/{rollout_id}/{action}")
+def rollout_action(rollout_id: int, action: str, _: bool = Depends(require_login)):
+    fn = {"pause": rollout.pause, "resume": rollout.resume, "cancel": rollout.cancel}.get(action)
+    if fn is None: raise HTTPException(404, "Unknown action")
+    if not rollout.get(rollout_id): raise HTTPException(404, "Rollout not found")
+    if not fn(rollout_id): raise HTTPException(409, f"Cannot {action} the rollout in its current state")
+    return RedirectResponse(f"/rollouts/{rollout_id}", status_code=303)
+
+@app.get("/jobs", response_class=HTMLResponse)
+def jobs_page(request: Request, node_id: Optional[int] = None, _: bool = Depends(require_login)):
+    tmpl = env.get_template("jobs.html")
+    return tmpl.render(jobs=jobs.recent(200, node_id))
+
+@app.get("/jobs/{job_id}", response_class=HTMLResponse)
+def job_page(job_id: int, request: Request, _: bool = Depends(require_login)):
+    job = jobs.get(job_id)
+    if not job: raise HTTPException(404, "Job not found")
+    tmpl = env.get_template("job.html")
+    return tmpl.render(job=job)
+
+@app.get("/jobs/{job_id}/stream")
+def job_stream(job_id: int, _: bool = Depends(require_login)):
+    if not jobs.get(job_id): raise HTTPException(404, "Job not found")
+    return StreamingResponse(jobs.stream(job_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/log")
+def job_log(job_id: int, _: bool = Depends(require_login)):
+    text = jobs.full_log(job_id)
+    if text is None: raise HTTPException(404, "Job not found")
+    return PlainTextResponse(text)
 
 @app.post("/nodes/{node_id}/collect")
 def collect(node_id: int, _: bool = Depends(require_login)):
-    with db_conn() as c:
-        r = c.execute("SELECT * FROM nodes WHERE id=?", (node_id,)).fetchone()
-    if not r: raise HTTPException(404, "Node not found")
-    n = dict(r)
-    api_port = n.get("api_port", 4050)
-    cmds = {
-        "uptime": "uptime -p",
-        "docker": "docker ps --format '{{.Names}}|{{.Status}}' | grep myst-node || true",
-        "ufw": "ufw status | sed -n '1,30p'",
-        "traffic": "command -v vnstat >/dev/null 2>&1 && vnstat --oneline b || echo 'vnstat not installed'",
-        "api_health": f"curl -s --max-time 2 http://127.0.0.1:{api_port}/tequilapi/health || echo ''",
-        "api_sessions": f"curl -s --max-time 2 http://127.0.0.1:{api_port}/tequilapi/sessions || echo ''",
-        "api_nat": f"curl -s --max-time 2 http://127.0.0.1:{api_port}/tequilapi/nat/type || echo ''"
-    }
-    data = {}
-    def _ssh(cmd):
-        try:
-            if n["use_password"]:
-                client = paramiko.SSHClient(); client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                client.connect(n["host"], port=n["port"], username=n["user"], password=n.get("password"), timeout=25)
-                _, stdout, stderr = client.exec_command(cmd, timeout=25)
-                out, err = stdout.read().decode().strip(), stderr.read().decode().strip()
-                rc = stdout.channel.recv_exit_status(); client.close()
-                return rc, out, err
-            else:
-                client = paramiko.SSHClient(); client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                pkey = paramiko.RSAKey.from_private_key_file(n.get("key_path"))
-                client.connect(n["host"], port=n["port"], username=n["user"], pkey=pkey, timeout=25)
-                _, stdout, stderr = client.exec_command(cmd, timeout=25)
-                out, err = stdout.read().decode().strip(), stderr.read().decode().strip()
-                rc = stdout.channel.recv_exit_status(); client.close()
-                return rc, out, err
-        except Exception as e:
-            return 255, "", str(e)
-    for k, cmd in cmds.items():
-        rc, out, err = _ssh(cmd); data[k] = {"rc": rc, "out": out, "err": err}
-    sessions_cnt = 0; bytes_total = 0
-    try:
-        ses = data.get("api_sessions",{}).get("out","")
-        if ses:
-            obj = json.loads(ses)
-            if isinstance(obj, list):
-                sessions_cnt = len(obj)
-                for s in obj:
-                    bt = s.get("bytes_sent",0) if isinstance(s,dict) else 0
-                    bytes_total += int(bt) if isinstance(bt,int) else 0
-    except Exception: pass
-    data["sessions"] = {"count": sessions_cnt, "bytes": bytes_total}
-    mbps = 0.0
-    try:
-        tr = data.get("traffic",{}).get("out","")
-        parts = tr.split(";")
-        if len(parts) >= 3:
-            rx = int(parts[1]); tx = int(parts[2]); total = rx + tx
-            mbps = round((total * 8) / (3600 * 24) / 1e6, 3)
-    except Exception: pass
-    data["bandwidth"] = {"mbps": mbps}
-    nat_type = ""
-    try:
-        nat_out = data.get("api_nat",{}).get("out","")
-        nat_type = (json.loads(nat_out).get("type") if nat_out else "") or ""
-    except Exception: pass
-    data["nat"] = {"type": nat_type}
-    now = datetime.utcnow().isoformat()
-    with db_conn() as c:
-        c.execute("UPDATE nodes SET last_seen=?, last_metrics=? WHERE id=?", (now, json.dumps(data), node_id))
-        c.execute("INSERT INTO metrics(node_id, ts, sessions, bytes_total, api_ok, nat_type) VALUES(?,?,?,?,?,?)",
-                  (node_id, now, sessions_cnt, bytes_total, 1 if data.get('api_health',{}).get('out','') else 0, nat_type))
+    n = core.node(node_id)
+    if not n: raise HTTPException(404, "Node not found")
+    core.collect_node(n)
     return RedirectResponse("/nodes", status_code=303)
 
 @app.post("/nodes/collect_all")
 def collect_all(_: bool = Depends(require_login)):
-    with db_conn() as c:
-        ids = [r["id"] for r in c.execute("SELECT id FROM nodes")]
-    for nid in ids:
-        try: collect(nid)
-        except Exception: pass
+    core.collect()
     return RedirectResponse("/nodes", status_code=303)
 
+@app.post("/api/ingest")
+async def api_ingest(request: Request):
+    # push-mode agents; authenticated by their per-node token, not the login session
+    auth = request.headers.get("authorization", "")
+    if not auth.startswith("Bearer "): raise HTTPException(401, "Unauthorized", headers={"WWW-Authenticate": "Bearer"})
+    if int(request.headers.get("content-length") or 0) > ingest.INGEST_MAX_BYTES: raise HTTPException(413, "Payload too large")
+    body = await request.body()
+    try:
+        return await run_in_threadpool(ingest.handle, auth[7:].strip(), body, request.headers.get("content-encoding", ""))
+    except ingest.AuthError:
+        raise HTTPException(401, "Unauthorized", headers={"WWW-Authenticate": "Bearer"})
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except TimeoutError:
+        raise HTTPException(503, "Ingest queue busy", headers={"Retry-After": "30"})
+
+@app.get("/api/collect/last_run")
+def collect_last_run(_: bool = Depends(require_login)):
+    return JSONResponse(json.loads(get_setting("collect_last_run") or "{}"))
+
+@app.get("/api/nodes")
+def api_nodes(sort: str = "id", order: str = "desc", limit: int = 100, cursor: Optional[str] = None,
+              tag: Optional[str] = None, nat: Optional[str] = None, wallet_id: Optional[int] = None,
+              running: Optional[bool] = None, _: bool = Depends(require_login)):
+    try:
+        return nodelist.page(float(get_setting("usd_per_gb","0") or 0), sort=sort, order=order, limit=limit, cursor=cursor,
+                             tag=tag, nat=nat, wallet_id=wallet_id, running=running)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/api/nodes/{node_id}/metrics")
+def node_metrics(node_id: int, start: Optional[str] = None, end: Optional[str] = None, max_points: int = 500,
+                 _: bool = Depends(require_login)):
+    try:
+        t_end = rollups.epoch(end) if end else time.time()
+        t_start = rollups.epoch(start) if start else t_end - 86400
+    except ValueError:
+        raise HTTPException(400, "start/end must be ISO timestamps")
+    if t_start >= t_end: raise HTTPException(400, "start must be before end")
+    return JSONResponse(rollups.query(node_id, t_start, t_end, max(1, min(max_points, 5000))))
+
+@app.get("/metrics")
+def metrics(request: Request):
+    # scrapers authenticate with METRICS_TOKEN; a logged-in browser session works too
+    auth = request.headers.get("authorization", "")
+    token_ok = bool(exporter.METRICS_TOKEN) and secrets.compare_digest(auth, f"Bearer {exporter.METRICS_TOKEN}")
+    if not token_ok and not request.session.get("auth"):
+        raise HTTPException(401, "Unauthorized", headers={"WWW-Authenticate": "Bearer"})
+    return Response(exporter.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/export")
-def export(_: bool = Depends(require_login)):
-    with db_conn() as c:
-        data = {"nodes":[dict(r) for r in c.execute("SELECT * FROM nodes")],
-                "wallets":[dict(r) for r in c.execute("SELECT * FROM wallets")],
-                "acls":[dict(r) for r in c.execute("SELECT * FROM acl")],
-                "settings":[dict(r) for r in c.execute("SELECT * FROM settings")]}
-    return JSONResponse(data)
+def export(format: str = "json", sections: Optional[str] = None, start: Optional[str] = None,
+           end: Optional[str] = None, node_id: List[int] = Query(default=[]), gzip: bool = False,
+           _: bool = Depends(require_login)):
+    try:
+        name, media, chunks = core.export(format, sections, start, end, node_id, gzip)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return StreamingResponse(chunks, media_type=media,
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
 
-@app.post("/import_json")
-async def import_json(file: UploadFile = File(...), _: bool = Depends(require_login)):
-    content = await file.read()
-    data = json.loads(content)
-    with db_conn() as c:
-        for w in data.get("wallets", []):
-            c.execute("INSERT INTO wallets(label,address) VALUES(?,?)", (w["label"], w["address"]))
-        for n in data.get("nodes", []):
-            c.execute("""INSERT INTO nodes(host,user,port,use_password,password,key_path,wg_port,api_port,wallet_id,payout_address,capacity_mbps,tags,notes,created_at,last_seen,last_metrics)
-                         VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-                (n["host"],n["user"],n.get("port",22),n.get("use_password",1),n.get("password"),n.get("key_path"),
-                 n.get("wg_port",51820),n.get("api_port",4050),n.get("wallet_id"),
-                 n.get("payout_address"), n.get("capacity_mbps"), n.get("tags"), n.get("notes"),
-                 n.get("created_at"), n.get("last_seen"), n.get("last_metrics")))
-        for a in data.get("acls", []):
-            c.execute("INSERT INTO acl(port, proto, cidr, enabled) VALUES(?,?,?,?)", (a["port"], a.get("proto","tcp"), a["cidr"], a.get("enabled",1)))
-        for s in data.get("settings", []):
-            c.execute("INSERT INTO settings(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (s["key"], s["value"]))
+def _import(request: Request, file: UploadFile, fmt: str):
+    try:
+        report = importer.run(file.file, fmt)
+    except ValueError as e:
+        raise HTTPException(400, f"Import failed, nothing was changed: {e}")
+    exporter.warm()
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse(report)
+    set_setting("import_last_report", json.dumps(dict(report, file=file.filename, errors=report["errors"][:10])))
     return RedirectResponse("/nodes", status_code=303)
 
+@app.post("/import_json")
+def import_json(request: Request, file: UploadFile = File(...), _: bool = Depends(require_login)):
+    fmt = importer.detect_format(file.file, file.filename)
+    return _import(request, file, "ndjson" if fmt == "ndjson" else "json")
+
 @app.post("/import_csv_nodes")
-async def import_csv_nodes(file: UploadFile = File(...), _: bool = Depends(require_login)):
-    content = (await file.read()).decode()
-    reader = csv.DictReader(io.StringIO(content))
-    with db_conn() as c:
-        for row in reader:
-            c.execute("""INSERT INTO nodes(host,user,port,use_password,password,key_path,wg_port,api_port,wallet_id,payout_address,capacity_mbps,tags,notes,created_at)
-                         VALUES(?,?,?,?,?,?,?,?,?,?,?,?,datetime('now'))""",
-                (row.get("host"), row.get("user","ubuntu"), int(row.get("port",22)),
-                 1 if row.get("auth","password")=="password" else 0,
-                 row.get("password",""), row.get("key_path"),
-                 int(row.get("wg_port",51820)), int(row.get("api_port",4050)),
-                 None, row.get("payout_address"), float(row.get("capacity_mbps",0) or 0), row.get("tags",""), row.get("notes","")))
-    return RedirectResponse("/nodes", status_code=303)
+def import_csv_nodes(request: Request, file: UploadFile = File(...), _: bool = Depends(require_login)):
+    return _import(request, file, "csv")
 
 # ACL
 @app.post("/acl/add")
 def acl_add(port: int = Form(...), cidr: str = Form(...), proto: str = Form("tcp"), _: bool = Depends(require_login)):
-    with db_conn() as c:
-        c.execute("INSERT INTO acl(port, proto, cidr, enabled) VALUES(?,?,?,1)", (port, proto, cidr))
+    core.acl_add(port, cidr, proto)
     return RedirectResponse("/server", status_code=303)
 
 @app.post("/acl/{acl_id}/toggle")
 def acl_toggle(acl_id: int, _: bool = Depends(require_login)):
-    with db_conn() as c:
-        r = c.execute("SELECT enabled FROM acl WHERE id=?", (acl_id,)).fetchone()
-        if not r: raise HTTPException(404, "Not found")
-        newv = 0 if r["enabled"] else 1
-        c.execute("UPDATE acl SET enabled=? WHERE id=?", (newv, acl_id))
+    if core.acl_toggle(acl_id) is None: raise HTTPException(404, "Not found")
     return RedirectResponse("/server", status_code=303)
 
 @app.post("/acl/{acl_id}/delete")
 def acl_delete(acl_id: int, _: bool = Depends(require_login)):
-    with db_conn() as c:
-        c.execute("DELETE FROM acl WHERE id=?", (acl_id,))
+    core.acl_delete(acl_id)
     return RedirectResponse("/server", status_code=303)
 
-@app.post("/acl/apply")
-def acl_apply(request: Request, _: bool = Depends(require_login)):
-    client_ip = request.client.host
-    with db_conn() as c:
-        rows = [dict(r) for r in c.execute("SELECT * FROM acl WHERE enabled=1")]
-    desired = rows + [
-        {"port": 22, "proto": "tcp", "cidr": client_ip},
-        {"port": PORT, "proto": "tcp", "cidr": client_ip},
-    ]
+def _acl_reconcile(request: Request, dry_run: bool) -> dict:
     try:
-        out = subprocess.run("ufw status", shell=True, capture_output=True, text=True).stdout
-        if "Status: inactive" in out:
-            subprocess.run("ufw default deny incoming", shell=True, check=False)
-            subprocess.run("ufw default allow outgoing", shell=True, check=False)
-            subprocess.run("ufw --force enable", shell=True, check=False)
-    except Exception:
-        subprocess.run("ufw default deny incoming", shell=True, check=False)
-        subprocess.run("ufw default allow outgoing", shell=True, check=False)
-        subprocess.run("ufw --force enable", shell=True, check=False)
-    for port in [22, PORT, 80, 443]:
-        status = subprocess.run("ufw status numbered", shell=True, capture_output=True, text=True).stdout.splitlines()
-        for line in status[::-1]:
-            if f"{port}/tcp" in line and ("ALLOW" in line or "ALLOW IN" in line):
-                s = line.strip()
-                if s.startswith("[") and "]" in s:
-                    num = s[1:s.index("]")].strip()
-                    subprocess.run(f"ufw delete {num}", shell=True, check=False)
-        for r in desired:
-            if r["port"] == port:
-                cidr = r["cidr"]; proto = r.get("proto","tcp")
-                subprocess.run(f"ufw allow from {cidr} to any port {port} proto {proto}", shell=True, check=False)
+        return core.acl_reconcile(request.client.host, PORT, dry_run)
+    except ufw.UfwError as e:
+        raise HTTPException(502, str(e))
+
+@app.get("/acl/plan")
+def acl_plan(request: Request, _: bool = Depends(require_login)):
+    return _acl_reconcile(request, dry_run=True)
+
+@app.post("/acl/apply")
+def acl_apply(request: Request, dry_run: bool = False, _: bool = Depends(require_login)):
+    res = _acl_reconcile(request, dry_run)
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse(res, status_code=200 if res["ok"] else 502)
+    if not dry_run: set_setting("acl_last_apply", json.dumps(dict(res, at=datetime.utcnow().isoformat(timespec="seconds"))))
     return RedirectResponse("/server", status_code=303)
 
 # TLS
@@ -470,9 +396,58 @@ echo "TLS ready at https://{hostname}"
 
 # DB backup
 @app.get("/backup_db")
-def backup_db(_: bool = Depends(require_login)):
-    return FileResponse(DB_PATH, filename="manager.db")
+def backup_db(gzip: bool = False, _: bool = Depends(require_login)):
+    name = "manager.db" + (".gz" if gzip else "")
+    return StreamingResponse(backup.stream_live(compress=gzip), media_type="application/gzip" if gzip else "application/octet-stream",
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.post("/backups/create")
+def backups_create(request: Request, _: bool = Depends(require_login)):
+    snap = backup.snapshot()
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse(snap)
+    return RedirectResponse("/server", status_code=303)
+
+@app.get("/backups")
+def backups_list(_: bool = Depends(require_login)):
+    return backup.list_snapshots()
+
+@app.get("/backups/{name}")
+def backups_download(name: str, _: bool = Depends(require_login)):
+    try: backup.path_of(name)
+    except (ValueError, FileNotFoundError): raise HTTPException(404, "Backup not found")
+    return StreamingResponse(backup.stream_file(name), media_type="application/octet-stream",
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.post("/backups/restore")
+def backups_restore(request: Request, file: UploadFile = File(...), _: bool = Depends(require_login)):
+    try:
+        res = backup.restore(file.file)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    exporter.warm()
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse(res)
+    return RedirectResponse("/server", status_code=303)
+
+@app.on_event("startup")
+def _start_scheduler():
+    exporter.warm()
+    housekeeping.start()
+    # every worker serves requests; only the one holding the leader lease collects and runs maintenance
+    leader.elector.start(on_elected=scheduler.start if SCHEDULER_ENABLED else lambda: None, on_demoted=scheduler.stop)
+
+@app.on_event("shutdown")
+def _close_ssh_pool():
+    leader.elector.stop()
+    housekeeping.stop()
+    tequilapi.close_all()
+    pool.close_all()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=HOST, port=PORT)
+    if WEB_WORKERS > 1:
+        # uvicorn starts the workers by importing this module by name
+        uvicorn.run("main:app", host=HOST, port=PORT, workers=WEB_WORKERS)
+    else:
+        uvicorn.run(app, host=HOST, port=PORT)
@@ -0,0 +1,84 @@
+import json, base64
+from typing import Optional
+from db import db_conn
+
+# never select n.password here: these rows go to templates and the JSON API
+COLUMNS = """n.id, n.host, n.user, n.port, n.use_password, n.key_path, n.wg_port, n.api_port, n.wallet_id, n.payout_address,
+    n.capacity_mbps, n.tags, n.notes, n.created_at, COALESCE(st.last_seen, n.last_seen) AS last_seen, w.label AS wallet_label,
+    COALESCE(st.running, 0) AS myst_running, COALESCE(st.api_ok, 0) AS api_ok, COALESCE(st.sessions, 0) AS sessions,
+    COALESCE(st.bytes_total, 0) AS bytes_total, COALESCE(st.mbps, 0.0) AS bandwidth_mbps, COALESCE(st.nat_type, '') AS nat_type,
+    CASE WHEN n.capacity_mbps > 0 THEN round(COALESCE(st.mbps, 0.0) * 100.0 / n.capacity_mbps, 1) END AS utilization_pct,
+    round(COALESCE(st.bytes_total, 0) / 1e9 * :usd_per_gb, 4) AS est_usd,
+    s.next_run, s.last_duration, s.last_status, s.interval AS poll_interval,
+    COALESCE(b.state, 'closed') AS breaker, b.failures AS breaker_failures, b.retry_at AS breaker_retry, b.last_error AS breaker_error"""
+# every node has a node_status row (see db._m17_node_status_keyset); node_status leads so pages walk its indexes
+FROM = """node_status st JOIN nodes n ON n.id=st.node_id LEFT JOIN wallets w ON n.wallet_id=w.id
+    LEFT JOIN node_schedule s ON s.node_id=n.id LEFT JOIN node_breaker b ON b.node_id=n.id"""
+
+# sort name -> expression over node_status only, each matching an index on (expression, node_id), so a page is
+# an index range scan with no sort step. None may be NULL so (key, id) row-value comparisons stay total.
+# est_usd is bytes_total times a constant, so it sorts on the indexed column.
+SORTS = {
+    "id": "st.node_id",
+    "sessions": "st.sessions",
+    "mbps": "st.mbps",
+    "utilization": "CASE WHEN st.capacity_mbps > 0 THEN st.mbps / st.capacity_mbps ELSE -1.0 END",
+    "est_usd": "st.bytes_total",
+    "last_seen": "COALESCE(st.last_seen, '')",
+}
+MAX_LIMIT = 500
+
+def encode_cursor(key, node_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([key, node_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        key, node_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        # a key SQLite cannot bind would surface as a 500 instead of a 400
+        if isinstance(key, bool) or not isinstance(key, (str, int, float)): raise TypeError("cursor key")
+        return key, int(node_id)
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+
+def filters(tag: Optional[str] = None, nat: Optional[str] = None, wallet_id: Optional[int] = None,
+            running: Optional[bool] = None) -> tuple:
+    """(WHERE terms, args) over FROM for the listing's filters; rollouts select their nodes with the same ones."""
+    where, args = [], {}
+    if tag: where.append("n.id IN (SELECT node_id FROM node_tags WHERE tag=:tag)"); args["tag"] = tag.strip()
+    if nat is not None: where.append("st.nat_type=:nat"); args["nat"] = nat
+    if wallet_id is not None: where.append("n.wallet_id=:wallet_id"); args["wallet_id"] = wallet_id
+    if running is not None: where.append("st.running=:running"); args["running"] = 1 if running else 0
+    return where, args
+
+def query(usd_per_gb: float, sort: str = "id", order: str = "desc", limit: int = 100, cursor: Optional[str] = None,
+          tag: Optional[str] = None, nat: Optional[str] = None, wallet_id: Optional[int] = None,
+          running: Optional[bool] = None) -> tuple:
+    """(sql, args, limit) for one page; the query fetches limit + 1 rows to tell whether another page follows."""
+    if sort not in SORTS: raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    if order not in ("asc", "desc"): raise ValueError("order must be asc or desc")
+    limit = max(1, min(limit, MAX_LIMIT))
+    expr = SORTS[sort]
+    where, args = filters(tag, nat, wallet_id, running)
+    args.update(usd_per_gb=usd_per_gb, limit=limit + 1)
+    if cursor:
+        args["ck"], args["cid"] = decode_cursor(cursor)
+        op = "<" if order == "desc" else ">"
+        # the bare key bound lets SQLite seek expression indexes too; it skips row values over expressions
+        where.append(f"{expr} {op}= :ck AND ({expr}, st.node_id) {op} (:ck, :cid)")
+    sql = (f"SELECT {COLUMNS}, {expr} AS _sort_key FROM {FROM}" + (" WHERE " + " AND ".join(where) if where else "")
+           + f" ORDER BY {expr} {order}, st.node_id {order} LIMIT :limit")
+    return sql, args, limit
+
+def page(usd_per_gb: float, sort: str = "id", order: str = "desc", limit: int = 100, cursor: Optional[str] = None,
+         tag: Optional[str] = None, nat: Optional[str] = None, wallet_id: Optional[int] = None,
+         running: Optional[bool] = None) -> dict:
+    """One page of the node listing, ordered by (sort key, id) and continued from an opaque cursor."""
+    sql, args, limit = query(usd_per_gb, sort, order, limit, cursor, tag, nat, wallet_id, running)
+    with db_conn() as c:
+        rows = [dict(r) for r in c.execute(sql, args)]
+    nxt = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        nxt = encode_cursor(rows[-1]["_sort_key"], rows[-1]["id"])
+    for r in rows: r.pop("_sort_key")
+    return {"items": rows, "next": nxt, "sort": sort, "order": order, "limit": limit}
@@ -0,0 +1,50 @@
+import os, asyncio
+from typing import Optional
+from sshpool import pool, node_key
+
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "1") == "1"
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", "3"))           # seconds for TCP connect plus the SSH banner
+PREFLIGHT_CONCURRENCY = int(os.getenv("PREFLIGHT_CONCURRENCY", "512"))   # sockets open at once
+
+# Sent before hanging up so sshd logs a normal pre-auth disconnect, not "did not receive identification string",
+# which fail2ban's aggressive sshd filter counts against the panel.
+_IDENT = b"SSH-2.0-myst-preflight\r\n"
+
+async def _probe(sem: asyncio.Semaphore, host: str, port: int, timeout: float) -> Optional[str]:
+    async with sem:
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            async def banner():
+                # RFC 4253 lets the server send other lines before its identification string
+                for _ in range(20):
+                    line = await reader.readline()
+                    if not line: return "connection closed before the SSH banner"
+                    if line.startswith(b"SSH-"): return None
+                return "no SSH banner"
+            err = await asyncio.wait_for(banner(), timeout)
+            writer.write(_IDENT)
+            return err and f"{host}:{port}: {err}"
+        except asyncio.TimeoutError:
+            return f"{host}:{port}: no answer within {timeout:g}s"
+        except OSError as e:
+            return f"{host}:{port}: {e.strerror or e}"
+        finally:
+            if writer:
+                writer.close()
+                try: await writer.wait_closed()
+                except OSError: pass
+
+async def _check(targets: dict, timeout: float) -> dict:
+    sem = asyncio.Semaphore(PREFLIGHT_CONCURRENCY)
+    ids = list(targets)
+    errs = await asyncio.gather(*(_probe(sem, h, p, timeout) for h, p in targets.values()))
+    return {i: e for i, e in zip(ids, errs) if e}
+
+def check(nodes, timeout: float = PREFLIGHT_TIMEOUT) -> dict:
+    """{node_id: error} for the nodes whose SSH port does not answer; probes them all concurrently.
+    Nodes with a live pooled transport are reachable by definition and are not probed."""
+    if not PREFLIGHT_ENABLED: return {}
+    targets = {n["id"]: (n["host"], int(n["port"])) for n in nodes if not pool.alive(node_key(n))}
+    if not targets: return {}
+    return asyncio.run(_check(targets, timeout))
@@ -0,0 +1,87 @@
+import os, json, base64, shlex
+import bandwidth
+
+# TequilAPI sections: section -> (path, timeout seconds). The session list grows with traffic, the rest are small documents.
+API_ENDPOINTS = {
+    "api_health": ("/tequilapi/health", float(os.getenv("TEQUILAPI_TIMEOUT_HEALTH", "2"))),
+    "api_sessions": ("/tequilapi/sessions", float(os.getenv("TEQUILAPI_TIMEOUT_SESSIONS", "8"))),
+    "api_nat": ("/tequilapi/nat/type", float(os.getenv("TEQUILAPI_TIMEOUT_NAT", "2"))),
+    "api_identities": ("/tequilapi/identities", float(os.getenv("TEQUILAPI_TIMEOUT_IDENTITIES", "3"))),
+    "api_services": ("/tequilapi/services", float(os.getenv("TEQUILAPI_TIMEOUT_SERVICES", "3"))),
+}
+
+# Every section the panel collects from a node, keyed the way last_metrics stores them.
+# api=False leaves out the TequilAPI sections, which the collector then fetches through tequilapi.py.
+def commands(api_port: int = 4050, api: bool = True, paths: dict = None) -> dict:
+    cmds = {
+        "uptime": "uptime -p",
+        "docker": "docker ps --format '{{.Names}}|{{.Status}}' | grep myst-node || true",
+        "ufw": "ufw status | sed -n '1,30p'",
+        "netdev": bandwidth.COMMAND,
+    }
+    if api: cmds.update(api_commands(api_port, paths))
+    return cmds
+
+def api_commands(api_port: int = 4050, paths: dict = None) -> dict:
+    # the curl route, for nodes whose sshd refuses port forwarding; paths overrides an endpoint's path (e.g. a query string)
+    paths = paths or {}
+    return {k: f"curl -s --max-time {t:g} {shlex.quote(f'http://127.0.0.1:{api_port}' + paths.get(k, path))} || echo ''"
+            for k, (path, t) in API_ENDPOINTS.items()}
+
+class ProbeError(Exception):
+    pass
+
+# Runs all sections in parallel on the node and prints a single JSON line:
+# {"<section>": {"rc": N, "out": "<base64>", "err": "<base64>"}, ...}
+# base64 keeps the document valid JSON without needing jq/python on the node.
+_HEAD = """d=$(mktemp -d) || exit 97
+trap 'rm -rf "$d"' EXIT
+sec() { ( timeout %(timeout)d sh -c "$2" >"$d/$1.out" 2>"$d/$1.err"; echo $? >"$d/$1.rc" ) & }
+b64() { base64 -w0 <"$1" 2>/dev/null || base64 <"$1" | tr -d '\\n'; }
+"""
+_TAIL = """wait
+sep=''
+printf '{'
+for k in %(keys)s; do
+  printf '%%s"%%s":{"rc":%%s,"out":"%%s","err":"%%s"}' "$sep" "$k" "$(cat "$d/$k.rc" 2>/dev/null || echo 255)" "$(b64 "$d/$k.out")" "$(b64 "$d/$k.err")"
+  sep=','
+done
+printf '}\\n'
+"""
+
+def build_script(cmds: dict, timeout: int = 20) -> str:
+    lines = [_HEAD % {"timeout": timeout}]
+    for k, cmd in cmds.items():
+        lines.append(f"sec {k} {shlex.quote(cmd)}\n")
+    lines.append(_TAIL % {"keys": " ".join(cmds)})
+    return "".join(lines)
+
+def parse(out: str, keys) -> dict:
+    doc = None
+    for line in reversed(out.splitlines()):
+        if line.startswith("{"):
+            try: doc = json.loads(line)
+            except ValueError: pass
+            break
+    if not isinstance(doc, dict):
+        raise ProbeError(f"unparseable probe output: {out[:200]!r}")
+    data = {}
+    for k in keys:
+        sec = doc.get(k)
+        if not isinstance(sec, dict):
+            data[k] = {"rc": 255, "out": "", "err": "missing from probe output"}
+            continue
+        try:
+            o = base64.b64decode(sec.get("out") or "").decode(errors="replace")
+            e = base64.b64decode(sec.get("err") or "").decode(errors="replace")
+        except ValueError as ex:
+            raise ProbeError(f"bad encoding in section {k}: {ex}")
+        data[k] = {"rc": int(sec.get("rc", 255)), "out": o.strip(), "err": e.strip()}
+    return data
+
+def run(exec_fn, cmds: dict, timeout: int = 20) -> dict:
+    # exec_fn(cmd, timeout=..., input=...) -> (rc, out, err), e.g. a bound sshpool.node_exec
+    rc, out, err = exec_fn("sh -s", timeout=timeout + 10, input=build_script(cmds, timeout))
+    if rc != 0:
+        raise ProbeError(f"probe exited {rc}: {err.strip()[:200]}")
+    return parse(out, cmds)
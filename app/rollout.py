@@ -0,0 +1,187 @@
+import os, json, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+import jobs, leader, nodelist
+import deploy as deployer
+from db import db_conn
+
+ROLLOUT_CANARY = int(os.getenv("ROLLOUT_CANARY", "1"))            # nodes in wave 0; any failure there stops the rollout
+ROLLOUT_WAVE_SIZE = int(os.getenv("ROLLOUT_WAVE_SIZE", "20"))
+ROLLOUT_CONCURRENCY = int(os.getenv("ROLLOUT_CONCURRENCY", "10")) # deploys in flight at once
+ROLLOUT_MAX_FAILURE = float(os.getenv("ROLLOUT_MAX_FAILURE", "0.1"))  # failed / attempted after a wave that stops the rollout
+
+log = logging.getLogger("myst.rollout")
+
+# states: running -> succeeded | failed | cancelled, running <-> paused. Pause and cancel take effect between
+# node starts; deploys already in flight finish, then the coordinator exits. Resume starts a new coordinator once
+# the old one is gone. Node states: pending, running, succeeded, failed, skipped, cancelled.
+ACTIVE = ("running", "paused")
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+def select(tag: Optional[str] = None, nat: Optional[str] = None, wallet_id: Optional[int] = None,
+           running: Optional[bool] = None, node_ids: Optional[list] = None) -> list:
+    where, args = nodelist.filters(tag, nat, wallet_id, running)
+    if node_ids:
+        where.append(f"n.id IN ({','.join(str(int(i)) for i in node_ids)})")
+    with db_conn() as c:
+        return [r["id"] for r in c.execute(f"SELECT n.id FROM {nodelist.FROM}" + (" WHERE " + " AND ".join(where) if where else "")
+                                           + " ORDER BY n.id", args)]
+
+def create(node_ids: list, selector: dict, mgmt_ip: str, canary: int = ROLLOUT_CANARY, wave_size: int = ROLLOUT_WAVE_SIZE,
+           concurrency: int = ROLLOUT_CONCURRENCY, max_failure: float = ROLLOUT_MAX_FAILURE, redeploy: bool = False,
+           agent_url: Optional[str] = None) -> int:
+    """Plan a rollout over node_ids (canary wave first, then waves of wave_size) and start it."""
+    if not node_ids: raise ValueError("no nodes match the selection")
+    canary, wave_size, concurrency = max(0, canary), max(1, wave_size), max(1, concurrency)
+    if not 0 <= max_failure <= 1: raise ValueError("max_failure must be between 0 and 1")
+    waves = [0] * min(canary, len(node_ids)) + [1 + i // wave_size for i in range(len(node_ids) - min(canary, len(node_ids)))]
+    with db_conn() as c:
+        rid = c.execute("""INSERT INTO rollouts(state, selector, canary, wave_size, concurrency, max_failure, redeploy, agent_url, mgmt_ip, created)
+                           VALUES('running',?,?,?,?,?,?,?,?,?)""",
+                        (json.dumps(selector), canary, wave_size, concurrency, max_failure, int(redeploy), agent_url, mgmt_ip, _now())).lastrowid
+        c.executemany("INSERT INTO rollout_nodes(rollout_id, node_id, wave) VALUES(?,?,?)",
+                      [(rid, nid, w) for nid, w in zip(node_ids, waves)])
+    _start(rid)
+    return rid
+
+def _start(rid: int):
+    # the coordinator runs in this process; if it dies the leader pauses the rollout (leader.recover)
+    job_id = jobs.create("rollout", None)
+    with db_conn() as c:
+        c.execute("UPDATE rollouts SET owner=?, job_id=? WHERE id=?", (leader.OWNER, job_id, rid))
+    jobs.start(job_id, lambda job: run(job, rid))
+
+def get(rid: int) -> Optional[dict]:
+    with db_conn() as c:
+        r = c.execute("SELECT * FROM rollouts WHERE id=?", (rid,)).fetchone()
+    return dict(r) if r else None
+
+def recent(limit: int = 50) -> list:
+    with db_conn() as c:
+        return [dict(r) for r in c.execute("SELECT * FROM rollouts ORDER BY id DESC LIMIT ?", (limit,))]
+
+def progress(rid: int) -> Optional[dict]:
+    """The rollout with per-wave counts by node state and its nodes."""
+    r = get(rid)
+    if not r: return None
+    with db_conn() as c:
+        nodes = [dict(x) for x in c.execute("""SELECT rn.node_id, rn.wave, rn.state, rn.job_id, n.host, n.port
+                                               FROM rollout_nodes rn LEFT JOIN nodes n ON n.id=rn.node_id
+                                               WHERE rn.rollout_id=? ORDER BY rn.wave, rn.node_id""", (rid,))]
+    waves = {}
+    for n in nodes:
+        w = waves.setdefault(n["wave"], {"wave": n["wave"], "total": 0})
+        w["total"] += 1; w[n["state"]] = w.get(n["state"], 0) + 1
+    r["selector"] = json.loads(r["selector"] or "{}")
+    r["waves"] = [waves[k] for k in sorted(waves)]
+    r["nodes"] = nodes
+    return r
+
+def _set_state(rid: int, state: str, allowed: tuple, error: Optional[str] = None) -> bool:
+    with db_conn() as c:
+        done = state in ("succeeded", "failed", "cancelled")
+        return c.execute(f"UPDATE rollouts SET state=?, error=COALESCE(?, error), finished=? WHERE id=? AND state IN ({','.join('?' * len(allowed))})",
+                         (state, error, _now() if done else None, rid, *allowed)).rowcount > 0
+
+def pause(rid: int) -> bool:
+    return _set_state(rid, "paused", ("running",))
+
+def resume(rid: int) -> bool:
+    """Restart a paused rollout; refused while the paused coordinator still waits for its in-flight deploys."""
+    with db_conn() as c:
+        ok = c.execute("""UPDATE rollouts SET state='running', finished=NULL WHERE id=? AND state='paused'
+                          AND (job_id IS NULL OR job_id NOT IN (SELECT id FROM jobs WHERE state IN ('queued','running')))""",
+                       (rid,)).rowcount > 0
+    if ok: _start(rid)
+    return ok
+
+def cancel(rid: int) -> bool:
+    if not _set_state(rid, "cancelled", ACTIVE): return False
+    with db_conn() as c:
+        c.execute("UPDATE rollout_nodes SET state='cancelled' WHERE rollout_id=? AND state='pending'", (rid,))
+    return True
+
+def _state(rid: int) -> str:
+    with db_conn() as c:
+        return c.execute("SELECT state FROM rollouts WHERE id=?", (rid,)).fetchone()["state"]
+
+def _active(rid: int, job_id: int) -> bool:
+    # still running and still ours: a coordinator replaced by Resume must not start more deploys
+    with db_conn() as c:
+        return c.execute("SELECT 1 FROM rollouts WHERE id=? AND state='running' AND job_id=?", (rid, job_id)).fetchone() is not None
+
+def _claim(rid: int, node_id: int, state: str) -> bool:
+    # pending -> state in one statement, so a node is never started twice
+    with db_conn() as c:
+        return c.execute("UPDATE rollout_nodes SET state=? WHERE rollout_id=? AND node_id=? AND state='pending'",
+                         (state, rid, node_id)).rowcount > 0
+
+def _counts(rid: int) -> dict:
+    with db_conn() as c:
+        return {r["state"]: r["n"] for r in c.execute("SELECT state, COUNT(*) AS n FROM rollout_nodes WHERE rollout_id=? GROUP BY state", (rid,))}
+
+def _deploy(rid: int, n: dict, job_id: int, r: dict, slots: threading.Semaphore):
+    try:
+        ok = jobs.execute(job_id, deployer.for_node(n, r["mgmt_ip"], r["agent_url"]))
+    except Exception:
+        log.exception("rollout %s: deploy of node %s failed", rid, n["id"]); ok = False
+    finally:
+        slots.release()
+    with db_conn() as c:
+        c.execute("UPDATE rollout_nodes SET state=? WHERE rollout_id=? AND node_id=?", ("succeeded" if ok else "failed", rid, n["id"]))
+
+def run(job, rid: int) -> bool:
+    """Coordinator: deploys the pending nodes wave by wave, at most r["concurrency"] at a time, and checks the
+    failure rate after each wave. Returns when the rollout ends, is paused or is cancelled."""
+    r = get(rid)
+    slots = threading.Semaphore(r["concurrency"])
+    ex = ThreadPoolExecutor(max_workers=r["concurrency"], thread_name_prefix=f"rollout-{rid}")
+    try:
+        with db_conn() as c:
+            waves = [w["wave"] for w in c.execute("SELECT DISTINCT wave FROM rollout_nodes WHERE rollout_id=? AND state='pending' ORDER BY wave", (rid,))]
+        for wave in waves:
+            with db_conn() as c:
+                nodes = [dict(x) for x in c.execute("""SELECT n.* FROM rollout_nodes rn JOIN nodes n ON n.id=rn.node_id
+                                                       WHERE rn.rollout_id=? AND rn.wave=? AND rn.state='pending' ORDER BY n.id""", (rid, wave))]
+            job.write(f"== wave {wave}{' (canary)' if wave == 0 else ''}: {len(nodes)} nodes\n")
+            futures = []
+            for n in nodes:
+                slots.acquire()
+                if not _active(rid, job.id):
+                    slots.release(); break
+                # the deploy button's check: a node that already runs is left alone unless asked to redeploy
+                if deployer.is_running(n["id"]) and not (r["redeploy"] or r["agent_url"]):
+                    slots.release(); _claim(rid, n["id"], "skipped")
+                    continue
+                if not _claim(rid, n["id"], "running"):
+                    slots.release(); continue
+                job_id = jobs.create("deploy", n["id"])
+                with db_conn() as c:
+                    c.execute("UPDATE rollout_nodes SET job_id=? WHERE rollout_id=? AND node_id=?", (job_id, rid, n["id"]))
+                futures.append(ex.submit(_deploy, rid, n, job_id, r, slots))
+            for f in futures: f.result()
+            counts = _counts(rid)
+            attempted = counts.get("succeeded", 0) + counts.get("failed", 0)
+            rate = counts.get("failed", 0) / attempted if attempted else 0.0
+            job.write(f"   {counts.get('succeeded', 0)} succeeded, {counts.get('failed', 0)} failed, {counts.get('skipped', 0)} skipped so far "
+                      f"(failure rate {rate:.0%})\n")
+            if not _active(rid, job.id):
+                state = _state(rid)
+                job.write(f"== {state}\n")
+                return state == "paused"
+            if (wave == 0 and counts.get("failed", 0)) or rate > r["max_failure"]:
+                why = "canary failed" if wave == 0 else f"failure rate {rate:.0%} over {r['max_failure']:.0%}"
+                _set_state(rid, "failed", ("running",), why)
+                job.write(f"== stopped: {why}\n")
+                return False
+        _set_state(rid, "succeeded", ("running",))
+        job.write("== rollout finished\n")
+        return True
+    except Exception as e:
+        _set_state(rid, "failed", ACTIVE, str(e))
+        raise
+    finally:
+        ex.shutdown(wait=True)
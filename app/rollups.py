@@ -0,0 +1,168 @@
+import os, json, time, calendar
+from datetime import datetime
+from typing import Optional
+import bandwidth
+from db import db_conn, get_setting, set_setting
+
+# (table, bucket seconds, retention days env, default days; 0 keeps forever)
+LEVELS = [
+    ("metrics_5m", 300, "RETAIN_5M_DAYS", "14"),
+    ("metrics_1h", 3600, "RETAIN_1H_DAYS", "180"),
+    ("metrics_1d", 86400, "RETAIN_1D_DAYS", "0"),
+]
+RETAIN_RAW_DAYS = float(os.getenv("RETAIN_RAW_DAYS", "2"))
+RETAIN_SESSIONS_DAYS = float(os.getenv("RETAIN_SESSIONS_DAYS", "90"))  # session rows only; the running totals are kept
+ROLLUP_BATCH = int(os.getenv("ROLLUP_BATCH", "5000"))  # raw rows per write transaction
+RAW_STEP = float(os.getenv("COLLECT_INTERVAL", "60"))
+
+def retention_days(level_env: str, default: str) -> float:
+    return float(os.getenv(level_env, default))
+
+def epoch(ts: str) -> int:
+    return calendar.timegm(datetime.fromisoformat(ts).utctimetuple())
+
+def iso(t: float) -> str:
+    return datetime.utcfromtimestamp(t).isoformat()
+
+def _fold(acc: dict, key, t: int, ts: str, r):
+    s, b, up = r["sessions"] or 0, r["bytes_total"] or 0, 1 if r["api_ok"] else 0
+    a = acc.get(key)
+    if a is None:
+        a = acc[key] = {"node_id": key[0], "bucket": key[1], "samples": 1, "up_samples": up,
+                        "sessions_min": s, "sessions_max": s, "sessions_sum": s, "sessions_last": s,
+                        "bytes_min": b, "bytes_max": b, "bytes_sum": b, "bytes_last": b, "last_ts": ts,
+                        "mbps_samples": 0, "mbps_sum": 0.0, "mbps_max": None, "mbps_hist": {}}
+        _fold_rate(a, r["mbps"])
+        return
+    _fold_rate(a, r["mbps"])
+    a["samples"] += 1; a["up_samples"] += up
+    a["sessions_min"] = min(a["sessions_min"], s); a["sessions_max"] = max(a["sessions_max"], s); a["sessions_sum"] += s
+    a["bytes_min"] = min(a["bytes_min"], b); a["bytes_max"] = max(a["bytes_max"], b); a["bytes_sum"] += b
+    if ts >= a["last_ts"]:
+        a["sessions_last"] = s; a["bytes_last"] = b; a["last_ts"] = ts
+
+def _fold_rate(a: dict, mbps):
+    if mbps is None: return  # no rate across a counter reset or for a node that did not answer
+    a["mbps_samples"] += 1; a["mbps_sum"] += mbps
+    a["mbps_max"] = mbps if a["mbps_max"] is None else max(a["mbps_max"], mbps)
+    bandwidth.hist_add(a["mbps_hist"], mbps)
+
+def _merge_hists(c, table: str, acc: dict):
+    # histograms do not merge in SQL; fold the stored one in here, inside the compaction transaction
+    for a in acc.values():
+        if not a["mbps_hist"]:
+            a["mbps_hist"] = None; continue
+        r = c.execute(f"SELECT mbps_hist FROM {table} WHERE node_id=? AND bucket=?", (a["node_id"], a["bucket"])).fetchone()
+        a["mbps_hist"] = json.dumps(bandwidth.hist_merge(bandwidth.hist_load(r["mbps_hist"]) if r else {}, a["mbps_hist"]))
+
+def _upsert_sql(table: str) -> str:
+    return f"""INSERT INTO {table}(node_id, bucket, samples, up_samples, sessions_min, sessions_max, sessions_sum, sessions_last,
+                   bytes_min, bytes_max, bytes_sum, bytes_last, last_ts, mbps_samples, mbps_sum, mbps_max, mbps_hist)
+               VALUES(:node_id,:bucket,:samples,:up_samples,:sessions_min,:sessions_max,:sessions_sum,:sessions_last,
+                   :bytes_min,:bytes_max,:bytes_sum,:bytes_last,:last_ts,:mbps_samples,:mbps_sum,:mbps_max,:mbps_hist)
+               ON CONFLICT(node_id, bucket) DO UPDATE SET
+                   samples=samples+excluded.samples, up_samples=up_samples+excluded.up_samples,
+                   sessions_min=min(sessions_min, excluded.sessions_min), sessions_max=max(sessions_max, excluded.sessions_max),
+                   sessions_sum=sessions_sum+excluded.sessions_sum,
+                   bytes_min=min(bytes_min, excluded.bytes_min), bytes_max=max(bytes_max, excluded.bytes_max),
+                   bytes_sum=bytes_sum+excluded.bytes_sum,
+                   sessions_last=CASE WHEN excluded.last_ts >= last_ts THEN excluded.sessions_last ELSE sessions_last END,
+                   bytes_last=CASE WHEN excluded.last_ts >= last_ts THEN excluded.bytes_last ELSE bytes_last END,
+                   last_ts=max(last_ts, excluded.last_ts),
+                   mbps_samples=mbps_samples+excluded.mbps_samples, mbps_sum=mbps_sum+excluded.mbps_sum,
+                   mbps_max=COALESCE(max(mbps_max, excluded.mbps_max), mbps_max, excluded.mbps_max),
+                   mbps_hist=COALESCE(excluded.mbps_hist, mbps_hist)"""
+
+def compact(max_batches: int = 100) -> int:
+    """Fold raw metrics rows past the cursor into every rollup level, one short transaction per batch."""
+    done = 0
+    c = db_conn()
+    for _ in range(max_batches):
+        cursor = int(get_setting("rollup_cursor", "0") or 0)
+        rows = c.execute("SELECT id, node_id, ts, sessions, bytes_total, api_ok, mbps FROM metrics WHERE id>? ORDER BY id LIMIT ?",
+                         (cursor, ROLLUP_BATCH)).fetchall()
+        if not rows: break
+        accs = [{} for _ in LEVELS]
+        for r in rows:
+            try: t = epoch(r["ts"])
+            except ValueError: continue
+            for acc, (_, step, _, _) in zip(accs, LEVELS):
+                _fold(acc, (r["node_id"], t - t % step), t, r["ts"], r)
+        with c:
+            for acc, (table, _, _, _) in zip(accs, LEVELS):
+                _merge_hists(c, table, acc)
+                c.executemany(_upsert_sql(table), list(acc.values()))
+            c.execute("INSERT INTO settings(key,value) VALUES('rollup_cursor',?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                      (str(rows[-1]["id"]),))
+        done += len(rows)
+        time.sleep(0)  # let waiting writers in between batches
+    return done
+
+def _delete_chunked(c, sql_select: str, table: str, key: str, args: tuple, chunk: int = 5000) -> int:
+    total = 0
+    while True:
+        with c:
+            n = c.execute(f"DELETE FROM {table} WHERE {key} IN ({sql_select} LIMIT {chunk})", args).rowcount
+        total += n
+        if n < chunk: return total
+
+def enforce_retention() -> dict:
+    c = db_conn(); now = time.time(); out = {}
+    cursor = int(get_setting("rollup_cursor", "0") or 0)
+    if RETAIN_RAW_DAYS > 0:
+        # never drop raw rows that have not been folded into the rollups yet
+        out["metrics"] = _delete_chunked(c, "SELECT id FROM metrics WHERE ts<? AND id<=?", "metrics", "id",
+                                         (iso(now - RETAIN_RAW_DAYS * 86400), cursor))
+    if RETAIN_SESSIONS_DAYS > 0:
+        out["sessions"] = _delete_chunked(c, "SELECT node_id, id FROM sessions WHERE started<?", "sessions", "(node_id, id)",
+                                          (iso(now - RETAIN_SESSIONS_DAYS * 86400),))
+    for table, step, env, default in LEVELS:
+        days = retention_days(env, default)
+        if days > 0:
+            out[table] = _delete_chunked(c, f"SELECT rowid FROM {table} WHERE bucket<?", table, "rowid",
+                                         (int(now - days * 86400),))
+    return out
+
+def maintain():
+    compact()
+    last = float(get_setting("retention_last_run", "0") or 0)
+    if time.time() - last > 600:
+        enforce_retention()
+        set_setting("retention_last_run", str(time.time()))
+
+def _raw(c, node_id, start, end):
+    rows = c.execute("SELECT ts, sessions, bytes_total, api_ok, mbps FROM metrics WHERE node_id=? AND ts>=? AND ts<? ORDER BY ts",
+                     (node_id, iso(start), iso(end))).fetchall()
+    return [{"ts": r["ts"], "samples": 1, "uptime": float(r["api_ok"] or 0),
+             "sessions_min": r["sessions"], "sessions_max": r["sessions"], "sessions_avg": r["sessions"], "sessions_last": r["sessions"],
+             "bytes_min": r["bytes_total"], "bytes_max": r["bytes_total"], "bytes_avg": r["bytes_total"], "bytes_last": r["bytes_total"],
+             "mbps_avg": r["mbps"], "mbps_max": r["mbps"], "mbps_p95": r["mbps"]}
+            for r in rows]
+
+def _rolled(c, table, node_id, start, end):
+    rows = c.execute(f"SELECT * FROM {table} WHERE node_id=? AND bucket>=? AND bucket<? ORDER BY bucket",
+                     (node_id, int(start), int(end))).fetchall()
+    return [{"ts": iso(r["bucket"]), "samples": r["samples"], "uptime": round(r["up_samples"] / r["samples"], 4),
+             "sessions_min": r["sessions_min"], "sessions_max": r["sessions_max"],
+             "sessions_avg": round(r["sessions_sum"] / r["samples"], 3), "sessions_last": r["sessions_last"],
+             "bytes_min": r["bytes_min"], "bytes_max": r["bytes_max"],
+             "bytes_avg": round(r["bytes_sum"] / r["samples"], 1), "bytes_last": r["bytes_last"],
+             "mbps_avg": round(r["mbps_sum"] / r["mbps_samples"], 3) if r["mbps_samples"] else None, "mbps_max": r["mbps_max"],
+             "mbps_p95": bandwidth.hist_quantile(bandwidth.hist_load(r["mbps_hist"]), 0.95)}
+            for r in rows]
+
+def pick_resolution(start: float, end: float, max_points: int = 500, now: Optional[float] = None) -> str:
+    """Finest resolution that is still retained at `start` and returns at most max_points; else the coarsest."""
+    now = now or time.time(); span = max(1.0, end - start)
+    options = [("raw", RAW_STEP, RETAIN_RAW_DAYS)] + [(t, step, retention_days(env, d)) for t, step, env, d in LEVELS]
+    for name, step, days in options:
+        retained = days <= 0 or start >= now - days * 86400
+        if retained and span / step <= max_points:
+            return name
+    return LEVELS[-1][0]
+
+def query(node_id: int, start: float, end: float, max_points: int = 500) -> dict:
+    res = pick_resolution(start, end, max_points)
+    c = db_conn()
+    points = _raw(c, node_id, start, end) if res == "raw" else _rolled(c, res, node_id, start, end)
+    return {"node_id": node_id, "resolution": res, "start": iso(start), "end": iso(end), "points": points}
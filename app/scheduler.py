@@ -0,0 +1,156 @@
+import os, json, time, random, hashlib, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import backup, breaker, collector, exporter, preflight, rollups, tequilapi
+from db import db_conn
+from sshpool import pool
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+COLLECT_INTERVAL = float(os.getenv("COLLECT_INTERVAL", "60"))            # base rate for healthy nodes
+COLLECT_INTERVAL_IDLE = float(os.getenv("COLLECT_INTERVAL_IDLE", "600"))  # cap for nodes whose state does not change
+COLLECT_BACKOFF_MAX = float(os.getenv("COLLECT_BACKOFF_MAX", "3600"))    # cap for offline nodes
+COLLECT_JITTER = float(os.getenv("COLLECT_JITTER", "0.1"))
+
+log = logging.getLogger("myst.scheduler")
+
+def signature(data: dict) -> str:
+    # what "unchanged" means: container name/state and the health document, minus the ticking uptime fields
+    docker = []
+    for line in ((data.get("docker") or {}).get("out") or "").splitlines():
+        name, _, status = line.partition("|")
+        docker.append(f"{name}|{status.split(' ')[0]}")
+    health = ((data.get("api_health") or {}).get("out") or "").strip()
+    try:
+        h = json.loads(health)
+        if isinstance(h, dict): h.pop("uptime", None); health = json.dumps(h, sort_keys=True)
+    except ValueError: pass
+    return hashlib.sha1("\n".join(docker + [health]).encode()).hexdigest()
+
+def next_state(prev: dict, res: dict, base=COLLECT_INTERVAL) -> dict:
+    failures = prev.get("failures") or 0; stable = prev.get("stable") or 0
+    sig = prev.get("last_sig")
+    if res["status"] != "ok":
+        failures += 1; stable = 0
+        interval = min(base * 2 ** failures, COLLECT_BACKOFF_MAX)
+    else:
+        failures = 0
+        new_sig = signature(res["data"] or {})
+        stable = stable + 1 if new_sig == sig else 0
+        sig = new_sig
+        interval = min(base * 2 ** min(stable, 16), max(base, COLLECT_INTERVAL_IDLE))
+    jittered = interval * random.uniform(1 - COLLECT_JITTER, 1 + COLLECT_JITTER)
+    return {"node_id": res["id"], "next_run": time.time() + jittered, "interval": interval,
+            "last_run": res.get("ts") or datetime.utcnow().isoformat(), "last_duration": res.get("duration"),
+            "last_status": res["status"], "failures": failures, "stable": stable, "last_sig": sig}
+
+class Scheduler:
+    """Polls every node on its own adaptive interval and runs periodic maintenance jobs; with collect=False
+    only the maintenance jobs."""
+    def __init__(self, concurrency=collector.COLLECT_CONCURRENCY, tick=1.0, collect=True):
+        self.concurrency = concurrency
+        self.collect = collect
+        self.tick = tick
+        self._stop = threading.Event()
+        self._thread = None
+        self._ex = None
+        self._inflight = {}
+        self._jobs = []  # [name, fn, every, next_at, future]
+        self._maint = None
+
+    def add_job(self, name, fn, every: float):
+        self._jobs.append([name, fn, every, time.monotonic() + every, None])
+
+    def _run_job(self, name, fn):
+        try: fn()
+        except Exception: log.exception("maintenance job %s failed", name)
+
+    def start(self):
+        if self._thread: return
+        self._stop.clear()
+        if self.collect: self._ex = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sched-collect")
+        self._maint = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sched-maint")
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+        if self._ex: self._ex.shutdown(wait=False, cancel_futures=True)
+        if self._maint: self._maint.shutdown(wait=False, cancel_futures=True)
+        self._thread = None; self._ex = None; self._maint = None
+        self._inflight.clear()  # still due in node_schedule, so picked up again on the next start
+
+    def _due(self, limit):
+        now = time.time()
+        with db_conn() as c:
+            rows = [dict(r) for r in c.execute(
+                """SELECT n.*, s.next_run AS s_next_run, s.failures AS s_failures, s.stable AS s_stable, s.last_sig AS s_last_sig
+                   FROM nodes n LEFT JOIN node_schedule s ON s.node_id=n.id
+                   WHERE s.next_run IS NULL OR s.next_run <= ? ORDER BY s.next_run LIMIT ?""",
+                (now, limit + len(self._inflight)))]
+            fresh = [{"node_id": r["id"], "next_run": now + random.uniform(0, COLLECT_INTERVAL), "interval": COLLECT_INTERVAL,
+                      "last_run": None, "last_duration": None, "last_status": None, "failures": 0, "stable": 0, "last_sig": None}
+                     for r in rows if r["s_next_run"] is None]
+            if fresh:
+                # first sight of a node: spread it over one base interval instead of hitting the whole fleet now
+                c.executemany("INSERT OR IGNORE INTO node_schedule(node_id, next_run, interval, failures, stable) VALUES(:node_id,:next_run,:interval,0,0)", fresh)
+        return [r for r in rows if r["s_next_run"] is not None and r["id"] not in self._inflight][:limit]
+
+    def _reap(self):
+        done = [nid for nid, (f, _) in self._inflight.items() if f.done()]
+        results, sched = [], []
+        for nid in done:
+            f, prev = self._inflight.pop(nid)
+            try: res = f.result()
+            except Exception as e:
+                res = {"id": nid, "status": "failed", "error": str(e), "duration": None, "data": None}
+            results.append(res)
+            sched.append(next_state(prev, res))
+        if results:
+            collector.store_results(results, sched)
+
+    def run_once(self):
+        if self.collect: self._collect()
+        now = time.monotonic()
+        for job in self._jobs:
+            # maintenance runs off the collection thread; a job still running from last time is skipped
+            if now >= job[3] and (job[4] is None or job[4].done()):
+                job[3] = now + job[2]
+                job[4] = self._maint.submit(self._run_job, job[0], job[1])
+
+    def _collect(self):
+        self._reap()
+        free = self.concurrency - len(self._inflight)
+        if free > 0:
+            due = self._due(free)
+            due, skipped = breaker.split(due)
+            if skipped: breaker.defer([n["id"] for n in skipped])
+            # unreachable nodes fail here, before they take a collect worker for a full connect timeout
+            down = preflight.check(due) if due else {}
+            results, sched = [], []
+            for n in due:
+                prev = {"failures": n.pop("s_failures"), "stable": n.pop("s_stable"), "last_sig": n.pop("s_last_sig")}
+                n.pop("s_next_run", None)
+                if n["id"] in down:
+                    res = collector.unreachable(n, down[n["id"]])
+                    results.append(res); sched.append(next_state(prev, res))
+                else:
+                    self._inflight[n["id"]] = (self._ex.submit(collector.collect_node, n), prev)
+            if results: collector.store_results(results, sched)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try: self.run_once()
+            except Exception: log.exception("scheduler tick failed")
+            self._stop.wait(self.tick)
+
+# fleet-wide work, run by the elected leader only (leader.elector)
+scheduler = Scheduler()
+scheduler.add_job("rollups", rollups.maintain, 60)
+scheduler.add_job("backup", backup.maintain, 300)
+# every worker has its own SSH pool and tunnels to sweep
+housekeeping = Scheduler(collect=False)
+housekeeping.add_job("ssh_pool_sweep", pool.sweep, 30)
+housekeeping.add_job("tequilapi_sweep", tequilapi.sweep, 30)
+# results stored by the leader or the CLI; /metrics itself never reads the database
+if exporter.METRICS_RELOAD: housekeeping.add_job("metrics_reload", exporter.refresh, exporter.METRICS_CACHE_TTL)
@@ -0,0 +1,93 @@
+import os, json
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+from db import db_conn
+
+SESSIONS_PAGE_SIZE = int(os.getenv("SESSIONS_PAGE_SIZE", "500"))
+SESSIONS_OPEN_MAX_AGE = float(os.getenv("SESSIONS_OPEN_MAX_AGE", "172800"))  # seconds an unfinished session may hold the cursor back
+# sessions in any other state may still be counting bytes, so they are re-read on the next poll
+CLOSED = {"Completed", "Failed", "Canceled", "Cancelled"}
+
+def _ts(v) -> Optional[str]:
+    """TequilAPI RFC 3339 timestamp -> naive UTC isoformat, so cursor comparisons are plain string compares."""
+    if not isinstance(v, str) or not v: return None
+    try: t = datetime.fromisoformat(v.replace("Z", "+00:00"))
+    except ValueError: return None
+    if t.tzinfo: t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return t.isoformat()
+
+def _int(v) -> int:
+    try: return max(0, int(v))
+    except (TypeError, ValueError): return 0
+
+def cursor(node_id: int) -> Optional[str]:
+    with db_conn() as c:
+        r = c.execute("SELECT cursor FROM session_cursor WHERE node_id=?", (node_id,)).fetchone()
+    return r["cursor"] if r else None
+
+def path(cur: Optional[str], page: int = 1) -> str:
+    # date_from is day-granular on the node; anything older than the cursor is dropped again in ingest()
+    q = f"page_size={SESSIONS_PAGE_SIZE}&page={page}"
+    return "/tequilapi/sessions?" + (f"date_from={cur[:10]}&" if cur else "") + q
+
+def parse(doc):
+    """Items and page count from a sessions document (text or decoded): the bare list older nodes return,
+    or {"items", "paging"}. Raises ValueError when it is not one."""
+    if isinstance(doc, str): doc = json.loads(doc) if doc else []
+    if isinstance(doc, dict):
+        items = doc.get("items") or []
+        pages = _int((doc.get("paging") or {}).get("total_pages")) or 1
+    else:
+        items, pages = doc, 1
+    if not isinstance(items, list): raise ValueError("sessions: items is not a list")
+    rows = []
+    for s in items:
+        if not isinstance(s, dict) or not s.get("id"): continue
+        rows.append({"id": str(s["id"]), "started": _ts(s.get("started")), "status": str(s.get("status") or ""),
+                     "bytes_sent": _int(s.get("bytes_sent")), "bytes_received": _int(s.get("bytes_received")),
+                     "consumer_country": str(s.get("consumer_country") or "")})
+    return rows, pages
+
+def _next_cursor(cur: Optional[str], open_starts: list, items: list) -> Optional[str]:
+    # the oldest session that may still change, but never more than SESSIONS_OPEN_MAX_AGE behind the newest one
+    newest = max([s["started"] for s in items if s["started"]] + ([cur] if cur else []), default=None)
+    if newest is None: return None
+    floor = (datetime.fromisoformat(newest) - timedelta(seconds=SESSIONS_OPEN_MAX_AGE)).isoformat()
+    pending = [t for t in open_starts if t >= floor]
+    return min(pending) if pending else newest
+
+def ingest(c, node_id: int, items: list, complete: bool = True) -> tuple:
+    """Fold one poll's sessions into the sessions table and the node's running totals; runs in the caller's transaction.
+    Only sessions at or after the cursor are considered. Returns (sessions, bytes_sent) totals for the node."""
+    r = c.execute("SELECT cursor, sessions, bytes_sent, bytes_received FROM session_cursor WHERE node_id=?", (node_id,)).fetchone()
+    cur = r["cursor"] if r else None
+    total_n, total_tx, total_rx = (r["sessions"], r["bytes_sent"], r["bytes_received"]) if r else (0, 0, 0)
+    if cur: items = [s for s in items if s["started"] is None or s["started"] >= cur]
+    seen = {}
+    ids = list({s["id"] for s in items})
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        seen.update((x["id"], x) for x in c.execute(
+            f"SELECT id, bytes_sent, bytes_received FROM sessions WHERE node_id=? AND id IN ({','.join('?' * len(chunk))})",
+            [node_id] + chunk))
+    for s in items:
+        old = seen.get(s["id"])
+        if old is None: total_n += 1
+        total_tx += s["bytes_sent"] - (old["bytes_sent"] if old else 0)
+        total_rx += s["bytes_received"] - (old["bytes_received"] if old else 0)
+        seen[s["id"]] = s
+    c.executemany("""INSERT INTO sessions(node_id, id, started, status, bytes_sent, bytes_received, consumer_country)
+                     VALUES(:node_id,:id,:started,:status,:bytes_sent,:bytes_received,:consumer_country)
+                     ON CONFLICT(node_id, id) DO UPDATE SET started=COALESCE(excluded.started, started), status=excluded.status,
+                     bytes_sent=excluded.bytes_sent, bytes_received=excluded.bytes_received,
+                     consumer_country=excluded.consumer_country""", [dict(s, node_id=node_id) for s in items])
+    if complete:
+        open_starts = [x["started"] for x in c.execute(
+            f"SELECT started FROM sessions WHERE node_id=? AND started>=? AND status NOT IN ({','.join('?' * len(CLOSED))})",
+            [node_id, cur or ""] + sorted(CLOSED)) if x["started"]]
+        cur = _next_cursor(cur, open_starts, items)
+    c.execute("""INSERT INTO session_cursor(node_id, cursor, sessions, bytes_sent, bytes_received) VALUES(?,?,?,?,?)
+                 ON CONFLICT(node_id) DO UPDATE SET cursor=excluded.cursor, sessions=excluded.sessions,
+                 bytes_sent=excluded.bytes_sent, bytes_received=excluded.bytes_received""",
+              (node_id, cur, total_n, total_tx, total_rx))
+    return total_n, total_tx
@@ -0,0 +1,153 @@
+import os, time, hashlib, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+import paramiko
+import creds
+
+SSH_POOL_MAX = int(os.getenv("SSH_POOL_MAX", "256"))
+SSH_POOL_IDLE = int(os.getenv("SSH_POOL_IDLE", "300"))
+SSH_KEEPALIVE = int(os.getenv("SSH_KEEPALIVE", "30"))
+
+# Errors that mean the cached transport is dead and the node should be reconnected.
+BROKEN = (paramiko.SSHException, EOFError, OSError)
+
+class _Conn:
+    def __init__(self, key):
+        self.key = key
+        self.client: Optional[paramiko.SSHClient] = None
+        self.lock = threading.Lock()
+        self.users = 0
+        self.last_used = time.monotonic()
+
+    def alive(self) -> bool:
+        t = self.client.get_transport() if self.client else None
+        return bool(t and t.is_active() and t.is_authenticated())
+
+    def close(self):
+        if self.client:
+            try: self.client.close()
+            except Exception: pass
+        self.client = None
+
+class SSHPool:
+    """One authenticated transport per (host, port, user, credential), reused across commands."""
+    def __init__(self, max_size=SSH_POOL_MAX, idle_timeout=SSH_POOL_IDLE, keepalive=SSH_KEEPALIVE):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self._conns: "OrderedDict[tuple, _Conn]" = OrderedDict()
+
+    @staticmethod
+    def key(host, port, user, password=None, key_path=None) -> tuple:
+        cred = hashlib.sha256(f"{password or ''}\0{key_path or ''}".encode()).hexdigest()
+        return (host, int(port), user, cred)
+
+    def _connect(self, host, port, user, password, key_path, timeout) -> paramiko.SSHClient:
+        # host key checked against known_hosts, key files parsed once per change, ssh-agent when neither is given
+        client = creds.client(host, port)
+        client.connect(host, port=port, username=user, timeout=timeout, banner_timeout=timeout, auth_timeout=timeout,
+                       **creds.connect_args(password, key_path))
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def _evict(self, now):
+        # caller holds self._lock; never tear down a connection that is in use
+        for k, c in list(self._conns.items()):
+            if c.users == 0 and now - c.last_used > self.idle_timeout:
+                del self._conns[k]; c.close()
+        for k, c in list(self._conns.items()):
+            if len(self._conns) <= self.max_size: break
+            if c.users == 0:
+                del self._conns[k]; c.close()
+
+    def sweep(self):
+        with self._lock:
+            self._evict(time.monotonic())
+
+    def discard(self, key):
+        with self._lock:
+            c = self._conns.pop(key, None)
+        if c: c.close()
+
+    def close_all(self):
+        with self._lock:
+            conns = list(self._conns.values()); self._conns.clear()
+        for c in conns: c.close()
+
+    def size(self) -> int:
+        return len(self._conns)
+
+    def alive(self, key) -> bool:
+        c = self._conns.get(key)
+        return bool(c and c.alive())
+
+    @contextmanager
+    def client(self, host, port, user, password=None, key_path=None, timeout=25):
+        key = self.key(host, port, user, password, key_path)
+        with self._lock:
+            now = time.monotonic()
+            c = self._conns.get(key)
+            if c is None:
+                c = self._conns[key] = _Conn(key)
+            self._conns.move_to_end(key)
+            c.users += 1; c.last_used = now
+            self._evict(now)
+        try:
+            with c.lock:
+                if not c.alive():
+                    c.close()
+                    c.client = self._connect(host, port, user, password, key_path, timeout)
+            yield c.client
+        except BROKEN:
+            # a failed channel or a slow command is not a dead transport; only drop it if it is gone
+            with c.lock:
+                if not c.alive(): c.close()
+            raise
+        finally:
+            with self._lock:
+                c.users -= 1; c.last_used = time.monotonic()
+
+    def exec(self, host, port, user, cmd, password=None, key_path=None, timeout=25, connect_timeout=25, input=None):
+        # a failed channel open means the transport went away under us: reconnect once
+        for attempt in (0, 1):
+            with self.client(host, port, user, password, key_path, connect_timeout) as client:
+                try:
+                    chan = client.get_transport().open_session(timeout=timeout)
+                except BROKEN:
+                    if client.get_transport().is_active(): raise
+                    if attempt: raise
+                    continue
+                try:
+                    chan.settimeout(timeout)
+                    chan.exec_command(cmd)
+                    if input is not None:
+                        try: chan.sendall(input.encode()); chan.shutdown_write()
+                        except OSError: pass  # command exited without reading stdin
+                    stdout, stderr = chan.makefile("rb"), chan.makefile_stderr("rb")
+                    out, err = stdout.read().decode(errors="replace"), stderr.read().decode(errors="replace")
+                    rc = chan.recv_exit_status()
+                    return rc, out, err
+                finally:
+                    chan.close()
+
+pool = SSHPool()
+
+def _cred(n: dict):
+    key_path = None if n.get("use_password") else n.get("key_path")
+    password = n.get("password") if n.get("use_password") else None
+    return password, key_path
+
+def node_key(n: dict) -> tuple:
+    password, key_path = _cred(n)
+    return pool.key(n["host"], n["port"], n["user"], password, key_path)
+
+def node_exec(n: dict, cmd: str, timeout=25, connect_timeout=25, input=None):
+    password, key_path = _cred(n)
+    return pool.exec(n["host"], n["port"], n["user"], cmd, password=password, key_path=key_path,
+                     timeout=timeout, connect_timeout=connect_timeout, input=input)
+
+def node_client(n: dict, timeout=25):
+    password, key_path = _cred(n)
+    return pool.client(n["host"], n["port"], n["user"], password, key_path, timeout)
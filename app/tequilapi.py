@@ -0,0 +1,138 @@
+import os, json, time, socket, threading, http.client
+import paramiko
+from probe import API_ENDPOINTS
+from sshpool import BROKEN, node_client, node_key
+
+TEQUILAPI_MODE = os.getenv("TEQUILAPI_MODE", "tunnel")  # tunnel: HTTP over an SSH direct-tcpip channel, curl: curl on the node
+TEQUILAPI_DENIED_RETRY = float(os.getenv("TEQUILAPI_DENIED_RETRY", "3600"))  # seconds before re-trying a node that refused forwarding
+
+class TequilAPIError(Exception):
+    pass
+
+class ForwardingDenied(TequilAPIError):
+    """The node's sshd refuses direct-tcpip (AllowTcpForwarding no); the caller should use probe.api_commands."""
+
+class _ChannelHTTPConnection(http.client.HTTPConnection):
+    # http.client only needs sendall/makefile/settimeout/close from its socket, and a paramiko Channel has all four
+    def __init__(self, transport, port: int, timeout: float):
+        super().__init__("127.0.0.1", port, timeout=timeout)
+        self.transport = transport
+
+    def connect(self):
+        try:
+            chan = self.transport.open_channel("direct-tcpip", ("127.0.0.1", self.port), ("127.0.0.1", 0), timeout=self.timeout)
+        except paramiko.ChannelException as e:
+            if e.code == paramiko.common.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED:
+                raise ForwardingDenied(f"port forwarding refused: {e.text}")
+            raise TequilAPIError(f"127.0.0.1:{self.port} unreachable on the node: {e.text}")
+        chan.settimeout(self.timeout)
+        self.sock = chan
+
+class Client:
+    """Keep-alive HTTP/1.1 to TequilAPI on one node, riding the node's pooled SSH transport."""
+    def __init__(self, transport, port: int):
+        self.transport = transport
+        self.port = port
+        self.http = _ChannelHTTPConnection(transport, port, 5)
+        self.lock = threading.Lock()
+
+    def usable(self, transport) -> bool:
+        return self.transport is transport and transport.is_active()
+
+    def close(self):
+        try: self.http.close()
+        except Exception: pass
+
+    def request(self, path: str, timeout: float):
+        """GET path; returns (status, body bytes). A kept-alive channel the node already closed is reopened once."""
+        with self.lock:
+            for attempt in (0, 1):
+                reused = self.http.sock is not None
+                self.http.timeout = timeout
+                if reused: self.http.sock.settimeout(timeout)
+                try:
+                    self.http.request("GET", path, headers={"Accept": "application/json"})
+                    resp = self.http.getresponse()
+                    return resp.status, resp.read()
+                except socket.timeout:
+                    self.http.close()
+                    raise
+                except (http.client.HTTPException, OSError):
+                    self.http.close()
+                    if attempt or not reused: raise
+                except Exception:
+                    self.http.close()
+                    raise
+
+# (ssh pool key, api_port) -> Client; entries die with the transport they were opened on
+_clients = {}
+_denied = {}  # ssh pool key -> time.monotonic() when forwarding was refused
+_lock = threading.Lock()
+
+def _client(key: tuple, transport, port: int) -> Client:
+    with _lock:
+        c = _clients.get((key, port))
+        if c is None or not c.usable(transport):
+            if c: c.close()
+            c = _clients[(key, port)] = Client(transport, port)
+        return c
+
+def sweep():
+    with _lock:
+        dead = [k for k, c in _clients.items() if not c.transport.is_active()]
+        for k in dead: _clients.pop(k).close()
+
+def close_all():
+    with _lock:
+        clients = list(_clients.values()); _clients.clear()
+    for c in clients: c.close()
+
+def denied(n: dict) -> bool:
+    """True while the node's refusal to forward is remembered; callers go to curl without asking again."""
+    t = _denied.get(node_key(n))
+    return t is not None and time.monotonic() - t < TEQUILAPI_DENIED_RETRY
+
+def decode(path: str, status: int, body: bytes):
+    if status >= 400: raise TequilAPIError(f"{path}: HTTP {status}")
+    try: return json.loads(body)
+    except ValueError as e: raise TequilAPIError(f"{path}: invalid JSON ({e})")
+
+def get_json(n: dict, path: str, timeout: float = 5, connect_timeout: float = 25):
+    """One decoded TequilAPI document from a node; raises TequilAPIError on HTTP and JSON errors."""
+    with node_client(n, timeout=connect_timeout) as ssh:
+        status, body = _client(node_key(n), ssh.get_transport(), n.get("api_port") or 4050).request(path, timeout)
+    return decode(path, status, body)
+
+def fetch(n: dict, api_port: int, deadline: float = None, connect_timeout: float = 25, paths: dict = None) -> dict:
+    """Every API_ENDPOINTS section for one node over a single kept-alive channel, shaped like probe sections
+    ({"rc", "out", "err"}; out is the JSON body). paths overrides an endpoint's path.
+    Raises ForwardingDenied when the node will not forward."""
+    key = node_key(n)
+    if denied(n): raise ForwardingDenied("port forwarding refused")
+    data = {}
+    with node_client(n, timeout=connect_timeout) as ssh:
+        transport = ssh.get_transport()
+        api = _client(key, transport, api_port)
+        for k, (path, timeout) in API_ENDPOINTS.items():
+            path = (paths or {}).get(k, path)
+            if deadline is not None: timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                data[k] = {"rc": 124, "out": "", "err": "node deadline exceeded"}; continue
+            try:
+                status, body = api.request(path, timeout)
+                decode(path, status, body)
+                data[k] = {"rc": 0, "out": body.decode(errors="replace").strip(), "err": ""}
+            except ForwardingDenied:
+                _denied[key] = time.monotonic()
+                raise
+            except TequilAPIError as e:
+                data[k] = {"rc": 1, "out": "", "err": str(e)}
+            except socket.timeout:
+                data[k] = {"rc": 124, "out": "", "err": f"{path}: timed out after {timeout:g}s"}
+            except BROKEN as e:
+                data[k] = {"rc": 255, "out": "", "err": str(e)}
+                if not transport.is_active(): break
+    _denied.pop(key, None)
+    for k in API_ENDPOINTS:
+        data.setdefault(k, {"rc": 255, "out": "", "err": "ssh transport closed"})
+    return data
@@ -0,0 +1,142 @@
+import os, re, ipaddress, subprocess
+from collections import namedtuple
+
+UFW_BIN = os.getenv("UFW_BIN", "ufw")
+UFW_TIMEOUT = float(os.getenv("UFW_TIMEOUT", "30"))
+
+# port, proto (tcp|udp|any), src: a bare address, a network, or "Anywhere"
+Rule = namedtuple("Rule", "port proto src")
+
+_NUMBERED = re.compile(r"^\[\s*(\d+)\]\s+(.+?)\s{2,}(ALLOW|DENY|REJECT|LIMIT)(?:\s+(IN|OUT|FWD))?\s+(.+?)\s*(?:#.*)?$")
+_ADDED = re.compile(r"^ufw (allow|deny|reject|limit)(?: in)? (.+)$")
+
+class UfwError(Exception):
+    pass
+
+def canon_src(src: str) -> str:
+    src = src.strip()
+    if src.endswith("(v6)"): src = src[:-4].strip()
+    if src.lower() in ("anywhere", "any", ""): return "Anywhere"
+    net = ipaddress.ip_network(src, strict=False)
+    if net.prefixlen == 0: return "Anywhere"
+    return str(net.network_address) if net.prefixlen == net.max_prefixlen else str(net)
+
+def _to(field: str):
+    m = re.fullmatch(r"(\d+)(?:/(tcp|udp))?(?: \(v6\))?", field.strip())
+    return (int(m.group(1)), m.group(2) or "any") if m else None
+
+def parse_numbered(text: str) -> list:
+    """Rules from `ufw status numbered`: [(number, Rule or None, line)]; None marks rules this module does not manage
+    (application profiles, ranges, interfaces, non-ALLOW actions)."""
+    out = []
+    for line in text.splitlines():
+        m = _NUMBERED.match(line.strip())
+        if not m: continue
+        num, to, action, direction, src = m.groups()
+        port = _to(to)
+        rule = None
+        if port and action == "ALLOW" and direction in (None, "IN"):
+            try: rule = Rule(port[0], port[1], canon_src(src))
+            except ValueError: rule = None
+        out.append((int(num), rule, line.strip()))
+    return out
+
+def parse_added(text: str) -> list:
+    """Rules from `ufw show added`, which still lists them while the firewall is inactive."""
+    out = []
+    for line in text.splitlines():
+        m = _ADDED.match(line.strip())
+        if not m: continue
+        action, spec = m.groups(); rule = None
+        words = spec.split()
+        if action == "allow":
+            try:
+                if len(words) == 1 and _to(words[0]):
+                    port, proto = _to(words[0]); rule = Rule(port, proto, "Anywhere")
+                elif words[:1] == ["from"] and words[2:5] == ["to", "any", "port"]:
+                    proto = words[words.index("proto") + 1] if "proto" in words else "any"
+                    rule = Rule(int(words[5]), proto, canon_src(words[1]))
+            except (ValueError, IndexError):
+                rule = None
+        out.append((None, rule, line.strip()))
+    return out
+
+def spec(rule: Rule) -> list:
+    src = "any" if rule.src == "Anywhere" else rule.src
+    args = ["from", src, "to", "any", "port", str(rule.port)]
+    if rule.proto != "any": args += ["proto", rule.proto]
+    return args
+
+def desired_rules(acl_rows, client_ip: str, panel_port: int):
+    """Enabled acl rows plus the caller's address on SSH and the panel port, so applying never locks the admin out.
+    Returns (rules, managed (port, proto) pairs, errors)."""
+    wanted, errors = [], []
+    for r in list(acl_rows) + [{"port": 22, "proto": "tcp", "cidr": client_ip}, {"port": panel_port, "proto": "tcp", "cidr": client_ip}]:
+        if "enabled" in r and not r["enabled"]: continue
+        try:
+            proto = (r.get("proto") or "tcp").lower()
+            if proto not in ("tcp", "udp", "any"): raise ValueError(f"bad proto {proto}")
+            wanted.append(Rule(int(r["port"]), proto, canon_src(str(r["cidr"]))))
+        except (ValueError, TypeError) as e:
+            errors.append(f"acl {r.get('id', '')} {r.get('port')}/{r.get('proto')} from {r.get('cidr')}: {e}")
+    managed = {(22, "tcp"), (panel_port, "tcp"), (80, "tcp"), (443, "tcp")} | {(int(r["port"]), (r.get("proto") or "tcp").lower()) for r in acl_rows}
+    return list(dict.fromkeys(wanted)), managed, errors
+
+def _ufw(*args) -> str:
+    try:
+        p = subprocess.run([UFW_BIN, *args], capture_output=True, text=True, timeout=UFW_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise UfwError(f"{UFW_BIN} {' '.join(args)}: {e}")
+    if p.returncode != 0:
+        raise UfwError(f"{UFW_BIN} {' '.join(args)} -> {p.returncode}: {(p.stderr or p.stdout).strip()}")
+    return p.stdout
+
+def current() -> tuple:
+    """(active, [(number, Rule|None, line)]) from a single status read."""
+    status = _ufw("status", "numbered")
+    if "Status: inactive" in status:
+        return False, parse_added(_ufw("show", "added"))
+    return True, parse_numbered(status)
+
+def plan(wanted, managed, active: bool, existing) -> dict:
+    have = {r for _, r, _ in existing if r is not None}
+    add = [r for r in wanted if r not in have]
+    delete = sorted({r for r in have if (r.port, r.proto) in managed and r not in set(wanted)})
+    keep = sorted(have & set(wanted))
+    return {"active": active, "add": add, "delete": delete, "keep": keep,
+            "commands": [["allow", *spec(r)] for r in add] + [["delete", "allow", *spec(r)] for r in delete]
+                        + ([] if active else [["default", "deny", "incoming"], ["default", "allow", "outgoing"], ["--force", "enable"]])}
+
+def reconcile(acl_rows, client_ip: str, panel_port: int, dry_run: bool = False) -> dict:
+    """Bring ufw in line with the acl table with the fewest commands.
+
+    Rules are added before stale ones are deleted, so allowed traffic is never cut off in between, and
+    deletes go by rule spec rather than by number, so they do not depend on renumbering. If any step
+    fails, the steps already applied are undone in reverse order."""
+    wanted, managed, errors = desired_rules(acl_rows, client_ip, panel_port)
+    active, existing = current()
+    p = plan(wanted, managed, active, existing)
+    res = {"active": active, "errors": errors, "dry_run": dry_run,
+           "add": [r._asdict() for r in p["add"]], "delete": [r._asdict() for r in p["delete"]],
+           "keep": len(p["keep"]), "commands": [" ".join([UFW_BIN, *c]) for c in p["commands"]],
+           "applied": 0, "ok": True, "rolled_back": False}
+    if dry_run: return res
+    done = []
+    try:
+        for r in p["add"]:
+            _ufw("allow", *spec(r)); done.append(("add", r)); res["applied"] += 1
+        for r in p["delete"]:
+            _ufw("delete", "allow", *spec(r)); done.append(("delete", r)); res["applied"] += 1
+        if not active:
+            # enable last: by now the admin's SSH and panel rules are in place
+            _ufw("default", "deny", "incoming"); _ufw("default", "allow", "outgoing"); _ufw("--force", "enable")
+    except UfwError as e:
+        res["ok"] = False; res["errors"].append(str(e))
+        for op, r in reversed(done):
+            try:
+                if op == "add": _ufw("delete", "allow", *spec(r))
+                else: _ufw("allow", *spec(r))
+            except UfwError as re_:
+                res["errors"].append(f"rollback: {re_}")
+        res["rolled_back"] = True
+    return res
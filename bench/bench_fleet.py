@@ -0,0 +1,276 @@
+"""Fleet simulation: N fake nodes on localhost, measured through the panel's own code paths.
+
+Each fake node is an SSH login (user n<i>) on one of a few paramiko servers running in child processes, so the
+fleet does not compete with the panel for the GIL. A node answers the collector's probe script (uptime, docker,
+ufw, /proc/net/dev) and serves TequilAPI over direct-tcpip (or curl commands) with a configurable latency and
+session-list size. A fraction of nodes can be down (closed port) or hung (accepts, never sends a banner).
+
+    python bench/bench_fleet.py [--sizes 10,100,1000,10000] [--sessions 50] [--api-latency 5] [--ssh-latency 0]
+                                [--fail-rate 0.02] [--hang-rate 0.01] [--concurrency 32] [--repeat 5]
+                                [--out results.json] [--compare baseline.json --tolerance 0.2]
+
+Prints one JSON document: per fleet size, collect (one node), collect_all (cold and warm pool), the nodes page,
+/api/nodes and /metrics. With --compare, exits 1 when any timing is slower than the baseline by more than --tolerance.
+"""
+import os, sys, re, json, time, shlex, base64, random, socket, argparse, resource, platform, statistics, subprocess
+import tempfile, threading, multiprocessing
+from datetime import datetime, timedelta
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP)
+os.environ.setdefault("SCHEDULER_ENABLED", "0")
+os.environ.setdefault("METRICS_TOKEN", "bench")
+os.environ.setdefault("ADMIN_PASSWORD", "bench")
+import paramiko
+
+T0 = time.time()
+BOOT = "5c1f6a2e-bench-0000-0000-000000000000"
+
+# ---------- fake node ----------
+def sessions_doc(i: int, a, query: dict) -> dict:
+    now = datetime.utcnow()
+    items = [{"id": f"{i}-{j}", "started": (now - timedelta(minutes=j)).isoformat() + "Z",
+              "status": "Connected" if j < 2 else "Completed", "bytes_sent": 1_000_000 * (j + 1),
+              "bytes_received": 50_000 * (j + 1), "consumer_country": "DE"} for j in range(a.sessions)]
+    if "page_size" not in query: return items
+    size, page = int(query["page_size"]), int(query.get("page", 1))
+    return {"items": items[(page - 1) * size:page * size], "paging": {"total_pages": max(1, -(-len(items) // size)), "current_page": page}}
+
+def api_doc(i: int, path: str, a) -> tuple:
+    base, _, qs = path.partition("?")
+    query = dict(p.split("=", 1) for p in qs.split("&") if "=" in p)
+    docs = {"/tequilapi/health": lambda: {"uptime": "3h", "version": "1.30.0"},
+            "/tequilapi/sessions": lambda: sessions_doc(i, a, query),
+            "/tequilapi/nat/type": lambda: {"type": "fullcone"},
+            "/tequilapi/identities": lambda: {"identities": [{"id": f"0x{i:040x}"}]},
+            "/tequilapi/services": lambda: [{"type": "wireguard", "status": "Running"}]}
+    if base not in docs: return 404, b"{}"
+    return 200, json.dumps(docs[base]()).encode()
+
+def answer(i: int, cmd: str, a) -> str:
+    """Output of one probe command on node i."""
+    if "curl" in cmd:
+        m = re.search(r"http://127\.0\.0\.1:\d+(\S+?)'?(?:\s|$)", cmd)
+        return api_doc(i, m.group(1), a)[1].decode() if m else ""
+    if cmd.startswith("uptime"): return "up 3 hours"
+    if cmd.startswith("docker"): return "myst-node|Up 3 hours"
+    if cmd.startswith("ufw"): return "Status: active"
+    if "/proc/net/dev" in cmd:
+        t = time.time(); rate = 125_000 * (1 + i % 50)  # 1..50 Mbps
+        rx = int((t - T0) * rate) + 10 ** 9; tx = rx // 10
+        return (f"now {t:.6f}\nboot {BOOT}\ndev eth0\nInter-|   Receive\n face |bytes packets\n"
+                f"    lo: 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0\n  eth0: {rx} 0 0 0 0 0 0 0 {tx} 0 0 0 0 0 0 0")
+    return ""
+
+def probe_reply(i: int, script: str, a) -> bytes:
+    out = {}
+    for line in script.splitlines():
+        if line.startswith("sec "):
+            _, key, cmd = shlex.split(line)
+            out[key] = {"rc": 0, "out": base64.b64encode(answer(i, cmd, a).encode()).decode(), "err": ""}
+    return (json.dumps(out) + "\n").encode()
+
+class FakeNode(paramiko.ServerInterface):
+    def __init__(self):
+        self.node = None; self.requests = {}; self.ready = threading.Event()
+    def check_auth_password(self, user, password):
+        if not user.startswith("n"): return paramiko.AUTH_FAILED
+        self.node = int(user[1:]); return paramiko.AUTH_SUCCESSFUL
+    def get_allowed_auths(self, user): return "password"
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+    def check_channel_direct_tcpip_request(self, chanid, origin, dest):
+        self.requests[chanid] = ("http", None); return paramiko.OPEN_SUCCEEDED
+    def check_channel_exec_request(self, channel, command):
+        self.requests[channel.get_id()] = ("exec", command.decode()); return True
+
+def serve_http(chan, i, a):
+    # keep-alive HTTP/1.1 straight over the channel; TequilAPI latency is added per request
+    f = chan.makefile("rb")
+    while True:
+        line = f.readline()
+        if not line: break
+        while f.readline() not in (b"\r\n", b"\n", b""): pass
+        if a.api_latency: time.sleep(a.api_latency / 1000)
+        status, body = api_doc(i, line.split()[1].decode(), a)
+        chan.sendall(b"HTTP/1.1 %d OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % (status, len(body)) + body)
+    chan.close()
+
+def serve_exec(chan, i, cmd, a):
+    if a.ssh_latency: time.sleep(a.ssh_latency / 1000)
+    if cmd == "sh -s":
+        buf = []
+        while True:
+            d = chan.recv(65536)
+            if not d: break
+            buf.append(d)
+        out = probe_reply(i, b"".join(buf).decode(), a)
+    else:
+        out = answer(i, cmd, a).encode()
+    chan.sendall(out); chan.send_exit_status(0); chan.close()
+
+def serve_conn(sock, hostkey, a):
+    t = paramiko.Transport(sock)
+    t.add_server_key(hostkey)
+    srv = FakeNode()
+    try: t.start_server(server=srv)
+    except (paramiko.SSHException, EOFError, OSError): return
+    while t.is_active():
+        chan = t.accept(1)
+        if chan is None: continue
+        for _ in range(100):  # the request arrives right after the channel opens
+            kind = srv.requests.pop(chan.get_id(), None)
+            if kind: break
+            time.sleep(0.005)
+        if not kind: chan.close(); continue
+        target = serve_http if kind[0] == "http" else serve_exec
+        args = (chan, srv.node, a) if kind[0] == "http" else (chan, srv.node, kind[1], a)
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+def serve(ls, a):
+    hostkey = paramiko.ECDSAKey.generate()
+    while True:
+        c, _ = ls.accept()
+        threading.Thread(target=serve_conn, args=(c, hostkey, a), daemon=True).start()
+
+def hang(ls):
+    held = []
+    while True: held.append(ls.accept()[0])  # accept and never answer
+
+def listener():
+    ls = socket.socket(); ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ls.bind(("127.0.0.1", 0)); ls.listen(1024)
+    return ls
+
+def start_fleet(a) -> dict:
+    ctx = multiprocessing.get_context("fork")
+    ports = []
+    for _ in range(a.fleet_procs):
+        ls = listener(); ports.append(ls.getsockname()[1])
+        ctx.Process(target=serve, args=(ls, a), daemon=True).start(); ls.close()
+    hl = listener()
+    ctx.Process(target=hang, args=(hl,), daemon=True).start(); hung = hl.getsockname()[1]; hl.close()
+    s = socket.socket(); s.bind(("127.0.0.1", 0)); closed = s.getsockname()[1]; s.close()
+    return {"ports": ports, "hung": hung, "closed": closed}
+
+# ---------- panel side ----------
+def seed(n: int, fleet: dict, a):
+    import db
+    db.DB_PATH = os.path.join(a.tmp, f"fleet-{n}.db")
+    db.db_init()
+    rnd = random.Random(n)
+    rows = []
+    for i in range(n):
+        r = rnd.random()
+        port = fleet["closed"] if r < a.fail_rate else fleet["hung"] if r < a.fail_rate + a.hang_rate else fleet["ports"][i % len(fleet["ports"])]
+        rows.append(("127.0.0.1", f"n{i}", port, "x", 100.0, f"pool-{i % 10}", datetime.utcnow().isoformat()))
+    with db.db_conn() as c:
+        c.executemany("""INSERT INTO nodes(host,user,port,use_password,password,wg_port,api_port,capacity_mbps,tags,created_at)
+                         VALUES(?,?,?,1,?,51820,4050,?,?,?)""", rows)
+        c.execute("INSERT OR REPLACE INTO settings(key,value) VALUES('usd_per_gb','0.1')")
+
+def timed(fn):
+    t = time.perf_counter(); r = fn()
+    return round(time.perf_counter() - t, 4), r
+
+def spread(xs: list) -> dict:
+    xs = sorted(xs)
+    return {"median": round(statistics.median(xs), 4), "max": round(xs[-1], 4), "n": len(xs)} if xs else {}
+
+def web_client():
+    # the real app, routes, middleware and templates; needs the panel's full requirements
+    os.chdir(APP)
+    from fastapi.testclient import TestClient
+    import main
+    cl = TestClient(main.app)
+    cl.post("/login", data={"username": main.ADMIN_USER, "password": main.ADMIN_PASSWORD}, follow_redirects=False)
+    return cl
+
+def run_size(n: int, fleet: dict, a, web) -> dict:
+    import collector, exporter, tequilapi
+    from db import db_conn
+    from sshpool import pool
+    pool.close_all(); tequilapi.close_all()
+    seed(n, fleet, a)
+    exporter.warm()
+    out = {"nodes": n}
+    out["collect_all_cold_s"], s = timed(lambda: collector.collect_all(a.concurrency))
+    out["collect_all_ok"], out["collect_all_failed"] = s["ok"], s["failed"] + s["timeout"]
+    out["collect_all_warm_s"], s = timed(lambda: collector.collect_all(a.concurrency))
+    out["collect_all_skipped"] = s["skipped"]
+    with db_conn() as c:
+        healthy = [dict(r) for r in c.execute("SELECT n.* FROM nodes n JOIN node_status st ON st.node_id=n.id WHERE st.collect_status='ok' LIMIT ?", (a.repeat,))]
+    out["collect_one_s"] = spread([timed(lambda: collector.collect_many([x], skip_open=False))[0] for x in healthy])
+    exporter.set_usd_per_gb(0.1)  # invalidates the rendered scrape
+    out["metrics_render_s"] = {"build": timed(exporter.render)[0], "cached": timed(exporter.render)[0]}
+    if isinstance(web, str):
+        out["web_error"] = web
+    else:
+        for key, url, headers in (("nodes_page_s", "/nodes", {}), ("api_nodes_s", "/api/nodes?limit=100&sort=mbps", {}),
+                                  ("metrics_scrape_s", "/metrics", {"Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"})):
+            times = []
+            for _ in range(a.repeat):
+                t, r = timed(lambda: web.get(url, headers=headers))
+                if r.status_code != 200: out.setdefault("web_error", f"{url}: HTTP {r.status_code}")
+                times.append(t)
+            out[key] = spread(times)
+    out["rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return out
+
+def timings(doc: dict) -> dict:
+    # (nodes, metric) -> seconds, for comparing runs
+    flat = {}
+    for r in doc.get("results", []):
+        for k, v in r.items():
+            if k.endswith("_s") and isinstance(v, (int, float)): flat[(r["nodes"], k)] = v
+            elif k.endswith("_s") and isinstance(v, dict):
+                for sub in ("median", "build"):
+                    if sub in v: flat[(r["nodes"], f"{k}.{sub}")] = v[sub]
+    return flat
+
+def compare(doc: dict, baseline: dict, tolerance: float) -> list:
+    old, new = timings(baseline), timings(doc)
+    return [{"nodes": k[0], "metric": k[1], "baseline": old[k], "now": v, "ratio": round(v / old[k], 2)}
+            for k, v in sorted(new.items()) if k in old and old[k] > 0.001 and v > old[k] * (1 + tolerance)]
+
+def git_rev() -> str:
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP, capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception: return ""
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,1000,10000")
+    ap.add_argument("--sessions", type=int, default=50, help="sessions each node reports")
+    ap.add_argument("--api-latency", type=float, default=5, help="ms per TequilAPI request")
+    ap.add_argument("--ssh-latency", type=float, default=0, help="ms per SSH exec")
+    ap.add_argument("--fail-rate", type=float, default=0.02, help="fraction of nodes with a closed SSH port")
+    ap.add_argument("--hang-rate", type=float, default=0.01, help="fraction of nodes that accept but never answer")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--fleet-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out")
+    ap.add_argument("--compare")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    a = ap.parse_args()
+    a.tmp = tempfile.mkdtemp(prefix="myst-fleet-")
+    os.environ["MYST_MANAGER_DB"] = os.path.join(a.tmp, "fleet.db")
+    fleet = start_fleet(a)
+    try: web = web_client()
+    except ImportError as e: web = f"web app not importable: {e}"
+    doc = {"bench": "fleet", "started": datetime.utcnow().isoformat(), "git": git_rev(), "python": platform.python_version(),
+           "params": {k: v for k, v in vars(a).items() if k not in ("out", "compare", "tmp")}, "results": []}
+    for n in [int(x) for x in a.sizes.split(",") if x]:
+        doc["results"].append(run_size(n, fleet, a, web))
+        print(json.dumps(doc["results"][-1]), file=sys.stderr, flush=True)
+    rc = 0
+    if a.compare:
+        with open(a.compare) as f: doc["regressions"] = compare(doc, json.load(f), a.tolerance)
+        rc = 1 if doc["regressions"] else 0
+    text = json.dumps(doc, indent=2)
+    if a.out:
+        with open(a.out, "w") as f: f.write(text + "\n")
+    print(text)
+    sys.exit(rc)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Mixed read/write throughput of the panel DB: legacy (connect per call, rollback journal,
+no metrics index) vs. the storage layer in app/db.py (WAL, per-thread connections, indexes).
+
+    python bench/bench_storage.py [--nodes 300] [--rows 200000] [--seconds 10] [--readers 8] [--writers 2]
+
+Prints one JSON document with ops/s per mode.
+"""
+import os, sys, json, time, random, sqlite3, argparse, tempfile, threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+def seed(path, nodes, rows):
+    os.environ["MYST_MANAGER_DB"] = path
+    import db
+    db.DB_PATH = path
+    db.db_init()
+    c = db.db_conn()
+    t0 = datetime.utcnow() - timedelta(days=7)
+    with c:
+        c.executemany("INSERT INTO nodes(host,user,port) VALUES(?,?,22)", [(f"10.0.{i // 250}.{i % 250}", "ubuntu") for i in range(nodes)])
+        c.execute("INSERT INTO settings(key,value) VALUES('usd_per_gb','0.1')")
+        c.executemany("INSERT INTO metrics(node_id, ts, sessions, bytes_total, api_ok, nat_type) VALUES(?,?,?,?,1,'cone')",
+                      [(i % nodes + 1, (t0 + timedelta(seconds=i * 3)).isoformat(), i % 7, i * 1000) for i in range(rows)])
+    return db
+
+def legacy_conn(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def workload(get_conn, nodes, seconds, readers, writers):
+    stop = time.monotonic() + seconds
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    since = (datetime.utcnow() - timedelta(hours=6)).isoformat()
+    def reader():
+        n = e = 0
+        while time.monotonic() < stop:
+            nid = random.randint(1, nodes)
+            try:
+                with get_conn() as c:
+                    c.execute("SELECT value FROM settings WHERE key=?", ("usd_per_gb",)).fetchone()
+                with get_conn() as c:
+                    c.execute("SELECT ts, sessions, bytes_total FROM metrics WHERE node_id=? AND ts>=? ORDER BY ts", (nid, since)).fetchall()
+                n += 1
+            except sqlite3.OperationalError:
+                e += 1
+        with lock: counts["reads"] += n; counts["errors"] += e
+    def writer():
+        n = e = 0
+        while time.monotonic() < stop:
+            nid = random.randint(1, nodes); now = datetime.utcnow().isoformat()
+            try:
+                with get_conn() as c:
+                    c.execute("UPDATE nodes SET last_seen=?, last_metrics=? WHERE id=?", (now, "{}", nid))
+                    c.execute("INSERT INTO metrics(node_id, ts, sessions, bytes_total, api_ok, nat_type) VALUES(?,?,1,1,1,'cone')", (nid, now))
+                n += 1
+            except sqlite3.OperationalError:
+                e += 1
+        with lock: counts["writes"] += n; counts["errors"] += e
+    ts = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer) for _ in range(writers)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    return {k: v for k, v in counts.items()} | {"reads_per_s": round(counts["reads"] / seconds, 1),
+                                                  "writes_per_s": round(counts["writes"] / seconds, 1)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=300)
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--readers", type=int, default=8)
+    ap.add_argument("--writers", type=int, default=2)
+    a = ap.parse_args()
+    tmp = tempfile.mkdtemp(prefix="myst-bench-")
+    path = os.path.join(tmp, "bench.db")
+    db = seed(path, a.nodes, a.rows)
+    legacy = os.path.join(tmp, "legacy.db")
+    db.db_conn().execute("VACUUM INTO ?", (legacy,))
+    c = sqlite3.connect(legacy)
+    c.execute("PRAGMA journal_mode=DELETE")
+    for (name,) in c.execute("SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_%'").fetchall():
+        c.execute(f"DROP INDEX {name}")
+    c.commit(); c.close()
+    out = {"nodes": a.nodes, "rows": a.rows, "seconds": a.seconds, "readers": a.readers, "writers": a.writers,
+           "legacy": workload(lambda: legacy_conn(legacy), a.nodes, a.seconds, a.readers, a.writers),
+           "pooled_wal": workload(db.db_conn, a.nodes, a.seconds, a.readers, a.writers)}
+    print(json.dumps(out, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ DB_PATH="${APP_DIR}/manager.db"
 mkdir -p "${APP_DIR}"
 cp -r "${REPO_DIR}/app" "${APP_DIR}/"
 cp -r "${REPO_DIR}/scripts/remote_install.sh" "${APP_DIR}/"
+cp "${REPO_DIR}/scripts/myst_agent.py" "${APP_DIR}/"
 cp "${REPO_DIR}/requirements.txt" "${APP_DIR}/"
 chmod +x "${APP_DIR}/remote_install.sh"
 
@@ -24,6 +25,7 @@ echo "== MysteriumNET setup =="
 read -rp "Admin username [admin]: " ADMIN_USER; ADMIN_USER=${ADMIN_USER:-admin}
 read -rsp "Admin password: " ADMIN_PASSWORD; echo
 read -rp "Uvicorn port [8080]: " UVICORN_PORT; UVICORN_PORT=${UVICORN_PORT:-8080}
+read -rp "Web workers [1]: " WEB_WORKERS; WEB_WORKERS=${WEB_WORKERS:-1}
 SECRET_KEY=$(python3 - <<'PY'
 import secrets; print(secrets.token_hex(32))
 PY
@@ -32,6 +34,7 @@ PY
 cat > "${ENV_FILE}" <<EOF
 UVICORN_HOST=0.0.0.0
 UVICORN_PORT=${UVICORN_PORT}
+WEB_WORKERS=${WEB_WORKERS}
 MYST_MANAGER_DB=${DB_PATH}
 ADMIN_USER=${ADMIN_USER}
 ADMIN_PASSWORD=${ADMIN_PASSWORD}
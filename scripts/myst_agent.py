@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Push-mode collector for one Mysterium node. Runs the panel's probe commands and TequilAPI requests locally
+# and POSTs the samples to the panel's /api/ingest, buffering them while the panel is unreachable.
+# Standard library only; installed by remote_install.sh when the panel deploys with the agent option.
+import sys, json, gzip, time, ssl, subprocess, threading, collections, urllib.request, urllib.error
+from datetime import datetime
+
+VERSION = "1"
+BUFFER = 1440      # samples kept while the panel is unreachable (a day at the default interval)
+PUSH_BATCH = 120   # samples per request; matches the panel's INGEST_MAX_SAMPLES default
+
+def log(msg):
+    print(f"{datetime.utcnow().isoformat()} {msg}", flush=True)
+
+def run_command(cmd, timeout):
+    try:
+        p = subprocess.run(["sh", "-c", cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        return {"rc": p.returncode, "out": p.stdout.decode(errors="replace").strip(), "err": p.stderr.decode(errors="replace").strip()}
+    except subprocess.TimeoutExpired:
+        return {"rc": 124, "out": "", "err": f"timed out after {timeout}s"}
+    except OSError as e:
+        return {"rc": 255, "out": "", "err": str(e)}
+
+def api_get(port, path, timeout):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+def api_section(port, path, timeout):
+    try:
+        return {"rc": 0, "out": json.dumps(api_get(port, path, timeout)), "err": ""}
+    except urllib.error.HTTPError as e:
+        return {"rc": 1, "out": "", "err": f"{path}: HTTP {e.code}"}
+    except ValueError as e:
+        return {"rc": 1, "out": "", "err": f"{path}: invalid JSON ({e})"}
+    except Exception as e:  # connection refused, timeout
+        return {"rc": 124 if "timed out" in str(e) else 255, "out": "", "err": f"{path}: {e}"}
+
+def sessions_section(port, template, timeout):
+    # every page from the panel's session cursor; "complete" tells the panel it may advance the cursor
+    items, page, pages = [], 1, 1
+    while page <= pages:
+        path = template.replace("{page}", str(page))
+        try: doc = api_get(port, path, timeout)
+        except Exception:
+            if page == 1: return api_section(port, path, timeout)
+            break
+        if isinstance(doc, dict):
+            items += doc.get("items") or []
+            pages = int((doc.get("paging") or {}).get("total_pages") or 1)
+        else:
+            items += doc
+        page += 1
+    return {"rc": 0, "out": json.dumps(items), "err": "", "complete": page > pages}
+
+def sample(cfg):
+    t0 = time.monotonic(); ts = datetime.utcnow().isoformat()
+    data, threads, port = {}, [], cfg.get("api_port", 4050)
+    def go(k, fn, *a): data[k] = fn(*a)
+    for k, cmd in cfg["commands"].items():
+        threads.append(threading.Thread(target=go, args=(k, run_command, cmd, 20)))
+    for k, (path, timeout) in cfg["api"].items():
+        if k == "api_sessions": threads.append(threading.Thread(target=go, args=(k, sessions_section, port, path, timeout)))
+        else: threads.append(threading.Thread(target=go, args=(k, api_section, port, path, timeout)))
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return {"ts": ts, "duration": round(time.monotonic() - t0, 3), "data": data}
+
+def push(cfg, samples):
+    body = gzip.compress(json.dumps({"agent": VERSION, "samples": samples}).encode())
+    req = urllib.request.Request(cfg["url"], data=body, method="POST", headers={
+        "Authorization": f"Bearer {cfg['token']}", "Content-Type": "application/json", "Content-Encoding": "gzip"})
+    ctx = ssl.create_default_context()
+    if not cfg.get("verify_tls", True):
+        ctx.check_hostname = False; ctx.verify_mode = ssl.CERT_NONE
+    with urllib.request.urlopen(req, timeout=60, context=ctx) as resp:
+        return json.loads(resp.read() or b"{}")
+
+def main(path):
+    with open(path) as f: cfg = json.load(f)
+    buf = collections.deque(maxlen=BUFFER)
+    log(f"myst-agent {VERSION} pushing to {cfg['url']} every {cfg['interval']:g}s")
+    while True:
+        started = time.monotonic()
+        buf.append(sample(cfg))
+        while buf:
+            batch = list(buf)[:PUSH_BATCH]
+            try:
+                reply = push(cfg, batch)
+            except urllib.error.HTTPError as e:
+                log(f"push rejected: HTTP {e.code}")
+                if e.code == 400: buf.clear()  # the panel will never take these samples
+                break
+            except Exception as e:
+                log(f"push failed, {len(buf)} samples buffered: {e}")
+                break
+            for _ in batch: buf.popleft()
+            # the panel owns the session cursor and the interval
+            if reply.get("sessions_path"): cfg["api"]["api_sessions"][0] = reply["sessions_path"]
+            if reply.get("interval"): cfg["interval"] = float(reply["interval"])
+        time.sleep(max(1.0, cfg["interval"] - (time.monotonic() - started)))
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "/opt/myst/agent/config.json")
@@ -7,33 +7,69 @@ MGMT_IP="${MGMT_IP:-}"
 PAYOUT_ADDRESS="${PAYOUT_ADDRESS:-}"
 WG_PORT="${WG_PORT:-51820}"
 API_PORT="${API_PORT:-4050}"
-apt-get update -y
-apt-get install -y ca-certificates curl gnupg jq ufw vnstat
-install -m 0755 -d /etc/apt/keyrings
-if [[ ! -f /etc/apt/keyrings/docker.gpg ]]; then
-  curl -fsSL https://download.docker.com/linux/ubuntu/gpg | gpg --dearmor -o /etc/apt/keyrings/docker.gpg
+INSTALL_AGENT="${INSTALL_AGENT:-}"
+MYST_ENV_B64="${MYST_ENV_B64:-}"  # myst.env as rendered by the panel; built from the variables above when empty
+FORCE="${FORCE:-}"                # run every step even when its marker says it is done
+STATE=/opt/myst/.deploy           # markers of finished steps, and the copy of this script the panel compares against
+SELF="$(readlink -f "$0")"
+install -m 0755 -d "${STATE}"
+# step_done <step> <key>: the step last finished with the same inputs
+step_done() { [[ -z "${FORCE}" && -f "${STATE}/$1" && "$(cat "${STATE}/$1")" == "$2" ]]; }
+mark() { printf '%s' "$2" > "${STATE}/$1"; }
+CHANGED=false
+# write_if_changed <path>: replace <path> with stdin only when the content differs
+write_if_changed() {
+  local tmp; tmp=$(mktemp)
+  cat >"${tmp}"
+  if cmp -s "${tmp}" "$1"; then rm -f "${tmp}"; return; fi
+  install -m 0644 "${tmp}" "$1"; rm -f "${tmp}"
+  CHANGED=true; echo "== updated $1"
+}
+
+PACKAGES_KEY="1 ca-certificates curl gnupg jq ufw vnstat python3 docker-ce docker-compose-plugin"
+if step_done packages "${PACKAGES_KEY}" && command -v docker >/dev/null; then
+  echo "== packages: up to date"
+else
+  apt-get update -y
+  apt-get install -y ca-certificates curl gnupg jq ufw vnstat python3
+  install -m 0755 -d /etc/apt/keyrings
+  if [[ ! -f /etc/apt/keyrings/docker.gpg ]]; then
+    curl -fsSL https://download.docker.com/linux/ubuntu/gpg | gpg --dearmor -o /etc/apt/keyrings/docker.gpg
+  fi
+  echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu $(. /etc/os-release; echo $VERSION_CODENAME) stable" > /etc/apt/sources.list.d/docker.list
+  apt-get update -y
+  apt-get install -y docker-ce docker-ce-cli containerd.io docker-compose-plugin
+  systemctl enable --now docker
+  mark packages "${PACKAGES_KEY}"
 fi
-echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu $(. /etc/os-release; echo $VERSION_CODENAME) stable" > /etc/apt/sources.list.d/docker.list
-apt-get update -y
-apt-get install -y docker-ce docker-ce-cli containerd.io docker-compose-plugin
-systemctl enable --now docker
-if ! ufw status | grep -q "Status: active"; then
-  ufw default deny incoming
-  ufw default allow outgoing
-  ufw allow OpenSSH
-  ufw allow ${WG_PORT}/udp
-  yes | ufw enable
+
+if step_done firewall "wg=${WG_PORT}" && ufw status | grep -q "Status: active"; then
+  echo "== firewall: up to date"
 else
-  ufw allow ${WG_PORT}/udp || true
+  if ! ufw status | grep -q "Status: active"; then
+    ufw default deny incoming
+    ufw default allow outgoing
+    ufw allow OpenSSH
+    ufw allow ${WG_PORT}/udp
+    ufw --force enable
+  else
+    ufw allow ${WG_PORT}/udp || true
+  fi
+  mark firewall "wg=${WG_PORT}"
 fi
+
 mkdir -p /opt/myst/{data,logs}
-cat >/opt/myst/myst.env <<EOF
+if [[ -n "${MYST_ENV_B64}" ]]; then
+  write_if_changed /opt/myst/myst.env < <(echo "${MYST_ENV_B64}" | base64 -d)
+else
+  write_if_changed /opt/myst/myst.env <<EOF
 LOG_LEVEL=info
 MYST_TEQUILA_API_PORT=${API_PORT}
 WIREGUARD_PORT=${WG_PORT}
 PAYOUT_ADDRESS=${PAYOUT_ADDRESS}
 EOF
-cat >/opt/myst/docker-compose.yml <<'EOF'
+fi
+write_if_changed /opt/myst/docker-compose.yml <<'EOF'
 version: "3.8"
 services:
   myst:
@@ -47,4 +83,33 @@ services:
       - /opt/myst/data:/var/lib/mysterium-node
       - /opt/myst/logs:/var/log/mysterium
 EOF
-cd /opt/myst && docker compose up -d
+# compose recreates the container when myst.env or the compose file changed
+if [[ -n "${FORCE}" || "${CHANGED}" == true || "$(docker inspect -f '{{.State.Running}}' myst-node 2>/dev/null)" != "true" ]]; then
+  cd /opt/myst && docker compose up -d
+else
+  echo "== myst-node: running with the current config"
+fi
+if [[ -n "${INSTALL_AGENT}" && -f /tmp/myst_agent.py && -f /tmp/myst_agent.json ]]; then
+  install -m 0755 -d /opt/myst/agent
+  install -m 0755 /tmp/myst_agent.py /opt/myst/agent/myst_agent.py
+  install -m 0600 /tmp/myst_agent.json /opt/myst/agent/config.json
+  rm -f /tmp/myst_agent.py /tmp/myst_agent.json
+  cat >/etc/systemd/system/myst-agent.service <<'EOF'
+[Unit]
+Description=MysteriumNET push agent
+After=network-online.target docker.service
+[Service]
+Type=simple
+ExecStart=/usr/bin/python3 /opt/myst/agent/myst_agent.py /opt/myst/agent/config.json
+Restart=always
+RestartSec=10
+User=root
+[Install]
+WantedBy=multi-user.target
+EOF
+  systemctl daemon-reload
+  systemctl enable myst-agent
+  systemctl restart myst-agent
+fi
+# the panel hashes this copy to decide whether the next deploy has to upload the script at all
+if [[ "${SELF}" != "${STATE}/remote_install.sh" ]]; then install -m 0644 "${SELF}" "${STATE}/remote_install.sh"; fi
@@ -0,0 +1,13 @@
+import os, sys
+import pytest
+
+# the app modules import each other flat, as when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh, fully migrated database for the test; db_conn reconnects when DB_PATH changes."""
+    import db as db_
+    monkeypatch.setattr(db_, "DB_PATH", str(tmp_path / "manager.db"))
+    db_.db_init()
+    return db_
@@ -0,0 +1,76 @@
+import socket, threading
+import paramiko
+import pytest
+import creds
+
+class _Server(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if password == "pw" else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+@pytest.fixture
+def sshd():
+    """A local SSH server accepting password "pw"; state["key"] is its host key and can be swapped between connects."""
+    sock = socket.socket(); sock.bind(("127.0.0.1", 0)); sock.listen(8)
+    state = {"key": paramiko.RSAKey.generate(1024), "transports": []}
+    def serve():
+        while True:
+            try: conn, _ = sock.accept()
+            except OSError: return
+            t = paramiko.Transport(conn); t.add_server_key(state["key"])
+            state["transports"].append(t)
+            try: t.start_server(server=_Server())
+            except (paramiko.SSHException, EOFError): pass
+    threading.Thread(target=serve, daemon=True).start()
+    state["port"] = sock.getsockname()[1]
+    yield state
+    sock.close()
+    for t in state["transports"]: t.close()
+
+def _connect(port):
+    c = creds.client("127.0.0.1", port)
+    try: c.connect("127.0.0.1", port=port, username="root", timeout=5, **creds.connect_args("pw", None))
+    finally: c.close()
+
+@pytest.fixture(autouse=True)
+def fresh(db, monkeypatch):
+    monkeypatch.setattr(creds, "_known", None)
+
+def _stored(db, port):
+    with db.db_conn() as c:
+        r = c.execute("SELECT key FROM known_hosts WHERE host='127.0.0.1' AND port=?", (port,)).fetchone()
+    return r["key"] if r else None
+
+@pytest.mark.parametrize("policy", ["accept", "tofu"])
+def test_first_connect_remembers_key(db, sshd, monkeypatch, policy):
+    monkeypatch.setattr(creds, "HOST_KEY_POLICY", policy)
+    _connect(sshd["port"])
+    assert _stored(db, sshd["port"]) == sshd["key"].get_base64()
+
+def test_first_connect_strict_refuses_unknown_host(db, sshd, monkeypatch):
+    monkeypatch.setattr(creds, "HOST_KEY_POLICY", "strict")
+    with pytest.raises(paramiko.SSHException, match="not in known_hosts"):
+        _connect(sshd["port"])
+    assert _stored(db, sshd["port"]) is None
+
+def test_strict_accepts_known_host(db, sshd, monkeypatch):
+    monkeypatch.setattr(creds, "HOST_KEY_POLICY", "tofu")
+    _connect(sshd["port"])
+    monkeypatch.setattr(creds, "HOST_KEY_POLICY", "strict")
+    monkeypatch.setattr(creds, "_known", None)
+    _connect(sshd["port"])
+
+def test_changed_key(db, sshd, monkeypatch):
+    monkeypatch.setattr(creds, "HOST_KEY_POLICY", "tofu")
+    _connect(sshd["port"])
+    first = sshd["key"].get_base64()
+    sshd["key"] = paramiko.RSAKey.generate(1024)
+    with pytest.raises(paramiko.BadHostKeyException):
+        _connect(sshd["port"])
+    assert _stored(db, sshd["port"]) == first
+    # accept takes the new key and remembers it
+    monkeypatch.setattr(creds, "HOST_KEY_POLICY", "accept")
+    _connect(sshd["port"])
+    assert _stored(db, sshd["port"]) == sshd["key"].get_base64()
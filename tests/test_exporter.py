@@ -0,0 +1,40 @@
+import sqlite3
+import exporter
+
+def _store(db, node_id, sessions, updated):
+    # as `python -m cli collect` would: another connection, another process as far as the panel can tell
+    c = sqlite3.connect(db.DB_PATH)
+    c.execute("""INSERT INTO node_status(node_id, running, sessions, updated) VALUES(?,1,?,?)
+                 ON CONFLICT(node_id) DO UPDATE SET sessions=excluded.sessions, updated=excluded.updated""", (node_id, sessions, updated))
+    c.commit(); c.close()
+
+def test_refresh_picks_up_collection_from_another_process(db, monkeypatch):
+    monkeypatch.setattr(exporter, "METRICS_CACHE_TTL", 0)
+    with db.db_conn() as c:
+        nid = c.execute("INSERT INTO nodes(host, user) VALUES('10.0.0.1', 'root')").lastrowid
+    exporter.warm()
+    assert f'myst_node_sessions{{node_id="{nid}",host="10.0.0.1"}} 0' in exporter.render().decode()
+    _store(db, nid, 7, "2026-01-01T00:00:00")
+    exporter.refresh()
+    assert f'myst_node_sessions{{node_id="{nid}",host="10.0.0.1"}} 7' in exporter.render().decode()
+
+def test_refresh_skips_reload_when_nothing_changed(db, monkeypatch):
+    exporter.warm()
+    calls = []
+    monkeypatch.setattr(exporter, "warm", lambda: calls.append(1))
+    exporter.refresh(); exporter.refresh()
+    assert calls == []
+
+def test_render_does_not_read_the_database(db, monkeypatch):
+    monkeypatch.setattr(exporter, "METRICS_CACHE_TTL", 0)
+    exporter.warm()
+    def no_db(*a, **kw): raise AssertionError("render hit SQLite")
+    monkeypatch.setattr(exporter, "db_conn", no_db); monkeypatch.setattr(exporter, "get_setting", no_db)
+    exporter.render(); exporter.render()
+
+def test_family_types(db):
+    exporter.warm()
+    text = exporter.render().decode()
+    assert "# TYPE myst_node_bytes_total counter" in text
+    # Prometheus reserves _total for counters
+    assert all(l.split()[3] == "counter" for l in text.splitlines() if l.startswith("# TYPE") and l.split()[2].endswith("_total"))
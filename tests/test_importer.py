@@ -0,0 +1,77 @@
+import io, json
+import pytest
+import importer
+
+def _run(doc, fmt="json"):
+    data = doc if isinstance(doc, bytes) else (json.dumps(doc) if fmt == "json" else doc).encode()
+    return importer.run(io.BytesIO(data), fmt)
+
+def _nodes(db):
+    with db.db_conn() as c:
+        return [dict(r) for r in c.execute("SELECT id, host, port, user, wallet_id, notes FROM nodes ORDER BY id")]
+
+def _split_at_edge(head, number, tail):
+    # pad `head` so the digits of `number` run across the first 64 KiB read
+    digits = str(number)
+    pad = (1 << 16) - len(head.format("")) - len(digits) // 2
+    return head.format("x" * pad) + digits + tail
+
+def test_number_split_at_chunk_edge():
+    text = _split_at_edge('{{"nodes": [{{"host": "10.0.0.1", "notes": "{}"}}], "version": ', 123456, "}")
+    assert text.index("123456") < 1 << 16 < text.index("123456") + 6
+    items = list(importer.iter_json(io.StringIO(text)))
+    assert items[-1] == ("version", 123456)
+
+def test_port_split_at_chunk_edge(db):
+    text = _split_at_edge('{{"nodes": [{{"host": "10.0.0.1", "notes": "{}", "port": ', 2222, "}]}")
+    report = _run(text.encode())
+    assert report["inserted"] == 1 and report["rejected"] == 0
+    assert _nodes(db)[0]["port"] == 2222
+
+def test_duplicate_host_port_user_is_updated(db):
+    first = _run({"nodes": [{"host": "10.0.0.1", "port": 22, "user": "root", "notes": "a"}]})
+    assert (first["inserted"], first["updated"]) == (1, 0)
+    again = _run({"nodes": [{"host": "10.0.0.1", "port": 22, "user": "root", "notes": "b"},
+                            {"host": "10.0.0.1", "port": 2222, "user": "root"}]})
+    assert (again["inserted"], again["updated"]) == (1, 1)
+    rows = _nodes(db)
+    assert [(r["port"], r["notes"]) for r in rows] == [(22, "b"), (2222, None)]
+
+def test_rejected_rows_are_reported(db):
+    csv = ("host,port,user,auth\n"
+           "10.0.0.1,22,root,key\n"
+           ",22,root,key\n"
+           "10.0.0.3,70000,root,key\n"
+           "10.0.0.4,22,root,telnet\n"
+           "10.0.0.5,22,root,password\n")
+    report = _run(csv, "csv")
+    assert (report["inserted"], report["rejected"]) == (2, 3)
+    assert [e["row"] for e in report["errors"]] == [2, 3, 4]
+    assert "host is required" in report["errors"][0]["error"]
+    assert "port out of range" in report["errors"][1]["error"]
+    assert [r["host"] for r in _nodes(db)] == ["10.0.0.1", "10.0.0.5"]
+
+def test_malformed_json_rolls_everything_back(db):
+    doc = json.dumps({"wallets": [{"id": 1, "address": "0x" + "1" * 40}],
+                      "nodes": [{"host": f"10.0.{i // 256}.{i % 256}"} for i in range(importer.IMPORT_BATCH + 5)]})
+    # the first batch of nodes has been upserted by the time the truncation is found
+    with pytest.raises(ValueError, match="malformed JSON"):
+        _run(doc[:-20].encode())
+    with db.db_conn() as c:
+        assert c.execute("SELECT COUNT(*) FROM nodes").fetchone()[0] == 0
+        assert c.execute("SELECT COUNT(*) FROM wallets").fetchone()[0] == 0
+
+@pytest.mark.parametrize("nodes_first", [False, True])
+def test_wallet_ids_are_remapped(db, nodes_first):
+    local, mine, theirs = "0x" + "a" * 40, "0x" + "b" * 40, "0x" + "c" * 40
+    with db.db_conn() as c:
+        c.execute("INSERT INTO wallets(label, address) VALUES('local', ?)", (local,))
+        kept = c.execute("INSERT INTO wallets(label, address) VALUES('mine', ?)", (mine,)).lastrowid
+    wallets = [{"id": 1, "label": "theirs", "address": theirs}, {"id": 7, "label": "mine", "address": mine.upper().replace("0X", "0x")}]
+    nodes = [{"host": "10.0.0.1", "wallet_id": 1}, {"host": "10.0.0.2", "wallet_id": 7}]
+    report = _run(dict([("nodes", nodes), ("wallets", wallets)] if nodes_first else [("wallets", wallets), ("nodes", nodes)]))
+    assert report["wallets"] == {"inserted": 1, "matched": 1}
+    with db.db_conn() as c:
+        added = c.execute("SELECT id FROM wallets WHERE address=?", (theirs,)).fetchone()[0]
+    # file wallet 1 is a new wallet here, not the local wallet that happens to have id 1
+    assert [r["wallet_id"] for r in _nodes(db)] == [added, kept]
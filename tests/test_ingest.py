@@ -0,0 +1,21 @@
+from datetime import datetime
+import pytest
+import ingest
+
+NODE = {"id": 1, "host": "10.0.0.1", "capacity_mbps": None}
+
+@pytest.mark.parametrize("rc", [None, "0", 1.5, True, [0]])
+def test_malformed_rc_is_rejected(rc):
+    with pytest.raises(ValueError, match="rc must be an integer"):
+        ingest.to_result(NODE, {"data": {"docker": {"rc": rc, "out": ""}}}, datetime.utcnow())
+
+def test_missing_rc_counts_as_failed_section():
+    r = ingest.to_result(NODE, {"data": {"docker": {"out": ""}}}, datetime.utcnow())
+    assert r["status"] == "failed"
+
+def test_handle_rejects_bad_sample_with_value_error(db, monkeypatch):
+    with db.db_conn() as c:
+        nid = c.execute("INSERT INTO nodes(host, user) VALUES('10.0.0.1', 'root')").lastrowid
+    token = ingest.issue_token(nid)
+    with pytest.raises(ValueError):
+        ingest.handle(token, b'{"samples": [{"data": {"docker": {"rc": null}}}]}')
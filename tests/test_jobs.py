@@ -0,0 +1,49 @@
+import asyncio, threading, time
+import jobs
+
+def _other_worker_job(db):
+    # a job row as another worker creates it: not in this process's _live map
+    with db.db_conn() as c:
+        jid = c.execute("INSERT INTO jobs(kind, state, created, owner) VALUES('deploy', 'queued', '', 'other')").lastrowid
+    return jid, jobs.Job(jid)
+
+def _lines(n, delay=0.0):
+    def fn(job):
+        for i in range(n):
+            job.write(f"line {i}\n")
+            if delay: time.sleep(delay)
+        return True
+    return fn
+
+def test_flush_appends_only_new_output(db, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LOG_FLUSH", 1e-9)
+    jid, job = _other_worker_job(db)
+    for i in range(200): job.write(f"line {i}\n")
+    with db.db_conn() as c:
+        stored = sum(len(r["text"]) for r in c.execute("SELECT text FROM job_log WHERE job_id=?", (jid,)))
+    # each flush carries only its own chunks, so the database holds the log once, not once per flush
+    assert stored == len(job.text())
+    assert jobs.full_log(jid) == job.text()
+
+def test_finished_job_folds_chunks_into_log(db, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LOG_FLUSH", 1e-9)
+    jid, job = _other_worker_job(db)
+    assert jobs._run(job, _lines(50))
+    with db.db_conn() as c:
+        assert c.execute("SELECT COUNT(*) FROM job_log WHERE job_id=?", (jid,)).fetchone()[0] == 0
+    assert jobs.full_log(jid) == "".join(f"line {i}\n" for i in range(50))
+
+def test_stream_follows_job_in_another_worker(db, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LOG_FLUSH", 0.02)
+    jid, job = _other_worker_job(db)
+    t = threading.Thread(target=jobs._run, args=(job, _lines(40, 0.005)))
+    t.start()
+    async def collect():
+        return [ev async for ev in jobs.stream(jid, poll=0.01)]
+    events = asyncio.run(collect())
+    t.join()
+    data = "".join(ev for ev in events if not ev.startswith("event: end"))
+    text = "\n".join(line[6:] for line in data.split("\n") if line.startswith("data: "))
+    assert text.replace("\n", "") == "".join(f"line {i}" for i in range(40))
+    assert len(events) > 2  # output arrived while the job ran, not only at the end
+    assert events[-1] == "event: end\ndata: succeeded\n\n"
@@ -0,0 +1,34 @@
+import threading, time
+import jobs, rollout
+
+def _wait(cond, timeout=10):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.02)
+
+def test_resume_waits_for_paused_coordinator(db, monkeypatch):
+    with db.db_conn() as c:
+        ids = [c.execute("INSERT INTO nodes(host, user) VALUES(?, 'root')", (f"10.0.0.{i}",)).lastrowid for i in range(3)]
+    deployed, gate = [], threading.Event()
+    def for_node(n, mgmt_ip, agent_url=None):
+        def fn(job):
+            deployed.append(n["id"]); gate.wait(10)
+            return True
+        return fn
+    monkeypatch.setattr(rollout.deployer, "for_node", for_node)
+    monkeypatch.setattr(rollout.deployer, "is_running", lambda node_id: False)
+
+    rid = rollout.create(ids, {}, "127.0.0.1", canary=0, wave_size=3, concurrency=1)
+    _wait(lambda: deployed)
+    assert rollout.pause(rid)
+    # the first deploy is still in flight: a second coordinator would start the same wave again
+    assert not rollout.resume(rid)
+    gate.set()
+    first = rollout.get(rid)["job_id"]
+    _wait(lambda: jobs.get(first)["state"] not in ("queued", "running"))
+    assert rollout.get(rid)["state"] == "paused"
+    assert rollout.resume(rid)
+    _wait(lambda: rollout.get(rid)["state"] == "succeeded")
+    assert sorted(deployed) == ids
+    assert {n["state"] for n in rollout.progress(rid)["nodes"]} == {"succeeded"}
@@ -0,0 +1,124 @@
+import os, sys, json, shlex
+import pytest
+import ufw
+
+# A stand-in for ufw: rules live in a JSON file, every call is logged, and FAIL makes any call containing it exit 1.
+FAKE = r'''
+import os, sys, json
+state_path, log_path = os.environ["FAKE_UFW_STATE"], os.environ["FAKE_UFW_LOG"]
+st = json.load(open(state_path))
+args = sys.argv[1:]
+with open(log_path, "a") as f: f.write(" ".join(args) + "\n")
+fail = os.environ.get("FAKE_UFW_FAIL")
+if fail and fail in " ".join(args):
+    print("ERROR: could not apply", file=sys.stderr); sys.exit(1)
+def to(r): return f"{r['port']}/{r['proto']}" if r["proto"] != "any" else str(r["port"])
+def rule(words):
+    # from SRC to any port P [proto X]
+    return {"src": words[1], "port": int(words[5]), "proto": words[7] if len(words) > 7 else "any"}
+if args == ["status", "numbered"]:
+    if not st["active"]: print("Status: inactive")
+    else:
+        print("Status: active\n\n     To                         Action      From\n     --                         ------      ----")
+        for i, r in enumerate(st["rules"], 1):
+            print(f"[{i:2}] {to(r):<26} ALLOW IN    {'Anywhere' if r['src'] == 'any' else r['src']}")
+elif args == ["show", "added"]:
+    print("Added user rules (see 'ufw status' for running firewall):")
+    for r in st["rules"]:
+        print(f"ufw allow from {r['src']} to any port {r['port']}" + (f" proto {r['proto']}" if r["proto"] != "any" else ""))
+elif args[0] == "allow":
+    if rule(args[1:]) not in st["rules"]: st["rules"].append(rule(args[1:]))
+elif args[:2] == ["delete", "allow"]:
+    st["rules"].remove(rule(args[2:]))
+elif args == ["--force", "enable"]:
+    st["active"] = True
+elif args[0] != "default":
+    sys.exit(2)
+json.dump(st, open(state_path, "w"))
+'''
+
+ADMIN = "10.9.9.9"
+PANEL = 8080
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    script = tmp_path / "ufw"
+    script.write_text(f"#!{sys.executable}\n" + FAKE); script.chmod(0o755)
+    state, log = tmp_path / "state.json", tmp_path / "calls.log"
+    monkeypatch.setattr(ufw, "UFW_BIN", str(script))
+    monkeypatch.setenv("FAKE_UFW_STATE", str(state)); monkeypatch.setenv("FAKE_UFW_LOG", str(log))
+    class Fake:
+        def set(self, active, rules):
+            state.write_text(json.dumps({"active": active, "rules": [dict(zip(("port", "proto", "src"), r)) for r in rules]}))
+            log.write_text("")
+        def rules(self):
+            return sorted((r["port"], r["proto"], r["src"]) for r in json.loads(state.read_text())["rules"])
+        def active(self):
+            return json.loads(state.read_text())["active"]
+        def calls(self):
+            return [shlex.split(l) for l in log.read_text().splitlines()]
+        def fail_on(self, text):
+            monkeypatch.setenv("FAKE_UFW_FAIL", text)
+    return Fake()
+
+ACL = [{"id": 1, "port": 4449, "proto": "tcp", "cidr": "192.0.2.0/24", "enabled": 1},
+       {"id": 2, "port": 51820, "proto": "udp", "cidr": "0.0.0.0/0", "enabled": 1},
+       {"id": 3, "port": 9000, "proto": "tcp", "cidr": "198.51.100.7", "enabled": 0}]
+WANTED = [(22, "tcp", ADMIN), (4449, "tcp", "192.0.2.0/24"), (PANEL, "tcp", ADMIN), (51820, "udp", "any")]
+
+def test_enables_inactive_firewall_with_acl_rules(fake):
+    fake.set(False, [])
+    res = ufw.reconcile(ACL, ADMIN, PANEL)
+    assert res["ok"] and not res["errors"] and res["applied"] == 4
+    assert fake.rules() == WANTED and fake.active()
+    # rules first, enable last, so the admin's SSH rule exists before the firewall comes up
+    assert fake.calls()[-1] == ["--force", "enable"]
+
+def test_second_run_is_a_no_op(fake):
+    fake.set(False, [])
+    ufw.reconcile(ACL, ADMIN, PANEL)
+    fake.set(True, [(p, proto, src) for p, proto, src in WANTED])
+    res = ufw.reconcile(ACL, ADMIN, PANEL)
+    assert res["ok"] and res["commands"] == [] and res["applied"] == 0 and res["keep"] == 4
+    assert fake.calls() == [["status", "numbered"]]
+
+def test_adds_then_deletes_stale_rules(fake):
+    # 9000/tcp is disabled in the acl; 3306/tcp is not managed by the panel and stays
+    fake.set(True, [(22, "tcp", ADMIN), (PANEL, "tcp", ADMIN), (9000, "tcp", "198.51.100.7"), (3306, "tcp", "any")])
+    res = ufw.reconcile(ACL, ADMIN, PANEL)
+    assert res["ok"] and res["applied"] == 3
+    assert fake.rules() == sorted(WANTED + [(3306, "tcp", "any")])
+    verbs = [c[0] for c in fake.calls()[1:]]
+    assert verbs == ["allow", "allow", "delete"]
+
+def test_failing_add_rolls_back(fake):
+    before = [(22, "tcp", ADMIN), (PANEL, "tcp", ADMIN), (9000, "tcp", "198.51.100.7")]
+    fake.set(True, before)
+    fake.fail_on("port 51820")
+    res = ufw.reconcile(ACL, ADMIN, PANEL)
+    assert not res["ok"] and res["rolled_back"]
+    assert any("51820" in e for e in res["errors"])
+    # the 4449 rule that went in first is taken out again, and the stale rule was never deleted
+    assert fake.rules() == sorted(before)
+    assert ["delete", "allow", "from", "192.0.2.0/24", "to", "any", "port", "4449", "proto", "tcp"] in fake.calls()
+
+def test_failing_delete_restores_earlier_deletes_and_adds(fake):
+    before = [(22, "tcp", ADMIN), (PANEL, "tcp", ADMIN), (9000, "tcp", "198.51.100.7"), (51820, "udp", "203.0.113.1"),
+              (51820, "udp", "any")]
+    fake.set(True, before)
+    fake.fail_on("delete allow from 203.0.113.1")
+    res = ufw.reconcile(ACL, ADMIN, PANEL)
+    assert not res["ok"] and res["rolled_back"]
+    assert fake.rules() == sorted(before)
+
+def test_dry_run_changes_nothing(fake):
+    fake.set(False, [])
+    res = ufw.reconcile(ACL, ADMIN, PANEL, dry_run=True)
+    assert res["ok"] and len(res["commands"]) == 7 and res["applied"] == 0
+    assert fake.rules() == [] and not fake.active()
+    assert fake.calls() == [["status", "numbered"], ["show", "added"]]
+
+def test_unreadable_status_raises(fake, monkeypatch):
+    monkeypatch.setattr(ufw, "UFW_BIN", os.path.join(os.path.dirname(ufw.UFW_BIN), "missing"))
+    with pytest.raises(ufw.UfwError):
+        ufw.reconcile(ACL, ADMIN, PANEL)